@@ -1,46 +1,154 @@
 from gevent import monkey  # type: ignore
 monkey.patch_all()  # Add this at the very top of the file, before other imports
+from gevent_psycopg import patch_psycopg
+patch_psycopg()  # psycopg2 is a C extension, make it yield to the hub explicitly
 
+import os
 import ssl 
 import uuid
 import logging
+import time
+import argparse
+import threading
 import multiprocessing
-from flask import Flask, request, jsonify # type: ignore
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context # type: ignore
 from flask_caching import Cache # type: ignore
-from psycopg2.extras import RealDictCursor # type: ignore
 from gevent.pywsgi import WSGIServer # type: ignore
-from psycopg2.pool import ThreadedConnectionPool  #type: ignore
 from datetime import datetime
+from db_pool import BoundedConnectionPool, PoolTimeout
+import metrics
+import request_logging
+import profiler
+from cluster_groups import distinct_city_ids, group_by_city, group_clusters, parse_ranking, valid_location
+from storage import MemoryStorage, PostgisStorage
+from poi_grid import MAX_LEVEL, MIN_LEVEL, aligned_bbox, cell_bounds, cell_plan, cell_range, cell_size, level_for_bbox
 
 app = Flask(__name__)
 app.config['DEBUG'] = True
 
-app.config['CACHE_TYPE'] = 'simple'
+app.config['CACHE_TYPE'] = 'SimpleCache'
 cache = Cache(app)
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, filename='app.log', filemode='a',
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+# Configure logging: JSON lines written by a background thread, see request_logging.py
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 1.0))  # Share of requests whose INFO logs are kept
+request_logging.configure_logging('app.log', level=LOG_LEVEL)
+request_logging.install(app, sample_rate=LOG_SAMPLE_RATE)
 
-db_pool = ThreadedConnectionPool(
-    minconn=10,      # Minimum number of connections
-    maxconn=100,     # Maximum number of connections
-    dsn="dbname=osm_points user=postgres"
-)
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 10))          # Connections opened at startup
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 100))         # Connection budget shared by all workers
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5)) # Seconds a request waits for a free connection
+
+# Created per process on first use, so pre-forked workers never share connections
+db_pool = None
+db_pool_lock = threading.Lock()
+
+def configure_db_pool(maxconn=DB_POOL_MAX):
+    global db_pool
+    db_pool = BoundedConnectionPool(
+        dsn="dbname=osm_points user=postgres",
+        minconn=min(DB_POOL_MIN, maxconn),
+        maxconn=maxconn,
+        timeout=DB_POOL_TIMEOUT,
+    )
+    return db_pool
+
+def get_db_pool():
+    if db_pool is None:
+        with db_pool_lock:
+            if db_pool is None:
+                configure_db_pool()
+    return db_pool
+
+# Optional memory-mapped POI snapshot (see poi_snapshot.py); when set, /api/points
+# is answered from it without touching the database
+POI_SNAPSHOT = os.environ.get('POI_SNAPSHOT')
+poi_snapshot = None
+if POI_SNAPSHOT:
+    from poi_snapshot import PoiSnapshot
+    poi_snapshot = PoiSnapshot(POI_SNAPSHOT)
 
 def get_db_connection():
-    return db_pool.getconn()
+    start = time.perf_counter()
+    conn = get_db_pool().getconn()
+    metrics.record_pool_wait(time.perf_counter() - start)
+    return conn
 
 def return_db_connection(conn):
-    db_pool.putconn(conn)
+    get_db_pool().putconn(conn)
+
+# Data access, see storage.py: 'postgis' (default) or 'memory' for a synthetic
+# in-process dataset, to benchmark request handling without a database
+NEAR_STORAGE = os.environ.get('NEAR_STORAGE', 'postgis')
+if NEAR_STORAGE == 'memory':
+    storage = MemoryStorage.synthetic(
+        num_cities=int(os.environ.get('SYNTHETIC_CITIES', 50)),
+        num_points=int(os.environ.get('SYNTHETIC_POINTS', 1000000)),
+        seed=int(os.environ.get('SYNTHETIC_SEED', 0)),
+    )
+else:
+    storage = PostgisStorage(get_db_connection, return_db_connection)
+
+def pool_timeout_response(e):
+    logging.warning("Connection pool exhausted: %s", e)
+    return jsonify({'error': 'Server busy, please retry'}), 503
+
+# Per-route counters and latency histograms at /metrics
+metrics.install(app, pool_stats=(lambda: get_db_pool().stats()) if NEAR_STORAGE != 'memory' else None)
+
+# Server-Timing header with per-phase durations on every response
+metrics.server_timing = os.environ.get('SERVER_TIMING', '0') == '1'
+
+# EXPLAIN (ANALYZE, BUFFERS) a sample of the queries slower than SLOW_QUERY_MS into slow_queries.log
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 0))  # 0 disables the capture
+SLOW_QUERY_SAMPLE = float(os.environ.get('SLOW_QUERY_SAMPLE', 0.1))
+if SLOW_QUERY_MS > 0:
+    from slow_queries import SlowQueryLog
+    metrics.slow_query_log = SlowQueryLog(
+        "dbname=osm_points user=postgres", SLOW_QUERY_MS, SLOW_QUERY_SAMPLE,
+        path=os.environ.get('SLOW_QUERY_LOG', 'slow_queries.log'),
+    )
+
+# /api/density maps a map zoom to the poi_grid level DENSITY_ZOOM_OFFSET levels finer
+# (32 cells across a tile by default), and coarsens it until the bbox spans at most
+# DENSITY_MAX_CELLS cells
+DENSITY_ZOOM_OFFSET = int(os.environ.get('DENSITY_ZOOM_OFFSET', 5))
+DENSITY_MAX_CELLS = int(os.environ.get('DENSITY_MAX_CELLS', 65536))
+
+# /api/cell_plan splits quadtree cells until each holds at most maxPoints POIs
+# (default CELL_PLAN_MAX_POINTS), down to the level where the bbox spans
+# CELL_PLAN_CELLS_PER_SIDE cells
+CELL_PLAN_MAX_POINTS = int(os.environ.get('CELL_PLAN_MAX_POINTS', 2000))
+CELL_PLAN_CELLS_PER_SIDE = int(os.environ.get('CELL_PLAN_CELLS_PER_SIDE', 256))
+
+# Prebuilt region packages (see export_region.py) served at /api/regions, unset to disable
+REGION_PACKAGE_DIR = os.environ.get('REGION_PACKAGE_DIR')
+REGION_PACKAGE_MAX_AGE = int(os.environ.get('REGION_PACKAGE_MAX_AGE', 86400))  # Seconds clients may reuse a package
+
+# Locations one POST /api/clusters request may send
+CLUSTERS_MAX_LOCATIONS = int(os.environ.get('CLUSTERS_MAX_LOCATIONS', 100))
+
+# Location pairs one POST /api/clusters/batch request may send
+CLUSTERS_BATCH_MAX_PAIRS = int(os.environ.get('CLUSTERS_BATCH_MAX_PAIRS', 1000))
+
+# Cells one /api/sync request may ask about
+SYNC_MAX_CELLS = int(os.environ.get('SYNC_MAX_CELLS', 500))
+
+# Sampling profiler at /api/admin/profile, only reachable with the X-Admin-Token header
+profiler.install(app, os.environ.get('ADMIN_TOKEN'))
 
 @app.route('/favicon.ico')
 def favicon():
     return '', 204 
 
+@app.route('/api/pool/stats', methods=['GET'])
+def get_pool_stats():
+    if NEAR_STORAGE == 'memory':
+        return jsonify({'error': 'No database pool with in-memory storage'}), 404
+    return jsonify(get_db_pool().stats())
+
 @app.route('/api/points', methods=['GET'])
 def get_points_in_bbox():
-    conn = None
     try:
         # Get parameters from query string
         min_lon = float(request.args.get('minLon'))
@@ -48,36 +156,32 @@ def get_points_in_bbox():
         max_lon = float(request.args.get('maxLon'))
         max_lat = float(request.args.get('maxLat'))
         
-        # Get connection from pool
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        # cur.execute("SET enable_seqscan = off")
-    
-        # Query points within bbox
-        cur.execute("""
-            SELECT id, 
-                ST_X(geom) as longitude,
-                ST_Y(geom) as latitude
-            FROM osm_points
-            WHERE geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
-        """, (min_lon, min_lat, max_lon, max_lat))
+        if poi_snapshot is not None:
+            ids, lons, lats = poi_snapshot.query_bbox(min_lon, min_lat, max_lon, max_lat)
+            points = [
+                {'id': point_id, 'longitude': lon, 'latitude': lat}
+                for point_id, lon, lat in zip(ids.tolist(), lons.tolist(), lats.tolist())
+            ]
+            return jsonify({
+                'count': len(points),
+                'points': points
+            })
         
-        points = cur.fetchall()
-        cur.close()
+        # Query points within bbox
+        with storage.session() as db:
+            points = db.points_in_bbox(min_lon, min_lat, max_lon, max_lat)
         
         return jsonify({
             'count': len(points),
             'points': points
         })
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 400
-    finally:
-        if conn:
-            return_db_connection(conn)  # Return connection to pool
 
 @app.route('/api/cities', methods=['GET'])
 def get_cities_in_bbox():
-    conn = None
     try:
         # Get parameters from query string
         min_lon = float(request.args.get('minLon'))
@@ -90,23 +194,9 @@ def get_cities_in_bbox():
                 -180 <= max_lon <= 180 and -90 <= max_lat <= 90):
             return jsonify({'error': 'Invalid coordinates. Longitude must be between -180 and 180, latitude between -90 and 90.'}), 400
         
-        # Get connection from pool
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
         # Query cities that intersect with the bbox using the spatial index
-        cur.execute("""
-            SELECT 
-                id, 
-                name,
-                ST_AsGeoJSON(geom) as geometry
-            FROM cities
-            WHERE geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
-            ORDER BY name
-        """, (min_lon, min_lat, max_lon, max_lat))
-        
-        cities = cur.fetchall()
-        cur.close()
+        with storage.session() as db:
+            cities = db.cities_in_bbox(min_lon, min_lat, max_lon, max_lat)
         
         return jsonify({
             'count': len(cities),
@@ -118,143 +208,295 @@ def get_cities_in_bbox():
             },
             'cities': cities
         })
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
+    except Exception as e:
+        logging.error("Error in get_cities_in_bbox: %s", e)
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/density', methods=['GET'])
+def get_density():
+    try:
+        # Get parameters from query string
+        min_lon = float(request.args.get('minLon'))
+        min_lat = float(request.args.get('minLat'))
+        max_lon = float(request.args.get('maxLon'))
+        max_lat = float(request.args.get('maxLat'))
+        
+        # Validate coordinates
+        if not (-180 <= min_lon <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90):
+            return jsonify({'error': 'Invalid bbox. Longitude must be between -180 and 180, latitude between -90 and 90, min before max.'}), 400
+        
+        # Pick the pyramid level from the zoom, or from the cells wanted across the bbox
+        if 'zoom' in request.args:
+            level = int(request.args.get('zoom')) + DENSITY_ZOOM_OFFSET
+        else:
+            level = level_for_bbox(min_lon, min_lat, max_lon, max_lat, int(request.args.get('cellsPerSide', 64)))
+        level = max(MIN_LEVEL, min(MAX_LEVEL, level))
+        while level > MIN_LEVEL:
+            x0, y0, x1, y1 = cell_range(level, min_lon, min_lat, max_lon, max_lat)
+            if (x1 - x0 + 1) * (y1 - y0 + 1) <= DENSITY_MAX_CELLS:
+                break
+            level -= 1
+        
+        with storage.session() as db:
+            cells = db.cell_counts(level, min_lon, min_lat, max_lon, max_lat)
+        
+        return jsonify({
+            'count': len(cells),
+            'total': sum(cell['point_count'] for cell in cells),
+            'level': level,
+            'cellSize': cell_size(level),
+            'cells': cells
+        })
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
+    except Exception as e:
+        logging.error("Error in get_density: %s", e)
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/cell_plan', methods=['GET'])
+def get_cell_plan():
+    try:
+        # Get parameters from query string
+        min_lon = float(request.args.get('minLon'))
+        min_lat = float(request.args.get('minLat'))
+        max_lon = float(request.args.get('maxLon'))
+        max_lat = float(request.args.get('maxLat'))
+        max_points = int(request.args.get('maxPoints', CELL_PLAN_MAX_POINTS))
+        
+        # Validate coordinates
+        if not (-180 <= min_lon <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90):
+            return jsonify({'error': 'Invalid bbox. Longitude must be between -180 and 180, latitude between -90 and 90, min before max.'}), 400
+        if max_points < 1:
+            return jsonify({'error': 'maxPoints must be positive'}), 400
+        
+        # One read of the finest level; the coarser counts are merged from it.
+        # The start cells reach past the bbox, so read all of them
+        fine_level = level_for_bbox(min_lon, min_lat, max_lon, max_lat, CELL_PLAN_CELLS_PER_SIDE)
+        start_level = min(fine_level, level_for_bbox(min_lon, min_lat, max_lon, max_lat, 2))
+        with storage.session() as db:
+            cells = db.cell_counts(fine_level, *aligned_bbox(start_level, min_lon, min_lat, max_lon, max_lat))
+        counts = {(cell['cell_x'], cell['cell_y']): cell['point_count'] for cell in cells}
+        
+        plan = []
+        for level, x, y, count in cell_plan(counts, fine_level, start_level, max_points,
+                                            min_lon, min_lat, max_lon, max_lat):
+            cell_min_lon, cell_min_lat, cell_max_lon, cell_max_lat = cell_bounds(level, x, y)
+            plan.append({
+                'level': level,
+                'cell_x': x,
+                'cell_y': y,
+                'point_count': count,
+                'minLon': cell_min_lon,
+                'minLat': cell_min_lat,
+                'maxLon': cell_max_lon,
+                'maxLat': cell_max_lat
+            })
+        
+        return jsonify({
+            'count': len(plan),
+            'total': sum(cell['point_count'] for cell in plan),
+            'maxPoints': max_points,
+            'cells': plan
+        })
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
+    except Exception as e:
+        logging.error("Error in get_cell_plan: %s", e)
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/regions', methods=['GET'])
+def list_region_packages():
+    if not REGION_PACKAGE_DIR or not os.path.isdir(REGION_PACKAGE_DIR):
+        return jsonify({'error': 'No region packages available'}), 404
+    regions = []
+    for filename in sorted(os.listdir(REGION_PACKAGE_DIR)):
+        if not filename.endswith('.gpkg.gz'):
+            continue
+        st = os.stat(os.path.join(REGION_PACKAGE_DIR, filename))
+        regions.append({
+            'name': filename[:-len('.gpkg.gz')],
+            'size': st.st_size,
+            'updated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(st.st_mtime))
+        })
+    return jsonify({'count': len(regions), 'regions': regions})
+
+@app.route('/api/regions/<name>', methods=['GET'])
+def download_region_package(name):
+    if not REGION_PACKAGE_DIR:
+        return jsonify({'error': 'No region packages available'}), 404
+    # send_from_directory rejects names escaping the directory; ETag and
+    # If-None-Match / Range handling come with conditional responses
+    return send_from_directory(REGION_PACKAGE_DIR, f"{name}.gpkg.gz", mimetype='application/gzip',
+                               as_attachment=True, conditional=True, max_age=REGION_PACKAGE_MAX_AGE)
+
+def parse_cell(cell):
+    """A client cell as [lon, lat] or its "lon,lat" key (GridCell.getKey)."""
+    if isinstance(cell, str):
+        cell = cell.split(',')
+    x, y = cell
+    return int(x), int(y)
+
+@app.route('/api/sync', methods=['POST'])
+def sync_cells():
+    try:
+        data = request.get_json()
+        grid_size = float(data.get('gridSize', 0.005))
+        since = int(data['since'])
+        cells = [parse_cell(cell) for cell in data['cells']]
+        
+        if grid_size <= 0:
+            return jsonify({'error': 'gridSize must be positive'}), 400
+        if len(cells) > SYNC_MAX_CELLS:
+            return jsonify({'error': f'Too many cells: {len(cells)} > {SYNC_MAX_CELLS}'}), 400
+        
+        with storage.session() as db:
+            # Only versions up to the committed watermark: later ones may still
+            # have lower-numbered writes in flight
+            version, pruned_through = db.sync_state()
+            if since < pruned_through:
+                return jsonify({
+                    'error': 'Changes this old are no longer kept, download the cells again',
+                    'prunedThrough': pruned_through,
+                    'version': version
+                }), 410
+            upserted, deleted = db.changes_in_cells(grid_size, cells, since, version)
+        
+        # Clients apply deleted before upserted: a moved point is in both
+        return jsonify({
+            'since': since,
+            'version': version,
+            'count': len(upserted) + len(deleted),
+            'upserted': upserted,
+            'deleted': deleted
+        })
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
     except Exception as e:
-        logging.error(f"Error in get_cities_in_bbox: {str(e)}")
+        logging.error("Error in sync_cells: %s", e)
         return jsonify({'error': str(e)}), 400
-    finally:
-        if conn:
-            return_db_connection(conn)  # Return connection to pool
+
+def clusters_near(db, locations, top=None, score='max'):
+    """Response body with the clusters of the cities nearest to the (lon, lat) locations.
+
+    With top set, only the `top` fairest meeting points for the group,
+    see fair_ranking.py.
+    """
+    # Find the nearest cities that have clusters
+    logging.info("Finding nearest cities with clusters for %d points", len(locations))
+    with metrics.phase('nearest_city'):
+        cities = db.nearest_cities_with_clusters(locations)
+    
+    # Get clusters for these cities, once per distinct city
+    with metrics.phase('clusters'):
+        clusters_by_city = clusters_of_cities(db, cities)
+    
+    if cities:
+        logging.info("Found cities: %s", [city['name'] for city in cities])
+    return group_clusters(locations, cities, clusters_by_city, top, score, metrics.phase)
+
+def clusters_of_cities(db, cities):
+    """{city id: clusters} for the distinct cities among the rows, in one query."""
+    city_ids = distinct_city_ids(cities)
+    return group_by_city(city_ids, db.clusters_for_cities(city_ids) if city_ids else [])
 
 @app.route('/api/clusters', methods=['GET'])
 def get_clusters_for_locations():
-    conn = None
     try:
         # Get parameters from query string
         lon1 = float(request.args.get('lon1'))
         lat1 = float(request.args.get('lat1'))
         lon2 = float(request.args.get('lon2'))
         lat2 = float(request.args.get('lat2'))
+        # Optional ranking: only the `top` fairest meeting points, see fair_ranking.py
+        top, score = parse_ranking(request.args)
         
         # Validate coordinates
-        if not (-180 <= lon1 <= 180 and -90 <= lat1 <= 90 and -180 <= lon2 <= 180 and -90 <= lat2 <= 90):
+        if not (valid_location(lon1, lat1) and valid_location(lon2, lat2)):
             return jsonify({'error': 'Invalid coordinates. Longitude must be between -180 and 180, latitude between -90 and 90.'}), 400
         
-        # Get connection from pool
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Find the nearest cities that have clusters - optimized approach
-        logging.info("Finding nearest cities with clusters for points")
-        
-        cur.execute("""
-            WITH 
-            point1 AS (
-                SELECT ST_SetSRID(ST_MakePoint(%s, %s), 4326) AS geom
-            ),
-            point2 AS (
-                SELECT ST_SetSRID(ST_MakePoint(%s, %s), 4326) AS geom
-            ),
-            nearest_to_point1 AS (
-                SELECT 
-                    c.id,
-                    c.name,
-                    ST_Distance(c.geom::geography, p.geom::geography) as distance,
-                    'point1' as point_source
-                FROM cities c, point1 p
-                WHERE EXISTS (SELECT 1 FROM poi_clusters pc WHERE pc.city_id = c.id)
-                ORDER BY c.geom <-> p.geom
-                LIMIT 1
-            ),
-            nearest_to_point2 AS (
-                SELECT 
-                    c.id,
-                    c.name,
-                    ST_Distance(c.geom::geography, p.geom::geography) as distance,
-                    'point2' as point_source
-                FROM cities c, point2 p
-                WHERE EXISTS (SELECT 1 FROM poi_clusters pc WHERE pc.city_id = c.id)
-                ORDER BY c.geom <-> p.geom
-                LIMIT 1
-            )
-            SELECT * FROM nearest_to_point1
-            UNION ALL
-            SELECT * FROM nearest_to_point2
-        """, (lon1, lat1, lon2, lat2))
-        
-        cities = cur.fetchall()
-        
-        if not cities:
-            # If no cities, return empty response
-            return jsonify({
-                'count': 0,
-                'message': 'No cities found near the specified locations',
-                'clusters': []
-            })
+        with storage.session() as db:
+            response = clusters_near(db, [(lon1, lat1), (lon2, lat2)], top, score)
         
-        # Log the cities found
-        city_names = [city['name'] for city in cities]
-        logging.info(f"Found cities: {', '.join(city_names)}")
-        
-        # Get city IDs (remove duplicates)
-        city_ids = list(set([city['id'] for city in cities]))
-        city_names = list(set(city_names))
-        
-        # Get clusters for these cities
-        placeholders = ','.join(['%s'] * len(city_ids))
-        query = f"""
-            SELECT 
-                pc.id,
-                pc.city_id,
-                c.name as city_name,
-                pc.cluster_id,
-                pc.point_count,
-                ST_X(pc.geom) as longitude,
-                ST_Y(pc.geom) as latitude
-            FROM poi_clusters pc
-            JOIN cities c ON pc.city_id = c.id
-            WHERE pc.city_id IN ({placeholders})
-            ORDER BY pc.point_count DESC
-        """
-        
-        cur.execute(query, city_ids)
-        clusters = cur.fetchall()
-        
-        # Group clusters by city
-        clusters_by_city = {}
-        for city_name in city_names:
-            clusters_by_city[city_name] = []
-            
-        for cluster in clusters:
-            city_name = cluster['city_name']
-            if city_name in clusters_by_city:
-                # Remove city_name from the cluster object to avoid redundancy
-                del cluster['city_name']
-                clusters_by_city[city_name].append(cluster)
-        
-        # Prepare response
-        response = {
-            'count': len(clusters),
-            'cities': [{'name': name, 'clusters': clusters_by_city[name]} for name in city_names],
-            'locations': [
-                {'longitude': lon1, 'latitude': lat1},
-                {'longitude': lon2, 'latitude': lat2}
-            ]
-        }
+        with metrics.phase('jsonify'):
+            return jsonify(response)
+        
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
+    except Exception as e:
+        logging.error("Error in get_clusters_for_locations: %s", e)
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/clusters', methods=['POST'])
+def post_clusters_for_locations():
+    try:
+        # Any number of people: {"locations": [{"longitude": .., "latitude": ..}, ...], "top": .., "score": ..}
+        data = request.get_json()
+        locations = [(float(location['longitude']), float(location['latitude'])) for location in data['locations']]
+        top, score = parse_ranking(data)
+        
+        if not 1 <= len(locations) <= CLUSTERS_MAX_LOCATIONS:
+            return jsonify({'error': f'Between 1 and {CLUSTERS_MAX_LOCATIONS} locations are supported'}), 400
+        if not all(valid_location(lon, lat) for lon, lat in locations):
+            return jsonify({'error': 'Invalid coordinates. Longitude must be between -180 and 180, latitude between -90 and 90.'}), 400
         
-        cur.close()
-        return jsonify(response)
+        with storage.session() as db:
+            response = clusters_near(db, locations, top, score)
         
+        with metrics.phase('jsonify'):
+            return jsonify(response)
+        
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
     except Exception as e:
-        logging.error(f"Error in get_clusters_for_locations: {str(e)}")
+        logging.error("Error in post_clusters_for_locations: %s", e)
         return jsonify({'error': str(e)}), 400
-    finally:
-        if conn:
-            return_db_connection(conn)  # Return connection to pool
 
-# Meeting API endpoints
+@app.route('/api/clusters/batch', methods=['POST'])
+def batch_clusters_for_locations():
+    try:
+        # {"pairs": [{"lon1": .., "lat1": .., "lon2": .., "lat2": ..}, ...], "top": .., "score": ..}
+        data = request.get_json()
+        pairs = [
+            [(float(pair['lon1']), float(pair['lat1'])), (float(pair['lon2']), float(pair['lat2']))]
+            for pair in data['pairs']
+        ]
+        top, score = parse_ranking(data)
+        
+        if not 1 <= len(pairs) <= CLUSTERS_BATCH_MAX_PAIRS:
+            return jsonify({'error': f'Between 1 and {CLUSTERS_BATCH_MAX_PAIRS} pairs are supported'}), 400
+        if not all(valid_location(lon, lat) for pair in pairs for lon, lat in pair):
+            return jsonify({'error': 'Invalid coordinates. Longitude must be between -180 and 180, latitude between -90 and 90.'}), 400
+        
+        # One nearest-city lookup for every location of every pair, and one cluster query
+        # for the distinct cities, on a single connection
+        with storage.session() as db:
+            with metrics.phase('nearest_city'):
+                cities = db.nearest_cities_with_clusters([location for pair in pairs for location in pair])
+            with metrics.phase('clusters'):
+                clusters_by_city = clusters_of_cities(db, cities)
+        
+        cities_by_pair = [[] for _ in pairs]
+        for city in cities:
+            cities_by_pair[city['location'] // 2].append(city)
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
+    except Exception as e:
+        logging.error("Error in batch_clusters_for_locations: %s", e)
+        return jsonify({'error': str(e)}), 400
+    
+    def generate():
+        # One JSON document per line, in request order, each shaped like GET /api/clusters
+        for index, pair in enumerate(pairs):
+            response = group_clusters(pair, cities_by_pair[index], clusters_by_city, top, score, metrics.phase)
+            yield app.json.dumps({'index': index, **response}) + '\n'
+    
+    # The request context stays up while streaming, for the request id in the logs
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/api/meetings', methods=['POST'])
 def create_meeting():
-    conn = None
     try:
         # Generate a unique token
         token = str(uuid.uuid4())
@@ -276,35 +518,22 @@ def create_meeting():
         if not (-180 <= longitude <= 180 and -90 <= latitude <= 90):
             return jsonify({'error': 'Invalid coordinates'}), 400
         
-        # Get connection from pool
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Insert new meeting with 'created' status
-        cur.execute("""
-            INSERT INTO meetings (token, location_lon, location_lat, datetime, status)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING id, token, status, location_lon, location_lat, datetime, created_at
-        """, (token, longitude, latitude, meeting_datetime, 'suggested'))
-        
-        meeting = cur.fetchone()
-        conn.commit()
-        cur.close()
+        # Insert new meeting with 'suggested' status
+        with storage.session() as db:
+            meeting = db.create_meeting(token, longitude, latitude, meeting_datetime, 'suggested')
         
         return jsonify({
             'success': True,
             'meeting': meeting
         })
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
     except Exception as e:
-        logging.error(f"Error creating meeting: {str(e)}")
+        logging.error("Error creating meeting: %s", e)
         return jsonify({'error': str(e)}), 400
-    finally:
-        if conn:
-            return_db_connection(conn)
 
 @app.route('/api/meetings/<token>/suggest', methods=['POST'])
 def suggest_meeting(token):
-    conn = None
     try:
         # Get location from request
         data = request.get_json()
@@ -323,164 +552,137 @@ def suggest_meeting(token):
         if not (-180 <= longitude <= 180 and -90 <= latitude <= 90):
             return jsonify({'error': 'Invalid coordinates'}), 400
         
-        # Get connection from pool
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Check if meeting exists
-        cur.execute("SELECT * FROM meetings WHERE token = %s", (token,))
-        meeting = cur.fetchone()
-        
-        if not meeting:
-            return jsonify({'error': 'Meeting not found'}), 404
-        
-        # Update meeting with suggested location, datetime and status
-        cur.execute("""
-            UPDATE meetings 
-            SET location_lon = %s, location_lat = %s, datetime = %s, status = %s, updated_at = NOW()
-            WHERE token = %s
-            RETURNING id, token, status, location_lon, location_lat, datetime, created_at, updated_at
-        """, (longitude, latitude, meeting_datetime, 'suggested', token))
-        
-        updated_meeting = cur.fetchone()
-        conn.commit()
-        cur.close()
+        with storage.session() as db:
+            # Check if meeting exists
+            if not db.get_meeting(token):
+                return jsonify({'error': 'Meeting not found'}), 404
+            
+            # Update meeting with suggested location, datetime and status
+            updated_meeting = db.suggest_meeting(token, longitude, latitude, meeting_datetime, 'suggested')
         
         return jsonify({
             'success': True,
             'meeting': updated_meeting
         })
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
     except Exception as e:
-        logging.error(f"Error suggesting meeting: {str(e)}")
+        logging.error("Error suggesting meeting: %s", e)
         return jsonify({'error': str(e)}), 400
-    finally:
-        if conn:
-            return_db_connection(conn)
 
 @app.route('/api/meetings/<token>/accept', methods=['POST'])
 def accept_meeting(token):
-    conn = None
     try:
-        # Get connection from pool
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Check if meeting exists
-        cur.execute("SELECT * FROM meetings WHERE token = %s", (token,))
-        meeting = cur.fetchone()
-        
-        if not meeting:
-            return jsonify({'error': 'Meeting not found'}), 404
-        
-        # Check if meeting has a suggested location
-        if meeting['location_lon'] is None or meeting['location_lat'] is None:
-            return jsonify({'error': 'Meeting has no suggested location'}), 400
-        
-        # Update meeting status
-        cur.execute("""
-            UPDATE meetings 
-            SET status = %s, updated_at = NOW()
-            WHERE token = %s
-            RETURNING id, token, status, location_lon, location_lat, created_at, updated_at
-        """, ('accepted', token))
-        
-        updated_meeting = cur.fetchone()
-        conn.commit()
-        cur.close()
+        with storage.session() as db:
+            # Check if meeting exists
+            meeting = db.get_meeting(token)
+            
+            if not meeting:
+                return jsonify({'error': 'Meeting not found'}), 404
+            
+            # Check if meeting has a suggested location
+            if meeting['location_lon'] is None or meeting['location_lat'] is None:
+                return jsonify({'error': 'Meeting has no suggested location'}), 400
+            
+            # Update meeting status
+            updated_meeting = db.set_meeting_status(token, 'accepted')
         
         return jsonify({
             'success': True,
             'meeting': updated_meeting
         })
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
     except Exception as e:
-        logging.error(f"Error accepting meeting: {str(e)}")
+        logging.error("Error accepting meeting: %s", e)
         return jsonify({'error': str(e)}), 400
-    finally:
-        if conn:
-            return_db_connection(conn)
 
 @app.route('/api/meetings/<token>/reject', methods=['POST'])
 def reject_meeting(token):
-    conn = None
     try:
-        # Get connection from pool
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
-        # Check if meeting exists
-        cur.execute("SELECT * FROM meetings WHERE token = %s", (token,))
-        meeting = cur.fetchone()
-        
-        if not meeting:
-            return jsonify({'error': 'Meeting not found'}), 404
-        
-        # Update meeting status
-        cur.execute("""
-            UPDATE meetings 
-            SET status = %s, updated_at = NOW()
-            WHERE token = %s
-            RETURNING id, token, status, location_lon, location_lat, created_at, updated_at
-        """, ('rejected', token))
-        
-        updated_meeting = cur.fetchone()
-        conn.commit()
-        cur.close()
+        with storage.session() as db:
+            # Check if meeting exists
+            if not db.get_meeting(token):
+                return jsonify({'error': 'Meeting not found'}), 404
+            
+            # Update meeting status
+            updated_meeting = db.set_meeting_status(token, 'rejected')
         
         return jsonify({
             'success': True,
             'meeting': updated_meeting
         })
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
     except Exception as e:
-        logging.error(f"Error rejecting meeting: {str(e)}")
+        logging.error("Error rejecting meeting: %s", e)
         return jsonify({'error': str(e)}), 400
-    finally:
-        if conn:
-            return_db_connection(conn)
 
 @app.route('/api/meetings/<token>', methods=['GET'])
 def get_meeting(token):
-    conn = None
     try:
-        # Get connection from pool
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        
         # Get meeting by token
-        cur.execute("SELECT * FROM meetings WHERE token = %s", (token,))
-        meeting = cur.fetchone()
+        with storage.session() as db:
+            meeting = db.get_meeting(token)
         
         if not meeting:
             return jsonify({'error': 'Meeting not found'}), 404
         
-        cur.close()
-        
         return jsonify({
             'success': True,
             'meeting': meeting
         })
+    except PoolTimeout as e:
+        return pool_timeout_response(e)
     except Exception as e:
-        logging.error(f"Error getting meeting: {str(e)}")
+        logging.error("Error getting meeting: %s", e)
         return jsonify({'error': str(e)}), 400
-    finally:
-        if conn:
-            return_db_connection(conn)
-
-if __name__ == '__main__':
-    ssl_cert = '/etc/letsencrypt/live/snf-78417.ok-kno.grnetcloud.net/fullchain.pem'
-    ssl_key = '/etc/letsencrypt/live/snf-78417.ok-kno.grnetcloud.net/privkey.pem'
-    
-    ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-    ssl_context.load_cert_chain(certfile=ssl_cert, keyfile=ssl_key)
 
+def serve(listener, ssl_context):
     cpu_cores = multiprocessing.cpu_count()
     optimal_workers = cpu_cores * 2
 
     http_server = WSGIServer(
         application=app,
         ssl_context=ssl_context,
-        listener=('0.0.0.0', 443), 
+        listener=listener, 
         spawn=optimal_workers,
     )
-    
-    print('Starting server with connection pool and multiple workers...')
-    http_server.serve_forever()
\ No newline at end of file
+    http_server.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Near API server")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=443)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="number of pre-forked worker processes sharing the listener")
+    parser.add_argument('--reuse-port', action='store_true',
+                        help="let every worker bind its own SO_REUSEPORT socket instead of sharing one")
+    parser.add_argument('--no-ssl', action='store_true', help="serve plain HTTP, e.g. for local benchmarks")
+    args = parser.parse_args()
+
+    ssl_context = None
+    if not args.no_ssl:
+        ssl_cert = '/etc/letsencrypt/live/snf-78417.ok-kno.grnetcloud.net/fullchain.pem'
+        ssl_key = '/etc/letsencrypt/live/snf-78417.ok-kno.grnetcloud.net/privkey.pem'
+        
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(certfile=ssl_cert, keyfile=ssl_key)
+
+    address = (args.host, args.port)
+    if args.workers <= 1:
+        print('Starting server with connection pool and multiple workers...')
+        serve(address, ssl_context)
+    else:
+        from prefork import bind_listener, run_prefork
+
+        # Bind before forking so every worker accepts on the same socket
+        listener = None if args.reuse_port else bind_listener(address)
+        per_worker = max(1, DB_POOL_MAX // args.workers)
+
+        def worker_main(slot):
+            configure_db_pool(maxconn=per_worker)
+            serve(listener or bind_listener(address, reuse_port=True), ssl_context)
+
+        print(f'Starting {args.workers} worker processes with {per_worker} database connections each...')
+        run_prefork(args.workers, worker_main)
@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+"""asyncio variant of the API server (aiohttp + asyncpg).
+
+Serves the same routes as api.py with the same response bodies, so the two
+stacks can be benchmarked against each other (see bench_servers.py):
+
+    python api_async.py --port 8443 --no-ssl
+"""
+import argparse
+import asyncio
+import decimal
+import json
+import logging
+import os
+import ssl
+import uuid
+from datetime import date, datetime, time, timezone
+from email.utils import format_datetime
+import asyncpg # type: ignore
+from aiohttp import web # type: ignore
+
+from cluster_groups import distinct_city_ids, group_by_city, group_clusters, parse_ranking, valid_location
+
+DSN = "postgresql://postgres@/osm_points"
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 10))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 100))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+# Most people POST /api/clusters takes at once, as in api.py
+CLUSTERS_MAX_LOCATIONS = int(os.environ.get('CLUSTERS_MAX_LOCATIONS', 100))
+# Location pairs one POST /api/clusters/batch request may send, as in api.py
+CLUSTERS_BATCH_MAX_PAIRS = int(os.environ.get('CLUSTERS_BATCH_MAX_PAIRS', 1000))
+
+# api.py runs Flask with DEBUG on, which pretty-prints jsonify output
+JSON_INDENT = 2
+
+logging.basicConfig(level=logging.DEBUG, filename='app_async.log', filemode='a',
+                    format='%(asctime)s - %(levelname)s - %(message)s')
+
+POI_SNAPSHOT = os.environ.get('POI_SNAPSHOT')
+poi_snapshot = None
+if POI_SNAPSHOT:
+    from poi_snapshot import PoiSnapshot
+    poi_snapshot = PoiSnapshot(POI_SNAPSHOT)
+
+def http_date(value):
+    """Format dates like Flask's JSON provider (RFC 822, naive values taken as UTC)."""
+    if isinstance(value, datetime):
+        value = value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+    else:
+        value = datetime.combine(value, time(), tzinfo=timezone.utc)
+    return format_datetime(value, usegmt=True)
+
+def json_default(o):
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+def jsonify(data, status=200):
+    body = json.dumps(data, indent=JSON_INDENT, sort_keys=True, default=json_default)
+    return web.Response(text=f"{body}\n", status=status, content_type='application/json')
+
+def records(rows):
+    return [dict(row) for row in rows]
+
+def _parse_timestamp(text):
+    return datetime.fromisoformat(text)
+
+async def init_connection(conn):
+    # Exchange timestamps as text, so ISO strings from clients reach PostgreSQL
+    # exactly as they do through psycopg2
+    for type_name in ('timestamp', 'timestamptz'):
+        await conn.set_type_codec(
+            type_name, schema='pg_catalog', format='text',
+            encoder=lambda value: value if isinstance(value, str) else value.isoformat(),
+            decoder=_parse_timestamp,
+        )
+
+async def acquire(request):
+    return await request.app['pool'].acquire(timeout=DB_POOL_TIMEOUT)
+
+def pool_timeout_response():
+    logging.warning("Connection pool exhausted")
+    return jsonify({'error': 'Server busy, please retry'}, 503)
+
+async def favicon(request):
+    return web.Response(status=204)
+
+async def get_points_in_bbox(request):
+    conn = None
+    try:
+        # Get parameters from query string
+        min_lon = float(request.query.get('minLon'))
+        min_lat = float(request.query.get('minLat'))
+        max_lon = float(request.query.get('maxLon'))
+        max_lat = float(request.query.get('maxLat'))
+
+        if poi_snapshot is not None:
+            ids, lons, lats = poi_snapshot.query_bbox(min_lon, min_lat, max_lon, max_lat)
+            points = [
+                {'id': point_id, 'longitude': lon, 'latitude': lat}
+                for point_id, lon, lat in zip(ids.tolist(), lons.tolist(), lats.tolist())
+            ]
+            return jsonify({'count': len(points), 'points': points})
+
+        conn = await acquire(request)
+        points = records(await conn.fetch("""
+            SELECT id,
+                ST_X(geom) as longitude,
+                ST_Y(geom) as latitude
+            FROM osm_points
+            WHERE geom && ST_MakeEnvelope($1, $2, $3, $4, 4326)
+        """, min_lon, min_lat, max_lon, max_lat))
+
+        return jsonify({'count': len(points), 'points': points})
+    except asyncio.TimeoutError:
+        return pool_timeout_response()
+    except Exception as e:
+        return jsonify({'error': str(e)}, 400)
+    finally:
+        if conn:
+            await request.app['pool'].release(conn)
+
+async def get_cities_in_bbox(request):
+    conn = None
+    try:
+        min_lon = float(request.query.get('minLon'))
+        min_lat = float(request.query.get('minLat'))
+        max_lon = float(request.query.get('maxLon'))
+        max_lat = float(request.query.get('maxLat'))
+
+        # Validate coordinates
+        if not (-180 <= min_lon <= 180 and -90 <= min_lat <= 90 and
+                -180 <= max_lon <= 180 and -90 <= max_lat <= 90):
+            return jsonify({'error': 'Invalid coordinates. Longitude must be between -180 and 180, latitude between -90 and 90.'}, 400)
+
+        conn = await acquire(request)
+        cities = records(await conn.fetch("""
+            SELECT
+                id,
+                name,
+                ST_AsGeoJSON(geom) as geometry
+            FROM cities
+            WHERE geom && ST_MakeEnvelope($1, $2, $3, $4, 4326)
+            ORDER BY name
+        """, min_lon, min_lat, max_lon, max_lat))
+
+        return jsonify({
+            'count': len(cities),
+            'bbox': {
+                'minLon': min_lon,
+                'minLat': min_lat,
+                'maxLon': max_lon,
+                'maxLat': max_lat
+            },
+            'cities': cities
+        })
+    except asyncio.TimeoutError:
+        return pool_timeout_response()
+    except Exception as e:
+        logging.error(f"Error in get_cities_in_bbox: {str(e)}")
+        return jsonify({'error': str(e)}, 400)
+    finally:
+        if conn:
+            await request.app['pool'].release(conn)
+
+async def nearest_cities_with_clusters(conn, locations):
+    """Rows (location, id, name, distance) like PostgisSession.nearest_cities_with_clusters."""
+    return records(await conn.fetch("""
+        SELECT
+            (l.ordinality - 1)::integer as location,
+            nearest.id,
+            nearest.name,
+            ST_Distance(nearest.geom::geography, l.geom::geography) as distance
+        FROM (
+            SELECT ordinality, ST_SetSRID(ST_MakePoint(lon, lat), 4326) AS geom
+            FROM unnest($1::float8[], $2::float8[]) WITH ORDINALITY AS u (lon, lat, ordinality)
+        ) l
+        CROSS JOIN LATERAL (
+            SELECT c.id, c.name, c.geom
+            FROM cities c
+            WHERE EXISTS (SELECT 1 FROM poi_clusters pc WHERE pc.city_id = c.id)
+            ORDER BY c.geom <-> l.geom
+            LIMIT 1
+        ) nearest
+        ORDER BY l.ordinality
+    """, [lon for lon, _ in locations], [lat for _, lat in locations]))
+
+async def clusters_of_cities(conn, cities):
+    """{city id: clusters} for the distinct cities among the rows, in one query."""
+    city_ids = distinct_city_ids(cities)
+    clusters = []
+    if city_ids:
+        clusters = records(await conn.fetch("""
+            SELECT
+                pc.id,
+                pc.city_id,
+                c.name as city_name,
+                pc.cluster_id,
+                pc.point_count,
+                ST_X(pc.geom) as longitude,
+                ST_Y(pc.geom) as latitude
+            FROM poi_clusters pc
+            JOIN cities c ON pc.city_id = c.id
+            WHERE pc.city_id = ANY($1::int[])
+            ORDER BY pc.point_count DESC
+        """, city_ids))
+    return group_by_city(city_ids, clusters)
+
+async def get_clusters_for_locations(request):
+    conn = None
+    try:
+        lon1 = float(request.query.get('lon1'))
+        lat1 = float(request.query.get('lat1'))
+        lon2 = float(request.query.get('lon2'))
+        lat2 = float(request.query.get('lat2'))
+        # Optional ranking: only the `top` fairest meeting points, see fair_ranking.py
+        top, score = parse_ranking(request.query)
+
+        # Validate coordinates
+        if not (valid_location(lon1, lat1) and valid_location(lon2, lat2)):
+            return jsonify({'error': 'Invalid coordinates. Longitude must be between -180 and 180, latitude between -90 and 90.'}, 400)
+
+        conn = await acquire(request)
+        locations = [(lon1, lat1), (lon2, lat2)]
+        cities = await nearest_cities_with_clusters(conn, locations)
+        if cities:
+            logging.info(f"Found cities: {', '.join(city['name'] for city in cities)}")
+        clusters_by_city = await clusters_of_cities(conn, cities)
+
+        return jsonify(group_clusters(locations, cities, clusters_by_city, top, score))
+    except asyncio.TimeoutError:
+        return pool_timeout_response()
+    except Exception as e:
+        logging.error(f"Error in get_clusters_for_locations: {str(e)}")
+        return jsonify({'error': str(e)}, 400)
+    finally:
+        if conn:
+            await request.app['pool'].release(conn)
+
+async def post_clusters_for_locations(request):
+    conn = None
+    try:
+        # Any number of people: {"locations": [{"longitude": .., "latitude": ..}, ...], "top": .., "score": ..}
+        data = await request.json()
+        locations = [(float(location['longitude']), float(location['latitude'])) for location in data['locations']]
+        top, score = parse_ranking(data)
+
+        if not 1 <= len(locations) <= CLUSTERS_MAX_LOCATIONS:
+            return jsonify({'error': f'Between 1 and {CLUSTERS_MAX_LOCATIONS} locations are supported'}, 400)
+        if not all(valid_location(lon, lat) for lon, lat in locations):
+            return jsonify({'error': 'Invalid coordinates. Longitude must be between -180 and 180, latitude between -90 and 90.'}, 400)
+
+        conn = await acquire(request)
+        cities = await nearest_cities_with_clusters(conn, locations)
+        if cities:
+            logging.info(f"Found cities: {', '.join(city['name'] for city in cities)}")
+        clusters_by_city = await clusters_of_cities(conn, cities)
+
+        return jsonify(group_clusters(locations, cities, clusters_by_city, top, score))
+    except asyncio.TimeoutError:
+        return pool_timeout_response()
+    except Exception as e:
+        logging.error(f"Error in post_clusters_for_locations: {str(e)}")
+        return jsonify({'error': str(e)}, 400)
+    finally:
+        if conn:
+            await request.app['pool'].release(conn)
+
+async def batch_clusters_for_locations(request):
+    conn = None
+    try:
+        # {"pairs": [{"lon1": .., "lat1": .., "lon2": .., "lat2": ..}, ...], "top": .., "score": ..}
+        data = await request.json()
+        pairs = [
+            [(float(pair['lon1']), float(pair['lat1'])), (float(pair['lon2']), float(pair['lat2']))]
+            for pair in data['pairs']
+        ]
+        top, score = parse_ranking(data)
+
+        if not 1 <= len(pairs) <= CLUSTERS_BATCH_MAX_PAIRS:
+            return jsonify({'error': f'Between 1 and {CLUSTERS_BATCH_MAX_PAIRS} pairs are supported'}, 400)
+        if not all(valid_location(lon, lat) for pair in pairs for lon, lat in pair):
+            return jsonify({'error': 'Invalid coordinates. Longitude must be between -180 and 180, latitude between -90 and 90.'}, 400)
+
+        # One nearest-city lookup for every location of every pair, and one cluster query
+        # for the distinct cities, on a single connection
+        conn = await acquire(request)
+        cities = await nearest_cities_with_clusters(conn, [location for pair in pairs for location in pair])
+        clusters_by_city = await clusters_of_cities(conn, cities)
+    except asyncio.TimeoutError:
+        return pool_timeout_response()
+    except Exception as e:
+        logging.error(f"Error in batch_clusters_for_locations: {str(e)}")
+        return jsonify({'error': str(e)}, 400)
+    finally:
+        # Released before streaming, the response needs no database
+        if conn:
+            await request.app['pool'].release(conn)
+
+    cities_by_pair = [[] for _ in pairs]
+    for city in cities:
+        cities_by_pair[city['location'] // 2].append(city)
+
+    # One JSON document per line, in request order, each shaped like GET /api/clusters
+    # and serialized like Flask's app.json.dumps in api.py
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    await response.prepare(request)
+    for index, pair in enumerate(pairs):
+        body = group_clusters(pair, cities_by_pair[index], clusters_by_city, top, score)
+        line = json.dumps({'index': index, **body}, sort_keys=True, default=json_default)
+        await response.write(f"{line}\n".encode())
+    await response.write_eof()
+    return response
+
+async def read_location(request):
+    """Parse the JSON body of the meeting routes; returns (longitude, latitude, datetime) or an error response."""
+    try:
+        data = await request.json()
+    except Exception:
+        data = None
+    if not data or 'longitude' not in data or 'latitude' not in data:
+        return jsonify({'error': 'Missing location data'}, 400)
+
+    longitude = float(data['longitude'])
+    latitude = float(data['latitude'])
+
+    # Get datetime if provided, otherwise use current time
+    meeting_datetime = data.get('datetime')
+    if not meeting_datetime:
+        meeting_datetime = datetime.now().isoformat()
+
+    if not (-180 <= longitude <= 180 and -90 <= latitude <= 90):
+        return jsonify({'error': 'Invalid coordinates'}, 400)
+    return longitude, latitude, meeting_datetime
+
+async def create_meeting(request):
+    conn = None
+    try:
+        token = str(uuid.uuid4())
+
+        location = await read_location(request)
+        if isinstance(location, web.Response):
+            return location
+        longitude, latitude, meeting_datetime = location
+
+        conn = await acquire(request)
+        meeting = await conn.fetchrow("""
+            INSERT INTO meetings (token, location_lon, location_lat, datetime, status)
+            VALUES ($1, $2, $3, $4, $5)
+            RETURNING id, token, status, location_lon, location_lat, datetime, created_at
+        """, token, longitude, latitude, meeting_datetime, 'suggested')
+
+        return jsonify({'success': True, 'meeting': dict(meeting)})
+    except asyncio.TimeoutError:
+        return pool_timeout_response()
+    except Exception as e:
+        logging.error(f"Error creating meeting: {str(e)}")
+        return jsonify({'error': str(e)}, 400)
+    finally:
+        if conn:
+            await request.app['pool'].release(conn)
+
+async def suggest_meeting(request):
+    conn = None
+    token = request.match_info['token']
+    try:
+        location = await read_location(request)
+        if isinstance(location, web.Response):
+            return location
+        longitude, latitude, meeting_datetime = location
+
+        conn = await acquire(request)
+        async with conn.transaction():
+            meeting = await conn.fetchrow("SELECT * FROM meetings WHERE token = $1", token)
+            if not meeting:
+                return jsonify({'error': 'Meeting not found'}, 404)
+
+            updated_meeting = await conn.fetchrow("""
+                UPDATE meetings
+                SET location_lon = $1, location_lat = $2, datetime = $3, status = $4, updated_at = NOW()
+                WHERE token = $5
+                RETURNING id, token, status, location_lon, location_lat, datetime, created_at, updated_at
+            """, longitude, latitude, meeting_datetime, 'suggested', token)
+
+        return jsonify({'success': True, 'meeting': dict(updated_meeting)})
+    except asyncio.TimeoutError:
+        return pool_timeout_response()
+    except Exception as e:
+        logging.error(f"Error suggesting meeting: {str(e)}")
+        return jsonify({'error': str(e)}, 400)
+    finally:
+        if conn:
+            await request.app['pool'].release(conn)
+
+async def set_meeting_status(request, status, require_location):
+    conn = None
+    token = request.match_info['token']
+    try:
+        conn = await acquire(request)
+        async with conn.transaction():
+            meeting = await conn.fetchrow("SELECT * FROM meetings WHERE token = $1", token)
+            if not meeting:
+                return jsonify({'error': 'Meeting not found'}, 404)
+
+            if require_location and (meeting['location_lon'] is None or meeting['location_lat'] is None):
+                return jsonify({'error': 'Meeting has no suggested location'}, 400)
+
+            updated_meeting = await conn.fetchrow("""
+                UPDATE meetings
+                SET status = $1, updated_at = NOW()
+                WHERE token = $2
+                RETURNING id, token, status, location_lon, location_lat, created_at, updated_at
+            """, status, token)
+
+        return jsonify({'success': True, 'meeting': dict(updated_meeting)})
+    except asyncio.TimeoutError:
+        return pool_timeout_response()
+    except Exception as e:
+        action = 'accepting' if status == 'accepted' else 'rejecting'
+        logging.error(f"Error {action} meeting: {str(e)}")
+        return jsonify({'error': str(e)}, 400)
+    finally:
+        if conn:
+            await request.app['pool'].release(conn)
+
+async def accept_meeting(request):
+    return await set_meeting_status(request, 'accepted', require_location=True)
+
+async def reject_meeting(request):
+    return await set_meeting_status(request, 'rejected', require_location=False)
+
+async def get_meeting(request):
+    conn = None
+    token = request.match_info['token']
+    try:
+        conn = await acquire(request)
+        meeting = await conn.fetchrow("SELECT * FROM meetings WHERE token = $1", token)
+        if not meeting:
+            return jsonify({'error': 'Meeting not found'}, 404)
+
+        return jsonify({'success': True, 'meeting': dict(meeting)})
+    except asyncio.TimeoutError:
+        return pool_timeout_response()
+    except Exception as e:
+        logging.error(f"Error getting meeting: {str(e)}")
+        return jsonify({'error': str(e)}, 400)
+    finally:
+        if conn:
+            await request.app['pool'].release(conn)
+
+async def create_pool(app):
+    app['pool'] = await asyncpg.create_pool(
+        DSN, min_size=DB_POOL_MIN, max_size=DB_POOL_MAX, init=init_connection,
+    )
+    yield
+    await app['pool'].close()
+
+def create_app():
+    app = web.Application()
+    app.cleanup_ctx.append(create_pool)
+    app.router.add_get('/favicon.ico', favicon)
+    app.router.add_get('/api/points', get_points_in_bbox)
+    app.router.add_get('/api/cities', get_cities_in_bbox)
+    app.router.add_get('/api/clusters', get_clusters_for_locations)
+    app.router.add_post('/api/clusters', post_clusters_for_locations)
+    app.router.add_post('/api/clusters/batch', batch_clusters_for_locations)
+    app.router.add_post('/api/meetings', create_meeting)
+    app.router.add_post('/api/meetings/{token}/suggest', suggest_meeting)
+    app.router.add_post('/api/meetings/{token}/accept', accept_meeting)
+    app.router.add_post('/api/meetings/{token}/reject', reject_meeting)
+    app.router.add_get('/api/meetings/{token}', get_meeting)
+    return app
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Near API server (asyncio)")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=443)
+    parser.add_argument('--no-ssl', action='store_true', help="serve plain HTTP, e.g. for local benchmarks")
+    args = parser.parse_args()
+
+    try:
+        import uvloop # type: ignore
+        uvloop.install()
+    except ImportError:
+        pass
+
+    ssl_context = None
+    if not args.no_ssl:
+        ssl_cert = '/etc/letsencrypt/live/snf-78417.ok-kno.grnetcloud.net/fullchain.pem'
+        ssl_key = '/etc/letsencrypt/live/snf-78417.ok-kno.grnetcloud.net/privkey.pem'
+
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(certfile=ssl_cert, keyfile=ssl_key)
+
+    print('Starting asyncio server...')
+    web.run_app(create_app(), host=args.host, port=args.port, ssl_context=ssl_context, access_log=None)
@@ -1,7 +1,11 @@
 from gevent import monkey  # type: ignore
 monkey.patch_all()  # Add this at the very top of the file, before other imports
+from gevent_psycopg import patch_psycopg
+patch_psycopg()  # psycopg2 is a C extension, make it yield to the hub explicitly
 
-import ssl 
+import os
+import ssl
+import math 
 import logging
 import multiprocessing
 from flask import Flask, request, jsonify # type: ignore
@@ -9,6 +13,10 @@ from flask_caching import Cache # type: ignore
 from psycopg2.extras import RealDictCursor # type: ignore
 from gevent.pywsgi import WSGIServer # type: ignore
 from psycopg2.pool import ThreadedConnectionPool  #type: ignore
+from psycopg2 import errors # type: ignore
+import numpy as np # type: ignore
+from poi_grid import dense_cell_clusters, estimate_points, fetch_cells, level_for_bbox, planner_estimate
+from weighted_kmeans import weighted_kmeans
 
 app = Flask(__name__)
 app.config['DEBUG'] = True
@@ -34,6 +42,104 @@ def get_db_connection():
 def return_db_connection(conn):
     db_pool.putconn(conn)
 
+# /api/kmeans clusters poi_grid cells (see poi_grid.py) at the finest level where the
+# padded bbox spans at most this many cells per side, so a point is never moved by
+# more than 1/KMEANS_CELLS_PER_SIDE of the bbox side; exact=1 clusters the raw points
+KMEANS_CELLS_PER_SIDE = int(os.environ.get('KMEANS_CELLS_PER_SIDE', 128))
+KMEANS_MINIBATCH_SIZE = 1024
+
+def grid_kmeans(conn, min_lon, min_lat, max_lon, max_lat, clusters, minibatch=False):
+    """Weighted k-means over the poi_grid cells of a bbox.
+
+    Returns (level, rows) with rows shaped like the exact query's, or None
+    when the exact path should answer instead: the grid is not built, or
+    the bbox holds no more points than clusters requested.
+    """
+    level = level_for_bbox(min_lon, min_lat, max_lon, max_lat, KMEANS_CELLS_PER_SIDE)
+    try:
+        cells = fetch_cells(conn, level, min_lon, min_lat, max_lon, max_lat)
+    except errors.UndefinedTable:
+        conn.rollback()
+        return None
+
+    counts = np.array([cell[2] for cell in cells], dtype=np.float64)
+    if counts.sum() <= clusters:
+        return None
+    sums = np.array([(cell[3], cell[4]) for cell in cells], dtype=np.float64)
+
+    _, labels, _ = weighted_kmeans(
+        sums / counts[:, None], counts, clusters,
+        batch_size=KMEANS_MINIBATCH_SIZE if minibatch else None,
+    )
+    # Exact centroids and sizes of the member points, merged from the cell sums
+    point_count = np.bincount(labels, weights=counts)
+    sum_lon = np.bincount(labels, weights=sums[:, 0])
+    sum_lat = np.bincount(labels, weights=sums[:, 1])
+
+    rows = [
+        {
+            'cluster_id': str(cluster_id),
+            'longitude': float(sum_lon[cluster_id] / point_count[cluster_id]),
+            'latitude': float(sum_lat[cluster_id] / point_count[cluster_id]),
+            'point_count': int(point_count[cluster_id]),
+            'is_individual_points': False,
+        }
+        for cluster_id in range(len(point_count)) if point_count[cluster_id] > 0
+    ]
+    rows.sort(key=lambda row: row['point_count'], reverse=True)
+    return level, rows
+
+# Level of detail for /api/dbscan and /api/cache_clusters. The POIs in the bbox are
+# estimated from poi_grid (or the planner's row estimate without it) before anything
+# runs: up to DBSCAN_EXACT_MAX_POINTS are clustered exactly, up to
+# DBSCAN_SAMPLED_MAX_POINTS on a random sample of about DBSCAN_EXACT_MAX_POINTS,
+# and above that dense poi_grid cells are joined instead. mode=exact|sampled|grid forces one
+DBSCAN_EXACT_MAX_POINTS = int(os.environ.get('DBSCAN_EXACT_MAX_POINTS', 50000))
+DBSCAN_SAMPLED_MAX_POINTS = int(os.environ.get('DBSCAN_SAMPLED_MAX_POINTS', 1000000))
+DBSCAN_GRID_CELLS_PER_SIDE = int(os.environ.get('DBSCAN_GRID_CELLS_PER_SIDE', 128))
+DBSCAN_MODES = ('auto', 'exact', 'sampled', 'grid')
+
+def estimate_bbox_points(conn, min_lon, min_lat, max_lon, max_lat):
+    """(estimate, source) for the POIs in a bbox, from poi_grid or else the planner."""
+    try:
+        estimate = estimate_points(conn, min_lon, min_lat, max_lon, max_lat)
+    except errors.UndefinedTable:
+        conn.rollback()
+        estimate = None
+    if estimate is not None:
+        return estimate, 'grid'
+    return planner_estimate(conn, min_lon, min_lat, max_lon, max_lat), 'planner'
+
+def choose_dbscan_mode(requested, estimate, source):
+    if requested != 'auto':
+        return requested
+    if estimate <= DBSCAN_EXACT_MAX_POINTS:
+        return 'exact'
+    if estimate <= DBSCAN_SAMPLED_MAX_POINTS or source != 'grid':
+        return 'sampled'
+    return 'grid'
+
+def dbscan_sample_rate(estimate):
+    """Fraction of the POIs to keep so that about DBSCAN_EXACT_MAX_POINTS get clustered."""
+    return min(1.0, DBSCAN_EXACT_MAX_POINTS / max(estimate, 1))
+
+def grid_dbscan(conn, min_lon, min_lat, max_lon, max_lat, eps, min_points):
+    """DBSCAN over the dense poi_grid cells of a bbox; (level, rows) shaped like the exact query's."""
+    level = level_for_bbox(min_lon, min_lat, max_lon, max_lat, DBSCAN_GRID_CELLS_PER_SIDE)
+    cells = fetch_cells(conn, level, min_lon, min_lat, max_lon, max_lat)
+    rows = [
+        {
+            'cluster_id': str(cluster_id),
+            'longitude': longitude,
+            'latitude': latitude,
+            'point_count': point_count,
+            'is_individual_points': False,
+        }
+        for cluster_id, (point_count, longitude, latitude)
+        in enumerate(dense_cell_clusters(cells, level, eps, min_points))
+    ]
+    return level, rows
+
 @app.route('/favicon.ico')
 def favicon():
     return '', 204 
@@ -77,6 +183,7 @@ def get_points_in_bbox():
 
 @app.route('/api/kmeans', methods=['GET'])
 def kmeans():
+    conn = None
     try:
         # Get parameters for two points
         lon1 = float(request.args.get('lon1'))
@@ -84,6 +191,8 @@ def kmeans():
         lon2 = float(request.args.get('lon2'))
         lat2 = float(request.args.get('lat2'))
         clusters = int(request.args.get('clusters', 5))
+        exact = request.args.get('exact', '0') == '1'
+        minibatch = request.args.get('minibatch', '0') == '1'
         
         # Create bounding box from the two points
         min_lon = min(lon1, lon2)
@@ -105,6 +214,20 @@ def kmeans():
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)  # Create cursor
 
+        # Cluster the precomputed cell aggregates unless the raw points are asked for
+        if not exact:
+            grid = grid_kmeans(conn, min_lon, min_lat, max_lon, max_lat, clusters, minibatch)
+            if grid is not None:
+                level, results = grid
+                cur.close()
+                return jsonify({
+                    'count': len(results),
+                    'clusters': results,
+                    'is_clustered': True,
+                    'mode': 'grid',
+                    'grid_level': level
+                })
+
         # Query clusters using PostgreSQL's k-means
         cur.execute("""
             WITH points AS (
@@ -150,7 +273,8 @@ def kmeans():
         return jsonify({
             'count': len(results),
             'clusters': results,
-            'is_clustered': not (results[0]['is_individual_points'] if results else False)
+            'is_clustered': not (results[0]['is_individual_points'] if results else False),
+            'mode': 'exact'
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 400
@@ -160,6 +284,7 @@ def kmeans():
 
 @app.route('/api/dbscan', methods=['GET'])
 def dbscan():
+    conn = None
     try:
         # Get parameters for two points
         lon1 = float(request.args.get('lon1'))
@@ -168,6 +293,9 @@ def dbscan():
         lat2 = float(request.args.get('lat2'))
         eps = float(request.args.get('eps', 0.00025))
         min_points = int(request.args.get('minPoints', 2))
+        requested_mode = request.args.get('mode', 'auto')
+        if requested_mode not in DBSCAN_MODES:
+            raise ValueError(f"mode must be one of {', '.join(DBSCAN_MODES)}")
         
         # Create bounding box from the two points
         min_lon = min(lon1, lon2)
@@ -187,6 +315,31 @@ def dbscan():
         # Connect to database
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
+
+        # Size the request up before clustering anything
+        estimate, source = estimate_bbox_points(conn, min_lon, min_lat, max_lon, max_lat)
+        if estimate == 0 and source == 'grid':
+            # No poi_grid cell overlaps the bbox, so there is nothing to cluster
+            cur.close()
+            return jsonify({'count': 0, 'clusters': [], 'is_clustered': False,
+                            'mode': 'empty', 'estimated_points': 0, 'estimate_source': source})
+        mode = choose_dbscan_mode(requested_mode, estimate, source)
+        lod = {'mode': mode, 'estimated_points': estimate, 'estimate_source': source}
+
+        if mode == 'grid':
+            level, results = grid_dbscan(conn, min_lon, min_lat, max_lon, max_lat, eps, min_points)
+            cur.close()
+            return jsonify({
+                'count': len(results),
+                'clusters': results,
+                'is_clustered': True,
+                'grid_level': level,
+                **lod
+            })
+
+        # A sample keeps the density of core points only if minPoints shrinks with it
+        rate = dbscan_sample_rate(estimate) if mode == 'sampled' else 1.0
+        sample_min_points = max(2, round(min_points * rate)) if rate < 1.0 else min_points
             
         # Query clusters using PostgreSQL's DBSCAN
         cur.execute("""
@@ -194,6 +347,7 @@ def dbscan():
                 SELECT id, geom
                 FROM osm_points
                 WHERE geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
+                    AND random() < %s
             ),
             point_count AS (
                 SELECT COUNT(*) as total FROM points
@@ -223,15 +377,21 @@ def dbscan():
                 (SELECT total <= %s FROM point_count) as is_individual_points
             FROM final
             ORDER BY point_count DESC
-        """, (min_lon, min_lat, max_lon, max_lat, min_points, eps, min_points, min_points))
+        """, (min_lon, min_lat, max_lon, max_lat, rate,
+              sample_min_points, eps, sample_min_points, sample_min_points))
     
         results = cur.fetchall()
         cur.close()
+        if rate < 1.0:
+            lod['sample_rate'] = rate
+            for row in results:
+                row['point_count'] = round(row['point_count'] / rate)
             
         return jsonify({
             'count': len(results),
             'clusters': results,
-            'is_clustered': not (results[0]['is_individual_points'] if results else False)
+            'is_clustered': not (results[0]['is_individual_points'] if results else False),
+            **lod
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 400
@@ -259,20 +419,53 @@ def cache_clusters():
         eps = float(request.args.get('eps', 0.00025))
         min_points = int(request.args.get('minPoints', 2))
         grid_size = float(request.args.get('gridSize', 0.01))  # Default: 0.01°
+        requested_mode = request.args.get('mode', 'auto')
+        if requested_mode not in DBSCAN_MODES:
+            return jsonify({'error': f"mode must be one of {', '.join(DBSCAN_MODES)}"}), 400
 
         logging.info(f"Cache Clusters called with: lon1={lon1}, lat1={lat1}, lon2={lon2}, lat2={lat2}, eps={eps}, minPoints={min_points}, gridSize={grid_size}")
 
         # Check cache first
-        cached_clusters = get_clusters_from_cache(lon1, lat1, lon2, lat2, grid_size)
-        if cached_clusters:
+        cache_key_size = grid_size if requested_mode == 'auto' else f"{grid_size}:{requested_mode}"
+        cached = get_clusters_from_cache(lon1, lat1, lon2, lat2, cache_key_size)
+        if cached:
             logging.info("Returning cached clusters.")
-            return jsonify({'count': len(cached_clusters), 'clusters': cached_clusters, 'is_clustered': True})
+            clusters, lod = cached
+            return jsonify({'count': len(clusters), 'clusters': clusters, 'is_clustered': True, **lod})
 
         # Query the database
         logging.info("Querying database for clusters...")
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
+        # Size the request up before clustering anything
+        min_lon, max_lon = min(lon1, lon2), max(lon1, lon2)
+        min_lat, max_lat = min(lat1, lat2), max(lat1, lat2)
+        estimate, source = estimate_bbox_points(conn, min_lon, min_lat, max_lon, max_lat)
+        if estimate == 0 and source == 'grid':
+            # No poi_grid cell overlaps the bbox, so there is nothing to cluster
+            cur.close()
+            return jsonify({'count': 0, 'clusters': [], 'is_clustered': False,
+                            'mode': 'empty', 'estimated_points': 0, 'estimate_source': source})
+        mode = choose_dbscan_mode(requested_mode, estimate, source)
+        lod = {'mode': mode, 'estimated_points': estimate, 'estimate_source': source}
+        logging.info(f"Estimated {estimate} points ({source}), clustering in {mode} mode.")
+
+        if mode == 'grid':
+            level, results = grid_dbscan(conn, min_lon, min_lat, max_lon, max_lat, eps, min_points)
+            cur.close()
+            for row in results:
+                row['grid_x'] = math.floor(row['longitude'] / grid_size)
+                row['grid_y'] = math.floor(row['latitude'] / grid_size)
+            results.sort(key=lambda row: (row['grid_x'], row['grid_y'], -row['point_count']))
+            lod['grid_level'] = level
+            add_clusters_to_cache(lon1, lat1, lon2, lat2, cache_key_size, (results, lod))
+            return jsonify({'count': len(results), 'clusters': results, 'is_clustered': True, **lod})
+
+        # A sample keeps the density of core points only if minPoints shrinks with it
+        rate = dbscan_sample_rate(estimate) if mode == 'sampled' else 1.0
+        sample_min_points = max(2, round(min_points * rate)) if rate < 1.0 else min_points
+
         cur.execute("""
             WITH points AS (
                 SELECT id, geom,
@@ -280,6 +473,7 @@ def cache_clusters():
                     FLOOR(ST_Y(geom) / %s) AS grid_y
                 FROM osm_points
                 WHERE geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
+                    AND random() < %s
             ),
             point_count AS (
                 SELECT COUNT(*) as total FROM points
@@ -312,20 +506,26 @@ def cache_clusters():
                 (SELECT total <= %s FROM point_count) as is_individual_points
             FROM final
             ORDER BY grid_x, grid_y, point_count DESC;
-        """, (grid_size, grid_size, lon1, lat1, lon2, lat2, min_points, eps, min_points, min_points))
+        """, (grid_size, grid_size, lon1, lat1, lon2, lat2, rate,
+              sample_min_points, eps, sample_min_points, sample_min_points))
 
         results = cur.fetchall()
         cur.close()
+        if rate < 1.0:
+            lod['sample_rate'] = rate
+            for row in results:
+                row['point_count'] = round(row['point_count'] / rate)
 
         logging.info(f"Query returned {len(results)} clusters across {len(set((r['grid_x'], r['grid_y']) for r in results))} grid cells.")
 
         # Cache results
-        add_clusters_to_cache(lon1, lat1, lon2, lat2, grid_size, results)
+        add_clusters_to_cache(lon1, lat1, lon2, lat2, cache_key_size, (results, lod))
 
         return jsonify({
             'count': len(results),
             'clusters': results,
-            'is_clustered': not (results[0]['is_individual_points'] if results else False)
+            'is_clustered': not (results[0]['is_individual_points'] if results else False),
+            **lod
         })
 
     except Exception as e:
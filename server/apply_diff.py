@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Apply OSM change files (.osc / .osc.gz) to osm_points and poi_grid.
+
+Created and moved nodes are upserted with a new change version, deleted
+ones removed, the positions they left recorded as tombstones (see
+poi_versions.py), and the poi_grid cell counts of every built level are
+adjusted in the same transaction, so neither the density pyramid nor the
+clients' cached cells have to be rebuilt between full imports. Files are
+applied in the order given, e.g. consecutive minutely or daily diffs:
+
+    python apply_diff.py 001.osc.gz 002.osc.gz
+
+poi_clusters is not touched; rerun the clustering stage of pipeline.py
+when the diffs add up.
+"""
+import argparse
+import osmium # type: ignore
+import psycopg2 # type: ignore
+from psycopg2 import errors # type: ignore
+from psycopg2.extras import execute_values # type: ignore
+
+import poi_grid
+import poi_versions
+from run_metrics import RunMetrics
+
+BATCH_SIZE = 10000
+
+class ChangeHandler(osmium.SimpleHandler):
+    """Collects the last version of every node in a change file, by id."""
+
+    def __init__(self):
+        super(ChangeHandler, self).__init__()
+        # id -> (lon, lat), or None when the node was deleted
+        self.nodes = {}
+
+    def node(self, n):
+        if n.deleted or not n.location.valid():
+            self.nodes[n.id] = None
+        else:
+            self.nodes[n.id] = (n.location.lon, n.location.lat)
+
+def apply_batch(conn, changes, levels):
+    """Apply {id: (lon, lat) or None}; returns (upserted, deleted) row counts."""
+    cur = conn.cursor()
+    poi_versions.lock_versions(cur)
+    cur.execute("SELECT id, ST_X(geom), ST_Y(geom) FROM osm_points WHERE id = ANY(%s)", (list(changes),))
+    old = {node_id: (lon, lat) for node_id, lon, lat in cur.fetchall()}
+
+    deleted = [node_id for node_id, location in changes.items() if location is None]
+    if deleted:
+        cur.execute("DELETE FROM osm_points WHERE id = ANY(%s)", (deleted,))
+    # Nodes whose tags changed but not their position are left alone
+    upserts = [(node_id,) + location for node_id, location in changes.items()
+               if location is not None and old.get(node_id) != location]
+    if upserts:
+        execute_values(cur, """
+            INSERT INTO osm_points (id, geom, version)
+            VALUES %s
+            ON CONFLICT (id) DO UPDATE
+            SET geom = EXCLUDED.geom, version = EXCLUDED.version
+        """, upserts, template="(%s, ST_SetSRID(ST_MakePoint(%s, %s), 4326), nextval('osm_points_version_seq'))")
+    # Positions left behind by deleted and moved nodes, for clients syncing their cells
+    left = [(node_id,) + old[node_id] for node_id, location in changes.items()
+             if node_id in old and old[node_id] != location]
+    poi_versions.add_tombstones(cur, left)
+
+    poi_grid.apply_delta(conn, [(lon, lat) for _, lon, lat in upserts], [position for _, *position in left], levels)
+    poi_versions.publish_versions(cur)
+    cur.close()
+    conn.commit()
+    return len(upserts), len(deleted)
+
+def apply_file(conn, path, levels, stage=None):
+    handler = ChangeHandler()
+    handler.apply_file(path)
+    changes = list(handler.nodes.items())
+    upserted = deleted = 0
+    for start in range(0, len(changes), BATCH_SIZE):
+        batch_upserted, batch_deleted = apply_batch(conn, dict(changes[start:start + BATCH_SIZE]), levels)
+        upserted += batch_upserted
+        deleted += batch_deleted
+        if stage:
+            stage.add_rows(batch_upserted + batch_deleted)
+    print(f"{path}: {upserted} nodes created or moved, {deleted} deleted")
+
+def apply_diffs(paths, metrics=None):
+    own_metrics = metrics is None
+    if own_metrics:
+        metrics = RunMetrics('apply_diff', params={'files': list(paths)})
+    conn = psycopg2.connect("dbname=osm_points user=postgres")
+    try:
+        poi_versions.create_schema(conn)
+        try:
+            levels = poi_grid.built_levels(conn)
+        except errors.UndefinedTable:
+            conn.rollback()
+            levels = []
+        print(f"Updating poi_grid levels: {', '.join(map(str, levels)) or 'none built'}")
+        with metrics.stage('apply_diff') as stage:
+            for path in paths:
+                apply_file(conn, path, levels, stage)
+    finally:
+        conn.close()
+        if own_metrics:
+            metrics.save()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply OSM change files to osm_points and poi_grid")
+    parser.add_argument('files', nargs='+', help=".osc or .osc.gz files, applied in order")
+    args = parser.parse_args()
+    apply_diffs(args.files)
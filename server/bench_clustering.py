@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""Benchmark the clustering strategies on synthetic point sets.
+
+Generates urban-like points (storage.generate_dataset: irregular city
+polygons, dense POI hotspots and background noise) at several sizes, loads
+them into a scratch schema and runs every strategy the way the API or the
+batch job does:
+
+    kmeans       ST_ClusterKMeans over the whole bbox (api_v1 /api/kmeans)
+    dbscan       ST_ClusterDBSCAN over the whole bbox (api_v1 /api/dbscan)
+    grid_dbscan  DBSCAN partitioned by grid cell (api_v1 /api/cache_clusters)
+    per_city     DBSCAN per city polygon (create_clusters.py)
+
+For each strategy and size it records the median execution time of
+--repeat runs, the buffers touched and temp I/O from EXPLAIN (ANALYZE,
+BUFFERS), the largest sort/hash memory reported in the plan, and how well
+the labels agree with the reference strategy (adjusted Rand index, noise
+points counted as singletons):
+
+    python bench_clustering.py --sizes 1e3,1e4,1e5,1e6 --repeat 3
+    python bench_clustering.py --sizes 1e7 --strategies dbscan,grid_dbscan,per_city --statement-timeout 1800
+
+Results are printed, saved through run_metrics (so two runs can be compared
+with run_metrics.py compare) and optionally written to --output. The scratch
+schema is dropped at the end unless --keep is given.
+"""
+import argparse
+import io
+import json
+import time
+import numpy as np # type: ignore
+import psycopg2 # type: ignore
+
+from create_clusters import EPS, MIN_POINTS, connect_db
+from run_metrics import RunMetrics
+from storage import generate_dataset
+
+SCHEMA = 'bench_clustering'
+STRATEGIES = ('kmeans', 'dbscan', 'grid_dbscan', 'per_city')
+COPY_CHUNK = 1000000
+
+# Each query yields (id, label); NULL labels are noise
+QUERIES = {
+    'kmeans': f"""
+        SELECT id, ST_ClusterKMeans(geom, %(k)s) OVER ()::text AS label
+        FROM {SCHEMA}.points
+        WHERE geom && ST_MakeEnvelope(%(min_lon)s, %(min_lat)s, %(max_lon)s, %(max_lat)s, 4326)
+    """,
+    'dbscan': f"""
+        SELECT id, ST_ClusterDBSCAN(geom, eps := %(eps)s, minpoints := %(min_points)s) OVER ()::text AS label
+        FROM {SCHEMA}.points
+        WHERE geom && ST_MakeEnvelope(%(min_lon)s, %(min_lat)s, %(max_lon)s, %(max_lat)s, 4326)
+    """,
+    'grid_dbscan': f"""
+        WITH points AS (
+            SELECT id, geom,
+                FLOOR(ST_X(geom) / %(grid_size)s) AS grid_x,
+                FLOOR(ST_Y(geom) / %(grid_size)s) AS grid_y
+            FROM {SCHEMA}.points
+            WHERE geom && ST_MakeEnvelope(%(min_lon)s, %(min_lat)s, %(max_lon)s, %(max_lat)s, 4326)
+        )
+        SELECT id, grid_x || ':' || grid_y || ':' ||
+            ST_ClusterDBSCAN(geom, eps := %(eps)s, minpoints := %(min_points)s) OVER (PARTITION BY grid_x, grid_y) AS label
+        FROM points
+    """,
+    'per_city': f"""
+        SELECT p.id, c.id || ':' ||
+            ST_ClusterDBSCAN(p.geom, eps := %(eps)s, minpoints := %(min_points)s) OVER (PARTITION BY c.id) AS label
+        FROM {SCHEMA}.points p
+        JOIN {SCHEMA}.cities c ON p.geom && c.geom AND ST_Intersects(c.geom, p.geom)
+    """,
+}
+
+def parse_sizes(spec):
+    return [int(float(size)) for size in spec.split(',')]
+
+def load_dataset(conn, size, seed):
+    """Generate `size` points and load them, with their cities, into the scratch schema."""
+    num_cities = min(200, max(4, size // 20000))
+    dataset = generate_dataset(num_cities=num_cities, num_points=size, seed=seed)
+
+    cur = conn.cursor()
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {SCHEMA}")
+    cur.execute(f"CREATE UNLOGGED TABLE {SCHEMA}.raw_points (id BIGINT, lon DOUBLE PRECISION, lat DOUBLE PRECISION)")
+    for start in range(0, size, COPY_CHUNK):
+        end = min(size, start + COPY_CHUNK)
+        buf = io.StringIO()
+        np.savetxt(buf, np.column_stack((dataset['ids'][start:end], dataset['lons'][start:end], dataset['lats'][start:end])),
+                   fmt=('%d', '%.7f', '%.7f'), delimiter='\t')
+        buf.seek(0)
+        cur.copy_from(buf, f'{SCHEMA}.raw_points', columns=('id', 'lon', 'lat'))
+
+    cur.execute(f"""
+        CREATE TABLE {SCHEMA}.points AS
+        SELECT id, ST_SetSRID(ST_MakePoint(lon, lat), 4326) AS geom
+        FROM {SCHEMA}.raw_points
+    """)
+    cur.execute(f"DROP TABLE {SCHEMA}.raw_points")
+    cur.execute(f"CREATE INDEX ON {SCHEMA}.points USING GIST (geom)")
+    cur.execute(f"ALTER TABLE {SCHEMA}.points ADD PRIMARY KEY (id)")
+
+    cur.execute(f"CREATE TABLE {SCHEMA}.cities (id INTEGER PRIMARY KEY, name TEXT, geom GEOMETRY(MULTIPOLYGON, 4326))")
+    for city in dataset['cities']:
+        wkt = 'MULTIPOLYGON(((' + ', '.join(f'{lon} {lat}' for lon, lat in city['ring']) + ')))'
+        cur.execute(f"INSERT INTO {SCHEMA}.cities VALUES (%s, %s, ST_GeomFromText(%s, 4326))",
+                    (city['id'], city['name'], wkt))
+    cur.execute(f"CREATE INDEX ON {SCHEMA}.cities USING GIST (geom)")
+    cur.execute(f"ANALYZE {SCHEMA}.points")
+    cur.execute(f"ANALYZE {SCHEMA}.cities")
+    conn.commit()
+    cur.close()
+
+    bbox = (float(dataset['lons'].min()), float(dataset['lats'].min()),
+            float(dataset['lons'].max()), float(dataset['lats'].max())) if size else (0.0, 0.0, 0.0, 0.0)
+    return num_cities, bbox
+
+def plan_memory_kb(node):
+    """Largest sort/hash/window memory reported anywhere in a JSON plan node."""
+    peak = max(node.get('Sort Space Used', 0) if node.get('Sort Space Type') == 'Memory' else 0,
+               node.get('Peak Memory Usage', 0),
+               node.get('Maximum Storage', 0) if node.get('Storage') == 'Memory' else 0)
+    for child in node.get('Plans', []):
+        peak = max(peak, plan_memory_kb(child))
+    return peak
+
+def explain(conn, query, params):
+    cur = conn.cursor()
+    cur.execute("EXPLAIN (ANALYZE, BUFFERS, TIMING OFF, FORMAT JSON) " + query, params)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    cur.close()
+    conn.rollback()
+    root = plan[0]
+    node = root['Plan']
+    return {
+        'seconds': root['Execution Time'] / 1000,
+        'shared_hit_blocks': node.get('Shared Hit Blocks', 0),
+        'shared_read_blocks': node.get('Shared Read Blocks', 0),
+        'temp_read_blocks': node.get('Temp Read Blocks', 0),
+        'temp_written_blocks': node.get('Temp Written Blocks', 0),
+        'plan_memory_kb': plan_memory_kb(node),
+    }
+
+def store_labels(conn, strategy, query, params):
+    """Materialise a strategy's labels for the agreement check; returns the cluster count."""
+    cur = conn.cursor()
+    cur.execute(f"DROP TABLE IF EXISTS {SCHEMA}.labels_{strategy}")
+    cur.execute(f"CREATE UNLOGGED TABLE {SCHEMA}.labels_{strategy} AS SELECT * FROM ({query}) q WHERE label IS NOT NULL", params)
+    cur.execute(f"SELECT COUNT(DISTINCT label) FROM {SCHEMA}.labels_{strategy}")
+    clusters = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    return clusters
+
+def adjusted_rand_index(counts):
+    """ARI from the contingency counts of every (label_a, label_b) pair."""
+    pairs = lambda n: n * (n - 1) / 2
+    counts = np.asarray(counts, dtype=np.float64)
+    if counts.size == 0:
+        return 1.0
+    nij, a_keys, b_keys = counts[:, 2], counts[:, 0], counts[:, 1]
+    n = nij.sum()
+    sum_ij = pairs(nij).sum()
+    sum_a = pairs(np.bincount(a_keys.astype(np.int64), weights=nij)).sum()
+    sum_b = pairs(np.bincount(b_keys.astype(np.int64), weights=nij)).sum()
+    expected = sum_a * sum_b / pairs(n) if n > 1 else 0.0
+    maximum = (sum_a + sum_b) / 2
+    if maximum == expected:
+        return 1.0
+    return float((sum_ij - expected) / (maximum - expected))
+
+def agreement(conn, strategy, reference):
+    """Adjusted Rand index between two stored labelings over all points, noise as singletons."""
+    cur = conn.cursor()
+    cur.execute(f"""
+        WITH pairs AS (
+            SELECT COALESCE(a.label, 'noise:' || p.id) AS label_a,
+                   COALESCE(b.label, 'noise:' || p.id) AS label_b
+            FROM {SCHEMA}.points p
+            LEFT JOIN {SCHEMA}.labels_{strategy} a ON a.id = p.id
+            LEFT JOIN {SCHEMA}.labels_{reference} b ON b.id = p.id
+        )
+        SELECT DENSE_RANK() OVER (ORDER BY label_a) - 1,
+               DENSE_RANK() OVER (ORDER BY label_b) - 1,
+               n
+        FROM (SELECT label_a, label_b, COUNT(*) AS n FROM pairs GROUP BY label_a, label_b) c
+    """)
+    counts = cur.fetchall()
+    cur.close()
+    return adjusted_rand_index(counts)
+
+def run_strategy(conn, strategy, params, repeat):
+    runs = []
+    for _ in range(repeat):
+        runs.append(explain(conn, QUERIES[strategy], params))
+    runs.sort(key=lambda run: run['seconds'])
+    result = dict(runs[len(runs) // 2])
+    result['seconds_min'] = runs[0]['seconds']
+    result['seconds_max'] = runs[-1]['seconds']
+    result['clusters'] = store_labels(conn, strategy, QUERIES[strategy], params)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the clustering strategies on synthetic points")
+    parser.add_argument('--sizes', default='1e3,1e4,1e5,1e6', help="comma separated point counts, up to 1e7")
+    parser.add_argument('--strategies', default=','.join(STRATEGIES))
+    parser.add_argument('--reference', default='per_city', help="strategy the others are compared against")
+    parser.add_argument('--eps', type=float, default=EPS)
+    parser.add_argument('--min-points', type=int, default=MIN_POINTS)
+    parser.add_argument('--grid-size', type=float, default=0.01, help="cell size of grid_dbscan in degrees")
+    parser.add_argument('--k', default='auto', help="k for kmeans, or 'auto' for the reference cluster count")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--statement-timeout', type=int, default=600, help="seconds before a strategy is abandoned")
+    parser.add_argument('--keep', action='store_true', help="keep the scratch schema")
+    parser.add_argument('--output', help="also write the results to a JSON file")
+    args = parser.parse_args()
+
+    sizes = parse_sizes(args.sizes)
+    strategies = args.strategies.split(',')
+    # The reference runs first so 'auto' k and the agreement can use it
+    order = [args.reference] + [s for s in strategies if s != args.reference]
+    metrics = RunMetrics('bench_clustering', params=vars(args))
+    results = []
+
+    conn = connect_db()
+    try:
+        cur = conn.cursor()
+        cur.execute("SET statement_timeout = %s", (args.statement_timeout * 1000,))
+        conn.commit()
+        cur.close()
+
+        for size in sizes:
+            print(f"\nGenerating and loading {size} points...")
+            start = time.perf_counter()
+            num_cities, bbox = load_dataset(conn, size, args.seed)
+            print(f"Loaded {size} points in {num_cities} cities in {time.perf_counter() - start:.1f}s")
+
+            params = {
+                'eps': args.eps, 'min_points': args.min_points, 'grid_size': args.grid_size, 'k': 5,
+                'min_lon': bbox[0], 'min_lat': bbox[1], 'max_lon': bbox[2], 'max_lat': bbox[3],
+            }
+            reference_clusters = None
+            for strategy in order:
+                if strategy == 'kmeans':
+                    k = reference_clusters if args.k == 'auto' and reference_clusters else (5 if args.k == 'auto' else int(args.k))
+                    params['k'] = max(1, min(k, size))
+
+                stage_name = f"{strategy}@{size}"
+                try:
+                    with metrics.stage(stage_name) as stage:
+                        result = run_strategy(conn, strategy, params, args.repeat)
+                        if strategy == args.reference:
+                            reference_clusters = result['clusters']
+                            result['ari'] = 1.0
+                        else:
+                            result['ari'] = agreement(conn, strategy, args.reference)
+                        stage.add_rows(size)
+                        stage.extra.update(result)
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    print(f"{stage_name}: failed ({str(e).strip()})")
+                    results.append({'strategy': strategy, 'size': size, 'error': str(e).strip()})
+                    continue
+
+                result.update(strategy=strategy, size=size)
+                results.append(result)
+                print(f"{strategy:>12} {size:>9}: {result['seconds']:8.3f}s "
+                      f"(min {result['seconds_min']:.3f}, max {result['seconds_max']:.3f}), "
+                      f"{result['clusters']} clusters, ARI {result['ari']:.3f}, "
+                      f"{result['shared_hit_blocks'] + result['shared_read_blocks']} buffers, "
+                      f"{result['temp_written_blocks']} temp blocks, {result['plan_memory_kb']} kB plan memory")
+    finally:
+        if not args.keep:
+            cur = conn.cursor()
+            conn.rollback()
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            conn.commit()
+            cur.close()
+        conn.close()
+        metrics.save()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
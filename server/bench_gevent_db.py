@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Show whether concurrent queries overlap under gevent.
+
+Runs the same batch of slow queries from N greenlets twice: once with
+plain blocking psycopg2 and once with the gevent wait callback installed
+(gevent_psycopg.py). With blocking psycopg2 the queries queue behind each
+other and the batch takes about N times one query; with the callback they
+overlap and the batch takes about as long as the slowest query.
+
+    python bench_gevent_db.py --concurrency 20 --query sleep --seconds 0.5
+    python bench_gevent_db.py --concurrency 20 --query bbox
+"""
+from gevent import monkey  # type: ignore
+monkey.patch_all()
+
+import argparse
+import time
+import gevent # type: ignore
+import psycopg2 # type: ignore
+
+from gevent_psycopg import patch_psycopg, unpatch_psycopg
+
+DSN = "dbname=osm_points user=postgres"
+
+# A wide bbox around Thessaloniki, large enough to make the count slow
+BBOX = (22.5, 40.3, 23.4, 40.9)
+
+def make_query(kind, seconds):
+    if kind == 'sleep':
+        return "SELECT pg_sleep(%s)", (seconds,)
+    return """
+        SELECT COUNT(*), ST_Extent(geom)
+        FROM osm_points
+        WHERE geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
+    """, BBOX
+
+def run_batch(concurrency, sql, params):
+    # Fresh connections, so they pick up the current wait callback
+    conns = [psycopg2.connect(DSN) for _ in range(concurrency)]
+    latencies = []
+
+    def worker(conn):
+        start = time.perf_counter()
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        cur.fetchall()
+        cur.close()
+        latencies.append(time.perf_counter() - start)
+
+    try:
+        start = time.perf_counter()
+        gevent.joinall([gevent.spawn(worker, conn) for conn in conns], raise_error=True)
+        elapsed = time.perf_counter() - start
+    finally:
+        for conn in conns:
+            conn.close()
+    return elapsed, latencies
+
+def report(mode, elapsed, latencies):
+    latencies.sort()
+    busy = sum(latencies)
+    print(f"{mode:>12}: batch {elapsed:.3f}s, query mean {busy / len(latencies):.3f}s, "
+          f"max {latencies[-1]:.3f}s, overlap {busy / elapsed:.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare blocking and cooperative psycopg2 under gevent")
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--query', choices=['sleep', 'bbox'], default='sleep')
+    parser.add_argument('--seconds', type=float, default=0.5, help="pg_sleep duration for --query sleep")
+    args = parser.parse_args()
+
+    sql, params = make_query(args.query, args.seconds)
+    print(f"{args.concurrency} concurrent '{args.query}' queries")
+
+    unpatch_psycopg()
+    report('blocking', *run_batch(args.concurrency, sql, params))
+
+    patch_psycopg()
+    report('cooperative', *run_batch(args.concurrency, sql, params))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Benchmark the gevent server (api.py) against the asyncio one (api_async.py).
+
+Both servers must already be running, e.g.
+
+    python api.py --port 8080 --no-ssl
+    python api_async.py --port 8081 --no-ssl
+    python bench_servers.py --server gevent=http://localhost:8080 --server asyncio=http://localhost:8081
+
+Each server gets the same read-only request mix (points, cities, and
+clusters with and without ranking around Thessaloniki, from the generators
+in test.py) at every concurrency level, and the throughput and latency
+percentiles are printed side by side. --check first sends an identical set of requests to every
+server and compares the response bodies.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import aiohttp # type: ignore
+
+from load_test import percentile
+from test import random_bbox_near_thessaloniki, random_location_near_thessaloniki
+
+ENDPOINTS = ('points', 'cities', 'clusters', 'ranked_clusters')
+
+def make_request(endpoint):
+    if endpoint in ('clusters', 'ranked_clusters'):
+        loc1 = random_location_near_thessaloniki()
+        loc2 = random_location_near_thessaloniki()
+        params = {
+            'lon1': loc1['longitude'], 'lat1': loc1['latitude'],
+            'lon2': loc2['longitude'], 'lat2': loc2['latitude'],
+        }
+        if endpoint == 'ranked_clusters':
+            params.update(top=5, score=random.choice(('max', 'sum')))
+        return '/api/clusters', params
+    return f'/api/{endpoint}', random_bbox_near_thessaloniki()
+
+def make_requests(count, endpoints, seed):
+    random.seed(seed)
+    return [make_request(random.choice(endpoints)) for _ in range(count)]
+
+async def run_level(base_url, requests, concurrency, timeout):
+    latencies = []
+    errors = 0
+    queue = list(reversed(requests))
+
+    async def worker(session):
+        nonlocal errors
+        while queue:
+            path, params = queue.pop()
+            start = time.perf_counter()
+            try:
+                async with session.get(base_url + path, params=params) as resp:
+                    await resp.read()
+                    if resp.status != 200:
+                        errors += 1
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                # A request over --timeout counts as failed, like a refused one
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+async def check_parity(servers, requests, timeout):
+    """Send every request to every server and report the ones whose bodies differ."""
+    mismatches = 0
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        for path, params in requests:
+            bodies = {}
+            for name, base_url in servers:
+                async with session.get(base_url + path, params=params) as resp:
+                    bodies[name] = (resp.status, json.loads(await resp.read()))
+            reference_name, reference = next(iter(bodies.items()))
+            for name, body in bodies.items():
+                if body != reference:
+                    mismatches += 1
+                    print(f"Mismatch on {path} {params}: {reference_name} returned {reference[0]}, {name} returned {body[0]}")
+    print(f"Parity check: {len(requests)} requests, {mismatches} mismatches")
+    return mismatches == 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API servers side by side")
+    parser.add_argument('--server', action='append', required=True, metavar='NAME=URL',
+                        help="server to benchmark, may be repeated")
+    parser.add_argument('--concurrency', default='1,8,32,128', help="comma separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=2000, help="requests per server and concurrency level")
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help="comma separated request mix")
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--check', action='store_true', help="compare response bodies before benchmarking")
+    parser.add_argument('--output', help="write the results to a JSON file")
+    args = parser.parse_args()
+
+    servers = [tuple(spec.split('=', 1)) for spec in args.server]
+    endpoints = args.endpoints.split(',')
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    if args.check and not asyncio.run(check_parity(servers, make_requests(100, endpoints, args.seed), args.timeout)):
+        raise SystemExit(1)
+
+    results = []
+    print(f"{'server':>10} {'conc':>5} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for concurrency in levels:
+        for name, base_url in servers:
+            # The same requests for every server at a given level
+            requests = make_requests(args.requests, endpoints, args.seed + concurrency)
+            result = asyncio.run(run_level(base_url, requests, concurrency, args.timeout))
+            result.update(server=name, concurrency=concurrency)
+            results.append(result)
+            print(f"{name:>10} {concurrency:>5} {result['rps']:>9.1f} {result['p50_ms']:>9.1f} "
+                  f"{result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['errors']:>7}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
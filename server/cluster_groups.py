@@ -0,0 +1,78 @@
+"""Response bodies of the /api/clusters routes, shared by api.py and api_async.py.
+
+The servers fetch the nearest cities and their clusters each in their own
+way; everything from the rows to the response body lives here, so both
+answer byte for byte the same (bench_servers.py --check compares them).
+api_async.py can't import api.py, which patches the process for gevent.
+"""
+from contextlib import nullcontext
+
+from fair_ranking import METHODS as RANKING_METHODS, rank_clusters
+
+def valid_location(lon, lat):
+    return -180 <= lon <= 180 and -90 <= lat <= 90
+
+def parse_ranking(args):
+    """(top, score) from request parameters; top is None when no ranking is asked for."""
+    top = int(args['top']) if args.get('top') is not None else None
+    score = args.get('score', 'max')
+    if top is not None and top < 1:
+        raise ValueError('top must be positive')
+    if score not in RANKING_METHODS:
+        raise ValueError(f"score must be one of {', '.join(RANKING_METHODS)}")
+    return top, score
+
+def distinct_city_ids(cities):
+    """Ids of the nearest-city rows, duplicates dropped, in row order."""
+    return list(dict.fromkeys(city['id'] for city in cities))
+
+def group_by_city(city_ids, clusters):
+    """{city id: clusters} from the cluster rows of the given cities."""
+    grouped = {city_id: [] for city_id in city_ids}
+    for cluster in clusters:
+        grouped[cluster['city_id']].append(cluster)
+    return grouped
+
+def group_clusters(locations, cities, clusters_by_city, top=None, score='max', phase=nullcontext):
+    """The response body for one group of locations from their nearest cities' clusters.
+
+    phase(name) times the ranking, e.g. metrics.phase in api.py.
+    """
+    if not cities:
+        # If no cities, return empty response
+        return {
+            'count': 0,
+            'message': 'No cities found near the specified locations',
+            'clusters': []
+        }
+
+    # Remove duplicate cities, in the order of the locations; clusters stay
+    # ordered by size, largest first
+    city_names = dict.fromkeys(city['name'] for city in cities)
+    city_ids = dict.fromkeys(city['id'] for city in cities)
+    clusters = sorted((cluster for city_id in city_ids for cluster in clusters_by_city[city_id]),
+                      key=lambda cluster: cluster['point_count'], reverse=True)
+
+    if top is not None:
+        with phase('rank'):
+            clusters = rank_clusters(clusters, locations, score, top)
+
+    # Group clusters by city, without the city_name of each cluster to avoid redundancy
+    clusters_by_name = {city_name: [] for city_name in city_names}
+    for cluster in clusters:
+        if cluster['city_name'] in clusters_by_name:
+            clusters_by_name[cluster['city_name']].append(
+                {key: value for key, value in cluster.items() if key != 'city_name'})
+
+    response = {
+        'count': len(clusters),
+        'cities': [
+            {'name': name, 'clusters': clusters_by_name[name]} for name in city_names
+            # A ranked response leaves out the cities none of the top clusters are in
+            if top is None or clusters_by_name[name]
+        ],
+        'locations': [{'longitude': lon, 'latitude': lat} for lon, lat in locations]
+    }
+    if top is not None:
+        response['ranking'] = {'score': score, 'top': top}
+    return response
@@ -0,0 +1,48 @@
+import os
+import uuid
+import pytest
+
+# A PostgreSQL to run the database tests against, e.g. "host=/tmp user=postgres";
+# PostGIS is not needed. Without it those tests are skipped.
+TEST_DSN = os.environ.get('NEAR_TEST_DSN')
+
+@pytest.fixture(scope='session')
+def api_module(tmp_path_factory):
+    """api.py on a small synthetic in-memory dataset (see storage.py), imported on first use."""
+    os.environ['NEAR_STORAGE'] = 'memory'
+    os.environ.setdefault('SYNTHETIC_POINTS', '20000')
+    # api.py writes app.log to the working directory when imported
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('api'))
+    try:
+        import api
+    finally:
+        os.chdir(cwd)
+    return api
+
+@pytest.fixture
+def api_client(api_module):
+    return api_module.app.test_client()
+
+@pytest.fixture
+def pg_connect():
+    """connect() opening connections into a scratch schema that is dropped afterwards."""
+    if not TEST_DSN:
+        pytest.skip("NEAR_TEST_DSN is not set")
+    import psycopg2 # type: ignore
+    schema = f"test_{uuid.uuid4().hex[:8]}"
+    admin = psycopg2.connect(TEST_DSN)
+    admin.autocommit = True
+    admin.cursor().execute(f"CREATE SCHEMA {schema}")
+    conns = []
+
+    def connect():
+        conn = psycopg2.connect(TEST_DSN, options=f"-c search_path={schema}")
+        conns.append(conn)
+        return conn
+
+    yield connect
+    for conn in conns:
+        conn.close()
+    admin.cursor().execute(f"DROP SCHEMA {schema} CASCADE")
+    admin.close()
@@ -1,6 +1,7 @@
 import psycopg2 # type: ignore
 from psycopg2.extras import DictCursor # type: ignore
 import time
+from run_metrics import RunMetrics
 
 # DBSCAN parameters - final working values
 EPS = 0.0005
@@ -64,9 +65,28 @@ def check_database(conn):
     
     cur.close()
 
-def process_city(conn, city_id, city_name, city_geom_wkt):
-    """Process clustering for a single city."""
+def fetch_cities(conn):
+    """Fetch every city with a geometry, ordered by name."""
+    cur = conn.cursor(cursor_factory=DictCursor)
+    cur.execute("""
+        SELECT name, id, ST_AsText(geom) as geom_wkt
+        FROM cities
+        WHERE geom IS NOT NULL
+        ORDER BY name
+    """)
+    cities = cur.fetchall()
+    cur.close()
+    return cities
+
+def process_city(conn, city_id, city_name, city_geom_wkt, metrics=None):
+    """Process clustering for a single city and return the number of clusters created.
+
+    The clusters are committed as a single transaction; on failure the
+    transaction is rolled back and the exception is re-raised so the caller
+    can record it.
+    """
     try:
+        start_time = time.time()
         cur = conn.cursor()
                 
         # Perform DBSCAN clustering
@@ -96,35 +116,47 @@ def process_city(conn, city_id, city_name, city_geom_wkt):
             FROM clustered
             WHERE cluster_id IS NOT NULL
             GROUP BY cluster_id
+        ),
+        inserted AS (
+            INSERT INTO poi_clusters (city_id, cluster_id, point_count, geom)
+            SELECT %s, cluster_id, point_count, center
+            FROM final
+            RETURNING cluster_id, point_count
         )
-        INSERT INTO poi_clusters (city_id, cluster_id, point_count, geom)
-        SELECT %s, cluster_id, point_count, center
-        FROM final
-        RETURNING cluster_id, point_count;
+        SELECT
+            (SELECT COUNT(*) FROM contained_points) AS points_scanned,
+            COUNT(*) AS total_clusters,
+            COALESCE(SUM(point_count), 0) AS total_points
+        FROM inserted;
         """
         
         cur.execute(clustering_query, (city_geom_wkt, EPS, MIN_POINTS, city_id))
-        clusters = cur.fetchall()
+        points_scanned, total_clusters, total_points = cur.fetchone()
         
         conn.commit()
         
-        if clusters:
-            total_clusters = len(clusters)
-            total_points = sum(cluster[1] for cluster in clusters)
+        if total_clusters:
             print(f"Created {total_clusters} clusters with {total_points} points for {city_name}")
         else:
             print(f"No clusters formed for {city_name}")
         
+        if metrics:
+            metrics.record_city(city_id, city_name, time.time() - start_time,
+                                points_scanned, total_clusters, total_points)
+        
         cur.close()
+        return total_clusters
         
     except Exception as e:
         print(f"Error processing {city_name}: {e}")
         conn.rollback()
+        raise
 
 def main():
     start_time = time.time()
     print(f"Starting clustering process")
     print(f"Parameters: EPS={EPS}, MIN_POINTS={MIN_POINTS}")
+    metrics = RunMetrics('create_clusters', params={'eps': EPS, 'min_points': MIN_POINTS})
     
     try:
         conn = connect_db()
@@ -136,14 +168,7 @@ def main():
         check_database(conn)
         
         # Get all unique city names
-        cur = conn.cursor(cursor_factory=DictCursor)
-        cur.execute("""
-            SELECT name, id, ST_AsText(geom) as geom_wkt
-            FROM cities
-            WHERE geom IS NOT NULL
-            ORDER BY name
-        """)
-        cities = cur.fetchall()
+        cities = fetch_cities(conn)
         
         if not cities:
             print("No cities found in database!")
@@ -153,21 +178,29 @@ def main():
         
         # Process each city
         processed_count = 0
-        for city in cities:
-            city_name, city_id, city_geom_wkt = city['name'], city['id'], city['geom_wkt']
+        failed_cities = []
+        with metrics.stage('create_clusters') as stage:
+            for city in cities:
+                city_name, city_id, city_geom_wkt = city['name'], city['id'], city['geom_wkt']
 
-            # if city_name != "ΘΕΣΣΑΛΟΝΙΚΗΣ":
-            #     continue
+                # if city_name != "ΘΕΣΣΑΛΟΝΙΚΗΣ":
+                #     continue
 
-            print(f"\nProcessing city {processed_count+1}/{len(cities)}: {city_name}")
-            process_city(conn, city_id, city_name, city_geom_wkt)
-            processed_count += 1
-            
-            # Show progress every 10 cities
-            if processed_count % 10 == 0:
-                print(f"Progress: {processed_count}/{len(cities)} cities processed")
+                print(f"\nProcessing city {processed_count+1}/{len(cities)}: {city_name}")
+                try:
+                    stage.add_rows(process_city(conn, city_id, city_name, city_geom_wkt, metrics))
+                except Exception:
+                    # Already reported by process_city, keep going with the next city
+                    failed_cities.append(city_name)
+                processed_count += 1
+                
+                # Show progress every 10 cities
+                if processed_count % 10 == 0:
+                    print(f"Progress: {processed_count}/{len(cities)} cities processed")
+            stage.extra['failed_cities'] = failed_cities
         
         # Get final statistics
+        cur = conn.cursor()
         cur.execute("SELECT COUNT(*) FROM poi_clusters")
         total_clusters = cur.fetchone()[0]
         
@@ -178,6 +211,8 @@ def main():
         print("\n=== Summary ===")
         print(f"Time: {elapsed_time:.2f} seconds")
         print(f"Cities processed: {processed_count}")
+        if failed_cities:
+            print(f"Cities failed: {len(failed_cities)} ({', '.join(failed_cities)})")
         print(f"Total clusters: {total_clusters}")
         print(f"Total points in clusters: {total_clustered_points}")
         
@@ -188,6 +223,7 @@ def main():
         if 'conn' in locals():
             conn.close()
             print("Database connection closed")
+        metrics.save()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,194 @@
+"""Bounded PostgreSQL connection pool that waits instead of failing.
+
+psycopg2's ThreadedConnectionPool raises as soon as maxconn connections
+are checked out. This pool queues callers in arrival order instead and
+hands every returned connection straight to the longest waiting caller,
+failing with PoolTimeout only after the configured wait. Connections that
+sat idle for a while are checked with a trivial query before being handed
+out, and broken ones are replaced.
+
+The pool only uses threading primitives, so under gevent's monkey
+patching waiting callers are parked greenlets rather than blocked threads.
+"""
+import threading
+import time
+from collections import deque
+import psycopg2 # type: ignore
+from psycopg2 import extensions # type: ignore
+
+class PoolTimeout(Exception):
+    """No connection became available within the wait timeout."""
+
+class _Waiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.conn = None
+        # Set instead of conn when the waiter may open a connection of its own
+        self.may_connect = False
+
+class BoundedConnectionPool:
+    def __init__(self, dsn, minconn=1, maxconn=20, timeout=5.0, health_check_after=30.0):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+
+        self._lock = threading.Lock()
+        self._idle = deque()  # (conn, returned_at), most recently returned on the right
+        self._waiters = deque()
+        self._size = 0  # open connections, including checked out and being opened
+        self._in_use = 0
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.created = 0
+        self.discarded = 0
+        self.health_check_failures = 0
+
+        for _ in range(minconn):
+            self._size += 1
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(self.dsn)
+        except Exception:
+            with self._lock:
+                self._size -= 1
+                self._pass_slot()
+            raise
+        with self._lock:
+            self.created += 1
+        return conn
+
+    def _pass_slot(self):
+        # Called with the lock held after a connection slot freed up
+        if self._waiters and self._size < self.maxconn:
+            waiter = self._waiters.popleft()
+            waiter.may_connect = True
+            self._size += 1
+            waiter.event.set()
+
+    def _healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_after:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            self.health_check_failures += 1
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._size -= 1
+            self.discarded += 1
+            self._pass_slot()
+
+    def getconn(self, timeout=None):
+        """Check out a connection, waiting up to `timeout` seconds (the pool default if None)."""
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        while True:
+            waiter = None
+            conn = None
+            connect = False
+            with self._lock:
+                if self._idle and not self._waiters:
+                    conn, idle_since = self._idle.pop()
+                elif self._size < self.maxconn and not self._waiters:
+                    self._size += 1
+                    connect = True
+                else:
+                    waiter = _Waiter()
+                    self._waiters.append(waiter)
+
+            if waiter is not None:
+                remaining = max(0.0, timeout - (time.monotonic() - start))
+                waiter.event.wait(remaining)
+                with self._lock:
+                    if waiter.conn is None and not waiter.may_connect:
+                        # Not served in time; a waiter served concurrently keeps its connection
+                        self._waiters.remove(waiter)
+                        self.timeouts += 1
+                        raise PoolTimeout(f"No database connection available within {timeout:.1f}s")
+                conn = waiter.conn
+                connect = waiter.may_connect
+                idle_since = time.monotonic()
+
+            if connect:
+                conn = self._connect()
+            elif not self._healthy(conn, idle_since):
+                self._discard(conn)
+                continue
+
+            waited = time.monotonic() - start
+            with self._lock:
+                self._in_use += 1
+                self.checkouts += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection; it is rolled back, or closed if it is broken."""
+        if not close and not conn.closed:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    close = True
+
+        with self._lock:
+            self._in_use -= 1
+
+        if close or conn.closed:
+            self._discard(conn)
+            return
+
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.conn = conn
+                waiter.event.set()
+            else:
+                self._idle.append((conn, time.monotonic()))
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+        for conn, _ in idle:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self._size,
+                'max_size': self.maxconn,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': len(self._waiters),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': round(self.wait_seconds_total, 6),
+                'wait_seconds_max': round(self.wait_seconds_max, 6),
+                'created': self.created,
+                'discarded': self.discarded,
+                'health_check_failures': self.health_check_failures,
+            }
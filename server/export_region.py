@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""Export region packages: gzipped GeoPackages the app can bootstrap from.
+
+A package holds the same tables SpatialDb creates on the device: `pois`
+(id, geopoint POINT UNIQUE, with its rtree index) and `cells_pois`
+(cell_lon, cell_lat), with every 0.005 degree download cell of the region
+already listed, so the app treats the whole region as downloaded. The
+region is widened to whole cells, and every POI of those cells is included.
+
+    python export_region.py --city Thessaloniki
+    python export_region.py --bbox 22.85 40.55 23.05 40.70 --name thessaloniki-center
+    python export_region.py --all-cities --out-dir regions
+
+Packages are written to <out-dir>/<name>.gpkg.gz and served by api.py at
+/api/regions when REGION_PACKAGE_DIR points at the same directory.
+"""
+import argparse
+import gzip
+import math
+import os
+import re
+import shutil
+import sqlite3
+import struct
+import tempfile
+import time
+
+from create_clusters import connect_db
+
+OUT_DIR = 'regions'
+# Cell size of SpatialDb.downloadCellsInArea on the client
+GRID_SIZE = 0.005
+FETCH_SIZE = 50000
+
+GPKG_APPLICATION_ID = 0x47504B47  # 'GPKG'
+GPKG_USER_VERSION = 10200
+
+WGS84_DEFINITION = (
+    'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,'
+    'AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,'
+    'AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],'
+    'AUTHORITY["EPSG","4326"]]'
+)
+
+def point_blob(lon, lat, srid=4326):
+    """GeoPackage geometry blob of a point: header without envelope, then little-endian WKB."""
+    return b'GP' + struct.pack('<BBi', 0, 0x01, srid) + struct.pack('<BIdd', 1, 1, lon, lat)
+
+def point_bounds(blob):
+    """(minx, maxx, miny, maxy) of a blob written by point_blob()."""
+    lon, lat = struct.unpack_from('<dd', blob, 13)
+    return lon, lon, lat, lat
+
+def slugify(name):
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-') or 'region'
+
+def snap_to_cells(min_lon, min_lat, max_lon, max_lat, grid_size=GRID_SIZE):
+    """Inclusive (x0, y0, x1, y1) client cell range covering a bbox."""
+    return (math.floor(min_lon / grid_size), math.floor(min_lat / grid_size),
+            math.floor(max_lon / grid_size), math.floor(max_lat / grid_size))
+
+def create_package(path):
+    db = sqlite3.connect(path)
+    # A scratch file until it is compressed; nothing to recover after a crash
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute(f"PRAGMA application_id = {GPKG_APPLICATION_ID}")
+    db.execute(f"PRAGMA user_version = {GPKG_USER_VERSION}")
+    db.executescript("""
+        CREATE TABLE gpkg_spatial_ref_sys (
+            srs_name TEXT NOT NULL,
+            srs_id INTEGER PRIMARY KEY,
+            organization TEXT NOT NULL,
+            organization_coordsys_id INTEGER NOT NULL,
+            definition TEXT NOT NULL,
+            description TEXT
+        );
+        CREATE TABLE gpkg_contents (
+            table_name TEXT NOT NULL PRIMARY KEY,
+            data_type TEXT NOT NULL,
+            identifier TEXT UNIQUE,
+            description TEXT DEFAULT '',
+            last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+            min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE,
+            srs_id INTEGER,
+            CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id)
+        );
+        CREATE TABLE gpkg_geometry_columns (
+            table_name TEXT NOT NULL,
+            column_name TEXT NOT NULL,
+            geometry_type_name TEXT NOT NULL,
+            srs_id INTEGER NOT NULL,
+            z TINYINT NOT NULL,
+            m TINYINT NOT NULL,
+            CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+            CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+            CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id)
+        );
+        CREATE TABLE gpkg_extensions (
+            table_name TEXT,
+            column_name TEXT,
+            extension_name TEXT NOT NULL,
+            definition TEXT NOT NULL,
+            scope TEXT NOT NULL,
+            CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name)
+        );
+        CREATE TABLE pois (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            geopoint POINT UNIQUE
+        );
+        CREATE TABLE cells_pois (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cell_lon INTEGER,
+            cell_lat INTEGER
+        );
+    """)
+    db.executemany("INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)", [
+        ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', 'undefined cartesian coordinate reference system'),
+        ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', 'undefined geographic coordinate reference system'),
+        ('WGS 84 geodetic', 4326, 'EPSG', 4326, WGS84_DEFINITION, 'longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid'),
+    ])
+    return db
+
+def add_rtree(db, table, column):
+    """The GeoPackage rtree index of a point column, filled from the table, plus its triggers."""
+    rtree = f"rtree_{table}_{column}"
+    db.execute(f"CREATE VIRTUAL TABLE {rtree} USING rtree(id, minx, maxx, miny, maxy)")
+    db.executemany(f"INSERT INTO {rtree} VALUES (?, ?, ?, ?, ?)", (
+        (row_id, *point_bounds(blob)) for row_id, blob in db.execute(f"SELECT id, {column} FROM {table}")
+    ))
+    db.execute("""
+        INSERT INTO gpkg_extensions VALUES (?, ?, 'gpkg_rtree_index', 'http://www.geopackage.org/spec120/#extension_rtree', 'write-only')
+    """, (table, column))
+    # The standard triggers, so edits made on the device keep the index in sync
+    db.executescript(f"""
+        CREATE TRIGGER {rtree}_insert AFTER INSERT ON {table}
+        WHEN (new.{column} NOT NULL AND NOT ST_IsEmpty(NEW.{column}))
+        BEGIN
+            INSERT OR REPLACE INTO {rtree} VALUES (
+                NEW.id, ST_MinX(NEW.{column}), ST_MaxX(NEW.{column}), ST_MinY(NEW.{column}), ST_MaxY(NEW.{column})
+            );
+        END;
+        CREATE TRIGGER {rtree}_update1 AFTER UPDATE OF {column} ON {table}
+        WHEN OLD.id = NEW.id AND (NEW.{column} NOTNULL AND NOT ST_IsEmpty(NEW.{column}))
+        BEGIN
+            INSERT OR REPLACE INTO {rtree} VALUES (
+                NEW.id, ST_MinX(NEW.{column}), ST_MaxX(NEW.{column}), ST_MinY(NEW.{column}), ST_MaxY(NEW.{column})
+            );
+        END;
+        CREATE TRIGGER {rtree}_update2 AFTER UPDATE OF {column} ON {table}
+        WHEN OLD.id = NEW.id AND (NEW.{column} ISNULL OR ST_IsEmpty(NEW.{column}))
+        BEGIN
+            DELETE FROM {rtree} WHERE id = OLD.id;
+        END;
+        CREATE TRIGGER {rtree}_update3 AFTER UPDATE ON {table}
+        WHEN OLD.id != NEW.id AND (NEW.{column} NOTNULL AND NOT ST_IsEmpty(NEW.{column}))
+        BEGIN
+            DELETE FROM {rtree} WHERE id = OLD.id;
+            INSERT OR REPLACE INTO {rtree} VALUES (
+                NEW.id, ST_MinX(NEW.{column}), ST_MaxX(NEW.{column}), ST_MinY(NEW.{column}), ST_MaxY(NEW.{column})
+            );
+        END;
+        CREATE TRIGGER {rtree}_update4 AFTER UPDATE ON {table}
+        WHEN OLD.id != NEW.id AND (NEW.{column} ISNULL OR ST_IsEmpty(NEW.{column}))
+        BEGIN
+            DELETE FROM {rtree} WHERE id IN (OLD.id, NEW.id);
+        END;
+        CREATE TRIGGER {rtree}_delete AFTER DELETE ON {table}
+        WHEN old.{column} NOT NULL
+        BEGIN
+            DELETE FROM {rtree} WHERE id = OLD.id;
+        END;
+    """)
+
+def fetch_points(conn, min_lon, min_lat, max_lon, max_lat):
+    """Stream the (lon, lat) of the POIs in a bbox, nearby points together."""
+    cur = conn.cursor(name='export_region')
+    cur.itersize = FETCH_SIZE
+    cur.execute("""
+        SELECT ST_X(geom), ST_Y(geom)
+        FROM osm_points
+        WHERE geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
+        ORDER BY ST_GeoHash(geom, 10)
+    """, (min_lon, min_lat, max_lon, max_lat))
+    yield from cur
+    cur.close()
+
+def export_region(conn, name, min_lon, min_lat, max_lon, max_lat, out_dir=OUT_DIR):
+    """Write <out_dir>/<name>.gpkg.gz for a bbox; returns (path, points, cells)."""
+    start = time.time()
+    x0, y0, x1, y1 = snap_to_cells(min_lon, min_lat, max_lon, max_lat)
+    # Whole cells, so the cells listed in cells_pois are complete
+    bounds = (x0 * GRID_SIZE, y0 * GRID_SIZE, (x1 + 1) * GRID_SIZE, (y1 + 1) * GRID_SIZE)
+
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{name}.gpkg.gz")
+    with tempfile.TemporaryDirectory(dir=out_dir) as tmp:
+        gpkg_path = os.path.join(tmp, f"{name}.gpkg")
+        db = create_package(gpkg_path)
+
+        db.executemany("INSERT OR IGNORE INTO pois (geopoint) VALUES (?)", (
+            (point_blob(lon, lat),) for lon, lat in fetch_points(conn, *bounds)
+        ))
+        points = db.execute("SELECT COUNT(*) FROM pois").fetchone()[0]
+        db.executemany("INSERT INTO cells_pois (cell_lon, cell_lat) VALUES (?, ?)", (
+            (x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)
+        ))
+        cells = (x1 - x0 + 1) * (y1 - y0 + 1)
+        add_rtree(db, 'pois', 'geopoint')
+
+        db.executemany("""
+            INSERT INTO gpkg_contents (table_name, data_type, identifier, description, min_x, min_y, max_x, max_y, srs_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            ('pois', 'features', 'pois', f"POIs of {name}", *bounds, 4326),
+            ('cells_pois', 'attributes', 'cells_pois', f"{GRID_SIZE} degree download cells of {name}", *bounds, None),
+        ])
+        db.execute("INSERT INTO gpkg_geometry_columns VALUES ('pois', 'geopoint', 'POINT', 4326, 0, 0)")
+        db.commit()
+        db.execute("VACUUM")
+        db.close()
+
+        partial = path + '.partial'
+        with open(gpkg_path, 'rb') as src, gzip.open(partial, 'wb', compresslevel=9) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+        os.replace(partial, path)
+
+    print(f"{name}: {points} points, {cells} cells, {os.path.getsize(path) / 1e6:.1f} MB in {time.time() - start:.1f}s")
+    return path, points, cells
+
+def fetch_city_bboxes(conn, city=None):
+    """(id, name, min_lon, min_lat, max_lon, max_lat) of one city by id or name, or of all of them."""
+    cur = conn.cursor()
+    query = """
+        SELECT id, name, ST_XMin(geom), ST_YMin(geom), ST_XMax(geom), ST_YMax(geom)
+        FROM cities
+    """
+    if city is None:
+        cur.execute(query + " ORDER BY id")
+    elif city.isdigit():
+        cur.execute(query + " WHERE id = %s", (int(city),))
+    else:
+        cur.execute(query + " WHERE name = %s", (city,))
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+def export_cities(conn, city=None, out_dir=OUT_DIR):
+    cities = fetch_city_bboxes(conn, city)
+    if not cities:
+        raise SystemExit(f"No city matching {city!r}")
+    for city_id, city_name, *bbox in cities:
+        export_region(conn, f"{city_id}-{slugify(city_name)}", *bbox, out_dir=out_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export gzipped GeoPackage region packages for the app")
+    region = parser.add_mutually_exclusive_group(required=True)
+    region.add_argument('--city', help="city id or exact name")
+    region.add_argument('--all-cities', action='store_true', help="one package per city")
+    region.add_argument('--bbox', nargs=4, type=float, metavar=('MIN_LON', 'MIN_LAT', 'MAX_LON', 'MAX_LAT'))
+    parser.add_argument('--name', help="package name for --bbox")
+    parser.add_argument('--out-dir', default=OUT_DIR)
+    args = parser.parse_args()
+
+    if args.bbox and not args.name:
+        parser.error("--bbox needs --name")
+
+    conn = connect_db()
+    try:
+        if args.bbox:
+            export_region(conn, slugify(args.name), *args.bbox, out_dir=args.out_dir)
+        else:
+            export_cities(conn, args.city, out_dir=args.out_dir)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Rank clusters as meeting points for a group of people.
+
+A cluster's cost is the great-circle distance, in meters, that the people
+have to travel to it: the longest single trip ('max', the fairest choice)
+or all trips together ('sum', the least total travel). Busier clusters
+make better meeting points, so the score divides the cost by
+point_count ** POPULARITY; the lowest score ranks first.
+"""
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+POPULARITY = 0.5
+METHODS = ('max', 'sum')
+
+def haversine_m(lons, lats, lon, lat):
+    """Distances in meters from arrays of points to one point."""
+    lons, lats = np.radians(lons), np.radians(lats)
+    lon, lat = np.radians(lon), np.radians(lat)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lats) * np.cos(lat) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def rank_clusters(clusters, locations, method='max', top=None, popularity=POPULARITY):
+    """The `top` best clusters for people at `locations` ((lon, lat) pairs), best first.
+
+    Each returned cluster is a copy with `score`, `rank` and `distances`
+    (meters to each location, in order) added.
+    """
+    if method not in METHODS:
+        raise ValueError(f"score must be one of {', '.join(METHODS)}")
+    if not clusters:
+        return []
+    lons = np.array([cluster['longitude'] for cluster in clusters], dtype=np.float64)
+    lats = np.array([cluster['latitude'] for cluster in clusters], dtype=np.float64)
+    counts = np.array([cluster['point_count'] for cluster in clusters], dtype=np.float64)
+
+    distances = np.stack([haversine_m(lons, lats, lon, lat) for lon, lat in locations], axis=1)
+    cost = distances.max(axis=1) if method == 'max' else distances.sum(axis=1)
+    scores = cost / np.maximum(counts, 1) ** popularity
+
+    order = np.argsort(scores, kind='stable')
+    if top is not None:
+        order = order[:top]
+    return [
+        dict(clusters[index], score=float(scores[index]), rank=rank + 1,
+             distances=[round(d, 1) for d in distances[index].tolist()])
+        for rank, index in enumerate(order.tolist())
+    ]
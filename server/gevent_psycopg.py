@@ -0,0 +1,35 @@
+"""Cooperative psycopg2 under gevent.
+
+psycopg2 is a C extension, so monkey.patch_all() cannot make its socket
+I/O cooperative and every query blocks the whole hub. Installing a wait
+callback switches libpq to non-blocking mode: psycopg2 polls the
+connection and this callback parks the greenlet on the socket until it is
+readable or writable, letting other greenlets run meanwhile.
+
+Call patch_psycopg() once, right after monkey.patch_all() and before any
+connection is opened.
+"""
+import psycopg2 # type: ignore
+from psycopg2 import extensions # type: ignore
+from gevent.socket import wait_read, wait_write # type: ignore
+
+def gevent_wait_callback(conn, timeout=None):
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state!r}")
+
+def patch_psycopg():
+    """Make every psycopg2 connection yield to the gevent hub while waiting on the server."""
+    if not hasattr(extensions, 'set_wait_callback'):
+        raise ImportError("psycopg2 2.2 or newer is required for gevent support")
+    extensions.set_wait_callback(gevent_wait_callback)
+
+def unpatch_psycopg():
+    extensions.set_wait_callback(None)
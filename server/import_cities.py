@@ -6,6 +6,7 @@ from shapely import wkt # type: ignore
 from psycopg2 import sql # type: ignore
 import pyproj # type: ignore
 import time
+from run_metrics import RunMetrics
 
 def connect_db():
     """Connect to the PostgreSQL database."""
@@ -44,6 +45,7 @@ def drop_and_create_tables(conn):
         conn.rollback()
 
 def insert_city(conn, city_name, city_geometry):
+    """Insert one city; returns False when it could not be transformed or inserted."""
     try:
         cur = conn.cursor()
         try:
@@ -51,7 +53,7 @@ def insert_city(conn, city_name, city_geometry):
             city_wkt = wkt.dumps(city_geometry_wgs84)
         except Exception as e:
             print(f"Error transforming {city_name}: {e}")
-            return
+            return False
         insert_query = sql.SQL("""
         INSERT INTO cities (name, geom)
         VALUES (%s, ST_SetSRID(ST_GeomFromText(%s), 4326))
@@ -59,13 +61,18 @@ def insert_city(conn, city_name, city_geometry):
         cur.execute(insert_query, (city_name, city_wkt))
         conn.commit()
         cur.close()
+        return True
     except Exception as e:
         print(f"Error inserting city {city_name}: {e}")
         conn.rollback()
+        return False
 
-def add_cities_to_db():
-    geojson_file = 'otas.geojson'
+def add_cities_to_db(geojson_file='otas.geojson', metrics=None):
+    """Import the municipality polygons from the GeoJSON file and return the number of cities imported."""
     start_time = time.time()
+    own_metrics = metrics is None
+    if own_metrics:
+        metrics = RunMetrics('import_cities', params={'file': geojson_file})
     try:
         print(f"Reading GeoJSON file: {geojson_file}")
         cities_gdf = gpd.read_file(geojson_file)
@@ -89,21 +96,33 @@ def add_cities_to_db():
                 print(f"Skipping city {city_name} because it's not a Polygon or MultiPolygon but {type(city_geometry)}")
 
         processed_count = 0
-        for city_name, polygons in cities.items():
-            if not polygons:
-                continue
-            unioned = unary_union(polygons)
-            insert_city(conn, city_name, unioned)
-            processed_count += 1
-            if processed_count % 10 == 0:
-                print(f"Progress: {processed_count}/{len(cities)} city names processed")
+        failed_cities = []
+        with metrics.stage('import_cities') as stage:
+            for city_name, polygons in cities.items():
+                if not polygons:
+                    continue
+                unioned = unary_union(polygons)
+                if insert_city(conn, city_name, unioned):
+                    stage.add_rows(1)
+                else:
+                    failed_cities.append(city_name)
+                processed_count += 1
+                if processed_count % 10 == 0:
+                    print(f"Progress: {processed_count}/{len(cities)} city names processed")
+            stage.extra['failed_cities'] = failed_cities
 
         conn.close()
         elapsed_time = time.time() - start_time
         print(f"Import completed in {elapsed_time:.2f} seconds")
-        print(f"Summary: {processed_count} cities imported")
+        imported_count = processed_count - len(failed_cities)
+        print(f"Summary: {imported_count} cities imported, {len(failed_cities)} failed")
+        return imported_count
     except Exception as e:
         print(f"Error in add_cities_to_db: {e}")
+        raise
+    finally:
+        if own_metrics:
+            metrics.save()
 
 if __name__ == "__main__":
     add_cities_to_db()
@@ -1,14 +1,25 @@
+import argparse
 import osmium # type: ignore
 import psycopg2 # type: ignore
 from shapely.geometry import Point # type: ignore
+import poi_versions
+from run_metrics import RunMetrics
+
+PBF_FILE = "greece-latest.osm.pbf"
 
 class NodeHandler(osmium.SimpleHandler):
-    def __init__(self):
+    def __init__(self, store=None):
         super(NodeHandler, self).__init__()
         self.conn = psycopg2.connect("dbname=osm_points user=postgres")
         self.cur = self.conn.cursor()
+        self.store = store
+        self.count = 0
     
     def node(self, n):
+        self.count += 1
+        if self.store:
+            tags = {tag.k: tag.v for tag in n.tags} if len(n.tags) else None
+            self.store.add(n.id, n.location.lon, n.location.lat, tags)
         try:
             self.cur.execute("""
                 INSERT INTO osm_points (id, geom)
@@ -25,9 +36,49 @@ class NodeHandler(osmium.SimpleHandler):
     
     def close(self):
         self.conn.commit()
+        # Nothing here is versioned: synced clients must download their cells again
+        poi_versions.require_resync(self.conn)
+        if self.store:
+            self.store.close()
         self.cur.close()
         self.conn.close()
 
-handler = NodeHandler()
-handler.apply_file("greece-latest.osm.pbf")
-handler.close()
\ No newline at end of file
+def import_pois(pbf_file=PBF_FILE, metrics=None, store_dir=None):
+    """Import every node of the PBF extract into osm_points.
+
+    With store_dir the nodes are also written to the columnar POI store
+    (see poi_store.py), tagged with the city they fall in, so later stages
+    can read them without scanning the database or reparsing the PBF.
+    """
+    own_metrics = metrics is None
+    if own_metrics:
+        metrics = RunMetrics('import_pois', params={'file': pbf_file, 'store': store_dir})
+    store = None
+    conn = psycopg2.connect("dbname=osm_points user=postgres")
+    try:
+        # Imported nodes are not versioned, but apply_diff.py needs the schema
+        poi_versions.create_schema(conn)
+        if store_dir:
+            from poi_store import CityLocator, PoiStoreWriter
+            store = PoiStoreWriter(store_dir, locator=CityLocator(conn))
+    finally:
+        conn.close()
+    handler = NodeHandler(store)
+    try:
+        with metrics.stage('import_pois') as stage:
+            try:
+                handler.apply_file(pbf_file)
+            finally:
+                stage.add_rows(handler.count)
+    finally:
+        handler.close()
+        if own_metrics:
+            metrics.save()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import the OSM nodes of a PBF extract")
+    parser.add_argument('pbf_file', nargs='?', default=PBF_FILE)
+    parser.add_argument('--store', metavar='DIR',
+                        help="also write the columnar POI store to this directory")
+    args = parser.parse_args()
+    import_pois(args.pbf_file, store_dir=args.store)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""Concurrent load test built on the scenarios in test.py.
+
+Drives a weighted mix of scenarios from many concurrent clients against
+any server and reports throughput and latency percentiles per endpoint:
+
+    python load_test.py --base-url http://localhost:8080 --concurrency 32 --duration 30 \\
+        --mix points=5,cities=2,clusters=3,meetings=1 --output before.json
+    python load_test.py --compare before.json after.json
+
+Scenarios:
+    points    GET /api/points for a random bbox near Thessaloniki
+    cities    GET /api/cities for a random bbox
+    clusters  GET /api/clusters for two random locations
+    meetings  the meetings flow from test.py: create, suggest, get, accept
+
+The meetings scenario writes rows into the meetings table, so only point
+it at a server whose database may be written to.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime
+import aiohttp # type: ignore
+
+from test import THESSALONIKI_CENTER, random_bbox_near_thessaloniki, random_location_near_thessaloniki
+
+DEFAULT_MIX = 'points=5,cities=2,clusters=3,meetings=1'
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    async def request(self, session, endpoint, method, url, **kwargs):
+        """Time one request under `endpoint`; returns the decoded JSON body, or None on failure."""
+        start = time.perf_counter()
+        body = None
+        failed = True
+        try:
+            async with session.request(method, url, **kwargs) as resp:
+                data = await resp.read()
+                if resp.status == 200:
+                    body = json.loads(data)
+                    failed = False
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            pass
+        self.latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+        if failed:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return body
+
+    def report(self, elapsed):
+        results = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            results[endpoint] = {
+                'requests': len(latencies),
+                'errors': self.errors.get(endpoint, 0),
+                'rps': len(latencies) / elapsed if elapsed else 0.0,
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p95_ms': percentile(latencies, 95) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+            }
+        return results
+
+async def points_scenario(session, base, rec):
+    await rec.request(session, '/api/points', 'GET', f"{base}/points", params=random_bbox_near_thessaloniki())
+
+async def cities_scenario(session, base, rec):
+    await rec.request(session, '/api/cities', 'GET', f"{base}/cities", params=random_bbox_near_thessaloniki())
+
+async def clusters_scenario(session, base, rec):
+    loc1 = random_location_near_thessaloniki()
+    loc2 = random_location_near_thessaloniki()
+    await rec.request(session, '/api/clusters', 'GET', f"{base}/clusters", params={
+        'lon1': loc1['longitude'], 'lat1': loc1['latitude'],
+        'lon2': loc2['longitude'], 'lat2': loc2['latitude'],
+    })
+
+async def meetings_scenario(session, base, rec):
+    location = dict(THESSALONIKI_CENTER, datetime=datetime.now().isoformat())
+    created = await rec.request(session, '/api/meetings', 'POST', f"{base}/meetings", json=location)
+    if not created:
+        return
+    token = created['meeting']['token']
+
+    location = random_location_near_thessaloniki()
+    location['datetime'] = datetime.now().isoformat()
+    if not await rec.request(session, '/api/meetings/<token>/suggest', 'POST',
+                             f"{base}/meetings/{token}/suggest", json=location):
+        return
+    await rec.request(session, '/api/meetings/<token>', 'GET', f"{base}/meetings/{token}")
+    await rec.request(session, '/api/meetings/<token>/accept', 'POST', f"{base}/meetings/{token}/accept")
+
+SCENARIOS = {
+    'points': points_scenario,
+    'cities': cities_scenario,
+    'clusters': clusters_scenario,
+    'meetings': meetings_scenario,
+}
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{name}', expected one of {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+async def run_load(base_url, mix, concurrency, duration=None, iterations=None, timeout=30, verify_ssl=True):
+    """Run scenarios from `concurrency` clients for `duration` seconds or `iterations` scenarios in total."""
+    base = base_url.rstrip('/') + '/api'
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    rec = Recorder()
+    remaining = iterations
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def client(session):
+        nonlocal remaining
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            if remaining is not None:
+                if remaining <= 0:
+                    return
+                remaining -= 1
+            scenario = SCENARIOS[random.choices(names, weights)[0]]
+            await scenario(session, base, rec)
+
+    connector = aiohttp.TCPConnector(limit=concurrency, ssl=None if verify_ssl else False)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return rec.report(elapsed), elapsed
+
+def print_results(results):
+    print(f"{'endpoint':<32} {'requests':>9} {'errors':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for endpoint, r in results.items():
+        print(f"{endpoint:<32} {r['requests']:>9} {r['errors']:>7} {r['rps']:>9.1f} "
+              f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f}")
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"Comparing {old_path} ({old['started_at']}) with {new_path} ({new['started_at']})")
+    print(f"{'endpoint':<32} {'metric':>7} {'old':>10} {'new':>10} {'change':>9}")
+    for endpoint in sorted(set(old['results']) | set(new['results'])):
+        before = old['results'].get(endpoint)
+        after = new['results'].get(endpoint)
+        if before is None or after is None:
+            print(f"{endpoint:<32} only in {'new' if before is None else 'old'} run")
+            continue
+        for metric in ('rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            change = (after[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+            print(f"{endpoint:<32} {metric:>7} {before[metric]:>10.1f} {after[metric]:>10.1f} {change:>+8.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the API with the test.py scenarios")
+    parser.add_argument('--base-url', default='http://localhost:8080', help="server root, without /api")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="weighted scenarios, e.g. points=5,meetings=1")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30, help="seconds to run for")
+    parser.add_argument('--iterations', type=int, help="run this many scenarios instead of a fixed duration")
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--insecure', action='store_true', help="skip TLS certificate verification")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', help="save the results as JSON")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two saved runs and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    mix = parse_mix(args.mix)
+    started_at = datetime.now().isoformat(timespec='seconds')
+    print(f"Load testing {args.base_url} with {args.concurrency} clients, mix {args.mix}")
+
+    results, elapsed = asyncio.run(run_load(
+        args.base_url, mix, args.concurrency,
+        duration=None if args.iterations else args.duration,
+        iterations=args.iterations, timeout=args.timeout, verify_ssl=not args.insecure,
+    ))
+    print_results(results)
+    total = sum(r['requests'] for r in results.values())
+    print(f"{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} rps)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'started_at': started_at,
+                'base_url': args.base_url,
+                'mix': mix,
+                'concurrency': args.concurrency,
+                'elapsed_seconds': elapsed,
+                'results': results,
+            }, f, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""Prometheus-style request metrics for the Flask API.
+
+Everything is kept in plain ints and floats that are updated in place.
+gevent only switches greenlets on I/O, so the updates need no locks, and
+the per-route series are created once, on the first request to each route.
+A request only allocates its start timer and a few numbers on flask.g.
+
+    import metrics
+    metrics.install(app, pool_stats=lambda: get_db_pool().stats())
+    cur = conn.cursor(cursor_factory=metrics.TimedCursor)
+
+The values are per process: with pre-forked workers each worker reports
+its own series and Prometheus should scrape every worker, or sum them.
+
+With server_timing enabled, every response also carries a Server-Timing
+header with the phases recorded through phase() plus pool wait, total
+database time and the whole request.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import Response, g, has_request_context, request # type: ignore
+from psycopg2.extras import RealDictCursor # type: ignore
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+class RouteMetrics:
+    __slots__ = ('responses', 'latency', 'db_seconds', 'db_queries', 'rows', 'response_bytes')
+
+    def __init__(self):
+        self.responses = {}  # status code -> count
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.db_seconds = Histogram(LATENCY_BUCKETS)
+        self.db_queries = 0
+        self.rows = Histogram(ROW_BUCKETS)
+        self.response_bytes = Histogram(SIZE_BUCKETS)
+
+routes = {}
+pool_wait = Histogram(LATENCY_BUCKETS)
+in_flight = 0
+
+server_timing = False
+# A slow_queries.SlowQueryLog, sampled from TimedCursor when set
+slow_query_log = None
+
+def _route_metrics(endpoint):
+    stats = routes.get(endpoint)
+    if stats is None:
+        stats = routes[endpoint] = RouteMetrics()
+    return stats
+
+def record_pool_wait(seconds):
+    pool_wait.observe(seconds)
+    if server_timing and has_request_context():
+        g.pool_seconds = g.get('pool_seconds', 0.0) + seconds
+
+@contextmanager
+def phase(name):
+    """Time a block of a request as a Server-Timing phase (a no-op when disabled)."""
+    if not server_timing:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if 'timings' not in g:
+            g.timings = []
+        g.timings.append((name, time.perf_counter() - start))
+
+class TimedCursor(RealDictCursor):
+    """RealDictCursor that charges query time and returned rows to the current request."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        finally:
+            elapsed = time.perf_counter() - start
+            if has_request_context():
+                g.db_seconds = g.get('db_seconds', 0.0) + elapsed
+                g.db_queries = g.get('db_queries', 0) + 1
+                if self.description is not None and self.rowcount > 0:
+                    g.db_rows = g.get('db_rows', 0) + self.rowcount
+        if slow_query_log is not None:
+            slow_query_log.observe(query, vars, elapsed, request.endpoint if has_request_context() else None)
+        return result
+
+def _before_request():
+    global in_flight
+    in_flight += 1
+    g.metrics_start = time.perf_counter()
+
+def _after_request(response):
+    start = g.get('metrics_start')
+    if start is None:
+        return response
+
+    stats = _route_metrics(request.endpoint or 'unmatched')
+    stats.responses[response.status_code] = stats.responses.get(response.status_code, 0) + 1
+    stats.latency.observe(time.perf_counter() - start)
+    if 'db_queries' in g:
+        stats.db_queries += g.db_queries
+        stats.db_seconds.observe(g.db_seconds)
+        stats.rows.observe(g.get('db_rows', 0))
+    if response.content_length is None and response.is_streamed:
+        # No length until the body has gone out, e.g. stream_with_context
+        response.response = _count_bytes(response.iter_encoded(), stats.response_bytes)
+    else:
+        stats.response_bytes.observe(response.content_length or 0)
+
+    if server_timing:
+        response.headers['Server-Timing'] = _server_timing(time.perf_counter() - start)
+    return response
+
+def _count_bytes(chunks, histogram):
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        # Also when the client goes away mid-stream and the server closes the body
+        histogram.observe(size)
+
+def _server_timing(total):
+    timings = []
+    if 'pool_seconds' in g:
+        timings.append(('pool', g.pool_seconds))
+    timings += g.get('timings', [])
+    if 'db_seconds' in g:
+        timings.append(('db', g.db_seconds))
+    timings.append(('total', total))
+    return ', '.join(f'{name};dur={seconds * 1000:.2f}' for name, seconds in timings)
+
+def _teardown_request(exc):
+    # Runs even when a view raised, so the gauge cannot drift
+    global in_flight
+    if 'metrics_start' in g:
+        in_flight -= 1
+
+def render(pool_stats=None):
+    # Prometheus wants every sample of a family right after its TYPE line
+    endpoints = sorted(routes.items())
+    lines = ['# TYPE near_http_requests_total counter']
+    for endpoint, stats in endpoints:
+        for status, count in sorted(stats.responses.items()):
+            lines.append(f'near_http_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+    lines.append('# TYPE near_db_queries_total counter')
+    for endpoint, stats in endpoints:
+        lines.append(f'near_db_queries_total{{endpoint="{endpoint}"}} {stats.db_queries}')
+    for name, attr in (('near_http_request_duration_seconds', 'latency'),
+                       ('near_db_query_duration_seconds', 'db_seconds'),
+                       ('near_db_rows_returned', 'rows'),
+                       ('near_http_response_bytes', 'response_bytes')):
+        lines.append(f'# TYPE {name} histogram')
+        for endpoint, stats in endpoints:
+            lines += getattr(stats, attr).render(name, f'endpoint="{endpoint}"')
+
+    lines.append('# TYPE near_http_requests_in_flight gauge')
+    lines.append(f'near_http_requests_in_flight {in_flight}')
+    lines.append('# TYPE near_db_pool_wait_seconds histogram')
+    lines += pool_wait.render('near_db_pool_wait_seconds', 'pool="api"')
+
+    if pool_stats is not None:
+        stats = pool_stats()
+        for key in ('size', 'max_size', 'in_use', 'idle', 'waiting'):
+            lines.append(f'# TYPE near_db_pool_{key} gauge')
+            lines.append(f'near_db_pool_{key} {stats[key]}')
+        for key in ('checkouts', 'timeouts', 'created', 'discarded', 'health_check_failures'):
+            lines.append(f'# TYPE near_db_pool_{key}_total counter')
+            lines.append(f'near_db_pool_{key}_total {stats[key]}')
+    return '\n'.join(lines) + '\n'
+
+def install(app, pool_stats=None, path='/metrics'):
+    """Register the request hooks and the scrape endpoint on a Flask app."""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+    def metrics_endpoint():
+        return Response(render(pool_stats), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule(path, 'metrics', metrics_endpoint)
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""Resumable batch pipeline for the POI database.
+
+Runs the batch stages (city import, POI import, clustering, the poi_grid
+count pyramid) in dependency order and records per-stage and per-city
+checkpoints in the pipeline_runs, pipeline_stages and
+pipeline_city_checkpoints tables.
+
+    python pipeline.py              # resume the last unfinished run or start a new one
+    python pipeline.py --new        # always start a new run
+    python pipeline.py --force create_clusters
+    python pipeline.py status
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import create_clusters
+from create_clusters import connect_db
+from run_metrics import RunMetrics
+
+CITIES_FILE = 'otas.geojson'
+PBF_FILE = 'greece-latest.osm.pbf'
+# Directory of the columnar POI store written during the POI import, None to disable
+POI_STORE_DIR = None
+# Path of the memory-mapped POI snapshot served by api.py, None to disable
+POI_SNAPSHOT_FILE = None
+# Directory of the per-city region packages served at /api/regions, None to disable
+REGION_PACKAGE_DIR = None
+# Levels of the poi_grid count pyramid behind /api/density, None to disable
+POI_GRID_LEVELS = '6-20'
+
+class Stage:
+    def __init__(self, name, run, deps=(), inputs=None):
+        self.name = name
+        self.run = run
+        self.deps = list(deps)
+        self.inputs = inputs or (lambda: {})
+
+def file_fingerprint(path):
+    """Cheap change detector for large input files (size and modification time)."""
+    if not os.path.exists(path):
+        return {'path': path, 'missing': True}
+    st = os.stat(path)
+    return {'path': path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+def run_import_cities(ctx):
+    import import_cities
+    import_cities.add_cities_to_db(CITIES_FILE, metrics=ctx.metrics)
+
+def run_import_pois(ctx):
+    import import_pois
+    import_pois.import_pois(PBF_FILE, metrics=ctx.metrics, store_dir=POI_STORE_DIR)
+
+def run_create_clusters(ctx):
+    conn = ctx.conn
+    done = ctx.completed_cities()
+    if not done:
+        # Fresh stage: same as create_clusters.py, start from an empty table
+        create_clusters.drop_and_create_table(conn)
+    else:
+        print(f"Resuming clustering, {len(done)} cities already done")
+
+    cities = create_clusters.fetch_cities(conn)
+    failed = []
+    with ctx.metrics.stage('create_clusters') as stage:
+        for index, city in enumerate(cities):
+            city_name, city_id, city_geom_wkt = city['name'], city['id'], city['geom_wkt']
+            if city_id in done:
+                continue
+
+            print(f"\nProcessing city {index+1}/{len(cities)}: {city_name}")
+            try:
+                # Remove any partial output left by an interrupted attempt
+                cur = conn.cursor()
+                cur.execute("DELETE FROM poi_clusters WHERE city_id = %s", (city_id,))
+                cur.close()
+                clusters = create_clusters.process_city(conn, city_id, city_name, city_geom_wkt, ctx.metrics)
+                ctx.checkpoint_city(city_id, 'completed', clusters=clusters)
+                stage.add_rows(clusters)
+            except Exception as e:
+                ctx.checkpoint_city(city_id, 'failed', error=str(e))
+                failed.append(city_name)
+        stage.extra['failed_cities'] = failed
+
+    if failed:
+        raise RuntimeError(f"{len(failed)} cities failed: {', '.join(failed)}")
+
+def run_build_snapshot(ctx):
+    import poi_snapshot
+    with ctx.metrics.stage('build_snapshot'):
+        poi_snapshot.build_snapshot(POI_SNAPSHOT_FILE, store_dir=POI_STORE_DIR)
+
+def run_build_poi_grid(ctx):
+    import poi_grid
+    with ctx.metrics.stage('build_poi_grid'):
+        poi_grid.build(ctx.conn, poi_grid.parse_levels(POI_GRID_LEVELS))
+
+def run_export_regions(ctx):
+    import export_region
+    with ctx.metrics.stage('export_regions'):
+        export_region.export_cities(ctx.conn, out_dir=REGION_PACKAGE_DIR)
+
+STAGES = [
+    Stage('import_cities', run_import_cities,
+          inputs=lambda: {'file': file_fingerprint(CITIES_FILE)}),
+    # The POI store is tagged with city ids, so it has to be rebuilt whenever the cities are
+    Stage('import_pois', run_import_pois, deps=['import_cities'] if POI_STORE_DIR else [],
+          inputs=lambda: {'file': file_fingerprint(PBF_FILE), 'store': POI_STORE_DIR}),
+    Stage('create_clusters', run_create_clusters, deps=['import_cities', 'import_pois'],
+          inputs=lambda: {'eps': create_clusters.EPS, 'min_points': create_clusters.MIN_POINTS}),
+]
+
+if POI_GRID_LEVELS:
+    # Rebuilt after every POI import; apply_diff.py keeps it current in between
+    STAGES.append(Stage('build_poi_grid', run_build_poi_grid, deps=['import_pois'],
+                        inputs=lambda: {'levels': POI_GRID_LEVELS}))
+
+if REGION_PACKAGE_DIR:
+    STAGES.append(Stage('export_regions', run_export_regions, deps=['import_cities', 'import_pois'],
+                        inputs=lambda: {'dir': REGION_PACKAGE_DIR}))
+
+if POI_SNAPSHOT_FILE:
+    STAGES.append(Stage('build_snapshot', run_build_snapshot, deps=['import_pois'],
+                        inputs=lambda: {'path': POI_SNAPSHOT_FILE, 'exists': os.path.exists(POI_SNAPSHOT_FILE)}))
+
+def ordered_stages(stages):
+    """Topologically sort the stages by their dependencies."""
+    by_name = {stage.name: stage for stage in stages}
+    ordered, visiting, visited = [], set(), set()
+
+    def visit(stage):
+        if stage.name in visited:
+            return
+        if stage.name in visiting:
+            raise ValueError(f"Dependency cycle at stage {stage.name}")
+        visiting.add(stage.name)
+        for dep in stage.deps:
+            if dep not in by_name:
+                raise ValueError(f"Stage {stage.name} depends on unknown stage {dep}")
+            visit(by_name[dep])
+        visiting.discard(stage.name)
+        visited.add(stage.name)
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+    return ordered
+
+def create_run_tables(conn):
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS pipeline_runs (
+        id SERIAL PRIMARY KEY,
+        status VARCHAR(16) NOT NULL DEFAULT 'running',
+        started_at TIMESTAMP DEFAULT NOW(),
+        finished_at TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS pipeline_stages (
+        run_id INTEGER REFERENCES pipeline_runs(id) ON DELETE CASCADE,
+        stage VARCHAR(64) NOT NULL,
+        status VARCHAR(16) NOT NULL,
+        input_hash VARCHAR(64),
+        error TEXT,
+        started_at TIMESTAMP DEFAULT NOW(),
+        finished_at TIMESTAMP,
+        PRIMARY KEY (run_id, stage)
+    );
+    CREATE TABLE IF NOT EXISTS pipeline_city_checkpoints (
+        run_id INTEGER REFERENCES pipeline_runs(id) ON DELETE CASCADE,
+        city_id INTEGER NOT NULL,
+        status VARCHAR(16) NOT NULL,
+        clusters INTEGER,
+        error TEXT,
+        finished_at TIMESTAMP DEFAULT NOW(),
+        PRIMARY KEY (run_id, city_id)
+    );
+    """)
+    conn.commit()
+    cur.close()
+
+class StageContext:
+    """Checkpoint access handed to a stage while it runs."""
+
+    def __init__(self, conn, run_id, stage, metrics):
+        self.conn = conn
+        self.run_id = run_id
+        self.stage = stage
+        self.metrics = metrics
+
+    def completed_cities(self):
+        cur = self.conn.cursor()
+        cur.execute("""
+            SELECT city_id FROM pipeline_city_checkpoints
+            WHERE run_id = %s AND status = 'completed'
+        """, (self.run_id,))
+        done = {row[0] for row in cur.fetchall()}
+        cur.close()
+        return done
+
+    def checkpoint_city(self, city_id, status, clusters=None, error=None):
+        cur = self.conn.cursor()
+        cur.execute("""
+            INSERT INTO pipeline_city_checkpoints (run_id, city_id, status, clusters, error)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (run_id, city_id) DO UPDATE
+            SET status = EXCLUDED.status, clusters = EXCLUDED.clusters,
+                error = EXCLUDED.error, finished_at = NOW()
+        """, (self.run_id, city_id, status, clusters, error))
+        self.conn.commit()
+        cur.close()
+
+def input_hash(stage, hashes):
+    """Hash a stage's own inputs together with the hashes of its dependencies."""
+    payload = {
+        'inputs': stage.inputs(),
+        'deps': {dep: hashes[dep] for dep in stage.deps},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def start_or_resume_run(conn, new_run):
+    cur = conn.cursor()
+    run_id = None
+    if not new_run:
+        cur.execute("""
+            SELECT id FROM pipeline_runs
+            WHERE status <> 'completed'
+            ORDER BY id DESC LIMIT 1
+        """)
+        row = cur.fetchone()
+        if row:
+            run_id = row[0]
+            cur.execute("UPDATE pipeline_runs SET status = 'running', finished_at = NULL WHERE id = %s", (run_id,))
+            print(f"Resuming run {run_id}")
+    if run_id is None:
+        cur.execute("INSERT INTO pipeline_runs DEFAULT VALUES RETURNING id")
+        run_id = cur.fetchone()[0]
+        print(f"Starting run {run_id}")
+    conn.commit()
+    cur.close()
+    return run_id
+
+def stage_state(conn, run_id, stage_name):
+    """Return (status, input_hash) of a stage in this run, or (None, None)."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT status, input_hash FROM pipeline_stages
+        WHERE run_id = %s AND stage = %s
+    """, (run_id, stage_name))
+    row = cur.fetchone()
+    cur.close()
+    return row if row else (None, None)
+
+def last_completed_hash(conn, stage_name):
+    """Input hash of the most recent successful execution of a stage in any run."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT input_hash FROM pipeline_stages
+        WHERE stage = %s AND status = 'completed'
+        ORDER BY finished_at DESC LIMIT 1
+    """, (stage_name,))
+    row = cur.fetchone()
+    cur.close()
+    return row[0] if row else None
+
+def set_stage(conn, run_id, stage_name, status, digest, error=None):
+    cur = conn.cursor()
+    finished = status in ('completed', 'skipped', 'failed')
+    cur.execute("""
+        INSERT INTO pipeline_stages (run_id, stage, status, input_hash, error, finished_at)
+        VALUES (%s, %s, %s, %s, %s, CASE WHEN %s THEN NOW() END)
+        ON CONFLICT (run_id, stage) DO UPDATE
+        SET status = EXCLUDED.status, input_hash = EXCLUDED.input_hash,
+            error = EXCLUDED.error, finished_at = EXCLUDED.finished_at
+    """, (run_id, stage_name, status, digest, error, finished))
+    conn.commit()
+    cur.close()
+
+# The only stage that writes pipeline_city_checkpoints; rerunning any other
+# stage leaves its rows alone
+CHECKPOINTED_STAGE = 'create_clusters'
+
+def clear_city_checkpoints(conn, run_id):
+    cur = conn.cursor()
+    cur.execute("DELETE FROM pipeline_city_checkpoints WHERE run_id = %s", (run_id,))
+    conn.commit()
+    cur.close()
+
+def run_pipeline(new_run=False, force=()):
+    start_time = time.time()
+    metrics = None
+    conn = connect_db()
+    try:
+        create_run_tables(conn)
+        run_id = start_or_resume_run(conn, new_run)
+        metrics = RunMetrics(f"pipeline-run{run_id}", params={
+            'eps': create_clusters.EPS,
+            'min_points': create_clusters.MIN_POINTS,
+        })
+
+        hashes = {}
+        # Stages that produced fresh output in this run; their dependents cannot be skipped
+        # (import_cities, for example, drops poi_clusters)
+        produced = set()
+        # Stages executed by this invocation; dependents must discard their city checkpoints
+        executed = set()
+        for stage in ordered_stages(STAGES):
+            digest = input_hash(stage, hashes)
+            hashes[stage.name] = digest
+            status, previous_hash = stage_state(conn, run_id, stage.name)
+            upstream_executed = any(dep in executed for dep in stage.deps)
+
+            if stage.name not in force and not upstream_executed:
+                if status in ('completed', 'skipped') and previous_hash == digest:
+                    print(f"[{stage.name}] already {status} in this run")
+                    if status == 'completed':
+                        produced.add(stage.name)
+                    continue
+                # Only a stage this run has not touched yet may reuse an earlier run's output;
+                # a failed attempt may already have dropped it
+                upstream_produced = any(dep in produced for dep in stage.deps)
+                if (status is None and not upstream_produced
+                        and last_completed_hash(conn, stage.name) == digest):
+                    print(f"[{stage.name}] inputs unchanged, skipping")
+                    set_stage(conn, run_id, stage.name, 'skipped', digest)
+                    continue
+
+            if (stage.name == CHECKPOINTED_STAGE
+                    and (previous_hash != digest or stage.name in force or upstream_executed)):
+                # The interrupted attempt worked on different inputs, its city checkpoints are stale
+                clear_city_checkpoints(conn, run_id)
+
+            print(f"[{stage.name}] running")
+            stage_start = time.time()
+            set_stage(conn, run_id, stage.name, 'running', digest)
+            try:
+                stage.run(StageContext(conn, run_id, stage.name, metrics))
+            except Exception as e:
+                conn.rollback()
+                set_stage(conn, run_id, stage.name, 'failed', digest, error=str(e))
+                cur = conn.cursor()
+                cur.execute("UPDATE pipeline_runs SET status = 'failed', finished_at = NOW() WHERE id = %s", (run_id,))
+                conn.commit()
+                cur.close()
+                print(f"[{stage.name}] failed: {e}")
+                print(f"Run {run_id} stopped, rerun pipeline.py to resume")
+                return False
+            set_stage(conn, run_id, stage.name, 'completed', digest)
+            produced.add(stage.name)
+            executed.add(stage.name)
+            print(f"[{stage.name}] completed in {time.time() - stage_start:.2f} seconds")
+
+        cur = conn.cursor()
+        cur.execute("UPDATE pipeline_runs SET status = 'completed', finished_at = NOW() WHERE id = %s", (run_id,))
+        conn.commit()
+        cur.close()
+        print(f"Run {run_id} completed in {time.time() - start_time:.2f} seconds")
+        return True
+    finally:
+        conn.close()
+        if metrics:
+            metrics.save()
+
+def print_status():
+    conn = connect_db()
+    try:
+        create_run_tables(conn)
+        cur = conn.cursor()
+        cur.execute("SELECT id, status, started_at, finished_at FROM pipeline_runs ORDER BY id DESC LIMIT 1")
+        run = cur.fetchone()
+        if not run:
+            print("No pipeline runs recorded")
+            return
+        run_id, status, started_at, finished_at = run
+        print(f"Run {run_id}: {status} (started {started_at}, finished {finished_at})")
+        cur.execute("""
+            SELECT stage, status, error FROM pipeline_stages
+            WHERE run_id = %s ORDER BY started_at
+        """, (run_id,))
+        for stage, stage_status, error in cur.fetchall():
+            print(f"  {stage}: {stage_status}" + (f" ({error})" if error else ""))
+        cur.execute("""
+            SELECT status, COUNT(*) FROM pipeline_city_checkpoints
+            WHERE run_id = %s GROUP BY status
+        """, (run_id,))
+        for city_status, count in cur.fetchall():
+            print(f"  cities {city_status}: {count}")
+        cur.close()
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the POI batch pipeline")
+    parser.add_argument('command', nargs='?', default='run', choices=['run', 'status'])
+    parser.add_argument('--new', action='store_true', help="start a new run instead of resuming")
+    parser.add_argument('--force', nargs='*', default=[], metavar='STAGE',
+                        help="rerun these stages even if their inputs are unchanged")
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        print_status()
+        return
+
+    known = {stage.name for stage in STAGES}
+    unknown = set(args.force) - known
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    ok = run_pipeline(new_run=args.new, force=set(args.force))
+    raise SystemExit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""Per-cell POI aggregates for the clustering endpoints.
+
+poi_grid holds, for every quadtree level, the number of POIs in each cell
+and the sums of their coordinates, so a cell's centroid is exact
+(sum_lon / point_count) and any group of cells can be merged exactly. A
+cell at `level` is 360 / 2**level degrees wide and high; cell (x, y)
+covers lon [-180 + x * size, -180 + (x + 1) * size) and lat
+[-90 + y * size, -90 + (y + 1) * size), and is split into the four cells
+(2x, 2y) .. (2x + 1, 2y + 1) of the next level.
+
+Only the finest level is aggregated from osm_points; every coarser one is
+rolled up from the level below it, so a full build reads the points once.
+Point edits (apply_diff.py) are folded into every built level with
+apply_delta() instead of a rebuild.
+
+    python poi_grid.py build
+    python poi_grid.py build --levels 10-18
+"""
+import argparse
+import math
+import time
+from collections import defaultdict
+
+from psycopg2.extras import execute_values # type: ignore
+
+from create_clusters import connect_db
+
+MIN_LEVEL = 6
+MAX_LEVEL = 20
+
+def cell_size(level):
+    return 360.0 / (1 << level)
+
+def cell_range(level, min_lon, min_lat, max_lon, max_lat):
+    """Inclusive (x0, y0, x1, y1) cell index range covering a bbox."""
+    size = cell_size(level)
+    return (math.floor((min_lon + 180) / size), math.floor((min_lat + 90) / size),
+            math.floor((max_lon + 180) / size), math.floor((max_lat + 90) / size))
+
+def level_for_bbox(min_lon, min_lat, max_lon, max_lat, cells_per_side, min_level=MIN_LEVEL, max_level=MAX_LEVEL):
+    """The finest level at which the longer bbox side spans at most `cells_per_side` cells."""
+    side = max(max_lon - min_lon, max_lat - min_lat)
+    if side <= 0:
+        return max_level
+    level = math.floor(math.log2(360.0 * cells_per_side / side))
+    return max(min_level, min(max_level, level))
+
+def create_table(conn):
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS poi_grid (
+            level SMALLINT NOT NULL,
+            cell_x INTEGER NOT NULL,
+            cell_y INTEGER NOT NULL,
+            point_count BIGINT NOT NULL,
+            sum_lon DOUBLE PRECISION NOT NULL,
+            sum_lat DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (level, cell_x, cell_y)
+        )
+    """)
+    conn.commit()
+    cur.close()
+
+def build_level(conn, level):
+    """Recompute one level from osm_points; returns the number of non-empty cells."""
+    size = cell_size(level)
+    cur = conn.cursor()
+    cur.execute("DELETE FROM poi_grid WHERE level = %s", (level,))
+    cur.execute("""
+        INSERT INTO poi_grid (level, cell_x, cell_y, point_count, sum_lon, sum_lat)
+        SELECT %s,
+            FLOOR((ST_X(geom) + 180) / %s)::integer AS cell_x,
+            FLOOR((ST_Y(geom) + 90) / %s)::integer AS cell_y,
+            COUNT(*),
+            SUM(ST_X(geom)),
+            SUM(ST_Y(geom))
+        FROM osm_points
+        GROUP BY cell_x, cell_y
+    """, (level, size, size))
+    cells = cur.rowcount
+    conn.commit()
+    cur.close()
+    return cells
+
+def rollup_level(conn, level, source_level):
+    """Recompute one level by merging the cells of a finer, already built level."""
+    factor = 1 << (source_level - level)
+    cur = conn.cursor()
+    cur.execute("DELETE FROM poi_grid WHERE level = %s", (level,))
+    cur.execute("""
+        INSERT INTO poi_grid (level, cell_x, cell_y, point_count, sum_lon, sum_lat)
+        SELECT %s, cell_x / %s, cell_y / %s, SUM(point_count), SUM(sum_lon), SUM(sum_lat)
+        FROM poi_grid
+        WHERE level = %s
+        GROUP BY cell_x / %s, cell_y / %s
+    """, (level, factor, factor, source_level, factor, factor))
+    cells = cur.rowcount
+    conn.commit()
+    cur.close()
+    return cells
+
+def build(conn, levels):
+    create_table(conn)
+    finer = None
+    for level in sorted(levels, reverse=True):
+        start = time.time()
+        if finer is None:
+            cells = build_level(conn, level)
+        else:
+            cells = rollup_level(conn, level, finer)
+        finer = level
+        print(f"Level {level} ({cell_size(level):.6f} degrees): {cells} cells in {time.time() - start:.1f}s")
+    cur = conn.cursor()
+    cur.execute("ANALYZE poi_grid")
+    conn.commit()
+    cur.close()
+
+def built_levels(conn):
+    """The levels present in poi_grid, one index probe per possible level."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT l.level FROM generate_series(0, %s) AS l (level)
+        WHERE EXISTS (SELECT 1 FROM poi_grid g WHERE g.level = l.level)
+    """, (MAX_LEVEL,))
+    levels = [row[0] for row in cur.fetchall()]
+    cur.close()
+    return levels
+
+def cell_deltas(levels, added, removed):
+    """{(level, x, y): [count, sum_lon, sum_lat]} changes for added and removed (lon, lat) points."""
+    deltas = defaultdict(lambda: [0, 0.0, 0.0])
+    for points, sign in ((added, 1), (removed, -1)):
+        for lon, lat in points:
+            for level in levels:
+                size = cell_size(level)
+                delta = deltas[(level, math.floor((lon + 180) / size), math.floor((lat + 90) / size))]
+                delta[0] += sign
+                delta[1] += sign * lon
+                delta[2] += sign * lat
+    return {cell: delta for cell, delta in deltas.items() if delta[0] or delta[1] or delta[2]}
+
+def apply_delta(conn, added, removed, levels=None):
+    """Fold added and removed (lon, lat) points into every built level.
+
+    A moved point is removed at its old position and added at the new one.
+    Cells left without points are deleted. Runs in the caller's transaction
+    and does not commit, so the grid changes with the points it counts.
+    """
+    if levels is None:
+        levels = built_levels(conn)
+    deltas = cell_deltas(levels, added, removed)
+    if not deltas:
+        return 0
+    rows = [(level, x, y, count, sum_lon, sum_lat) for (level, x, y), (count, sum_lon, sum_lat) in deltas.items()]
+    cur = conn.cursor()
+    execute_values(cur, """
+        INSERT INTO poi_grid (level, cell_x, cell_y, point_count, sum_lon, sum_lat)
+        VALUES %s
+        ON CONFLICT (level, cell_x, cell_y) DO UPDATE
+        SET point_count = poi_grid.point_count + EXCLUDED.point_count,
+            sum_lon = poi_grid.sum_lon + EXCLUDED.sum_lon,
+            sum_lat = poi_grid.sum_lat + EXCLUDED.sum_lat
+    """, rows)
+    shrunk = [row[:3] for row in rows if row[3] < 0]
+    if shrunk:
+        execute_values(cur, """
+            DELETE FROM poi_grid g
+            USING (VALUES %s) AS shrunk (level, cell_x, cell_y)
+            WHERE g.level = shrunk.level AND g.cell_x = shrunk.cell_x AND g.cell_y = shrunk.cell_y
+                AND g.point_count <= 0
+        """, shrunk)
+    cur.close()
+    return len(rows)
+
+def fetch_cells(conn, level, min_lon, min_lat, max_lon, max_lat):
+    """(cell_x, cell_y, point_count, sum_lon, sum_lat) tuples of the cells overlapping a bbox."""
+    x0, y0, x1, y1 = cell_range(level, min_lon, min_lat, max_lon, max_lat)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT cell_x, cell_y, point_count, sum_lon, sum_lat
+        FROM poi_grid
+        WHERE level = %s AND cell_x BETWEEN %s AND %s AND cell_y BETWEEN %s AND %s
+    """, (level, x0, x1, y0, y1))
+    cells = cur.fetchall()
+    cur.close()
+    return cells
+
+def estimate_points(conn, min_lon, min_lat, max_lon, max_lat, cells_per_side=64):
+    """Upper bound on the POIs in a bbox from the cells overlapping it, or None if the level is not built."""
+    level = level_for_bbox(min_lon, min_lat, max_lon, max_lat, cells_per_side)
+    x0, y0, x1, y1 = cell_range(level, min_lon, min_lat, max_lon, max_lat)
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT COUNT(*), COALESCE(SUM(point_count), 0)
+        FROM poi_grid
+        WHERE level = %s AND cell_x BETWEEN %s AND %s AND cell_y BETWEEN %s AND %s
+    """, (level, x0, x1, y0, y1))
+    cells, points = cur.fetchone()
+    if not cells:
+        # An empty answer may just mean the level was never built
+        cur.execute("SELECT EXISTS (SELECT 1 FROM poi_grid WHERE level = %s)", (level,))
+        if not cur.fetchone()[0]:
+            points = None
+    cur.close()
+    return None if points is None else int(points)
+
+def planner_estimate(conn, min_lon, min_lat, max_lon, max_lat):
+    """The planner's row estimate for the POIs in a bbox; nothing is executed."""
+    cur = conn.cursor()
+    cur.execute("""
+        EXPLAIN (FORMAT JSON)
+        SELECT 1 FROM osm_points WHERE geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
+    """, (min_lon, min_lat, max_lon, max_lat))
+    plan = cur.fetchone()[0]
+    cur.close()
+    return int(plan[0]['Plan']['Plan Rows'])
+
+def dense_cell_clusters(cells, level, eps, min_points):
+    """DBSCAN on the grid: join adjacent dense cells into clusters.
+
+    A cell is dense when its POI density would make a typical POI inside it
+    a DBSCAN core point (min_points within eps). Dense cells touching each
+    other, diagonals included, form one cluster. Returns (point_count,
+    longitude, latitude) per cluster, largest first, with exact centroids
+    from the cell sums.
+    """
+    size = cell_size(level)
+    threshold = min_points * size * size / (math.pi * eps * eps)
+    dense = {(c[0], c[1]): c for c in cells if c[2] >= threshold}
+
+    clusters = []
+    seen = set()
+    for start in dense:
+        if start in seen:
+            continue
+        seen.add(start)
+        stack = [start]
+        count = sum_lon = sum_lat = 0
+        while stack:
+            x, y = stack.pop()
+            _, _, cell_count, cell_lon, cell_lat = dense[(x, y)]
+            count += cell_count
+            sum_lon += cell_lon
+            sum_lat += cell_lat
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    neighbour = (x + dx, y + dy)
+                    if neighbour in dense and neighbour not in seen:
+                        seen.add(neighbour)
+                        stack.append(neighbour)
+        clusters.append((count, sum_lon / count, sum_lat / count))
+    clusters.sort(reverse=True)
+    return clusters
+
+def cell_bounds(level, x, y):
+    """(min_lon, min_lat, max_lon, max_lat) of a cell."""
+    size = cell_size(level)
+    return (-180 + x * size, -90 + y * size, -180 + (x + 1) * size, -90 + (y + 1) * size)
+
+def aligned_bbox(level, min_lon, min_lat, max_lon, max_lat):
+    """The bbox grown to the edges of the level's cells it overlaps."""
+    x0, y0, x1, y1 = cell_range(level, min_lon, min_lat, max_lon, max_lat)
+    return cell_bounds(level, x0, y0)[:2] + cell_bounds(level, x1, y1)[2:]
+
+def cell_plan(counts, fine_level, start_level, max_points, min_lon, min_lat, max_lon, max_lat):
+    """Adaptive quadtree cover of a bbox from the POI counts of one fine level.
+
+    counts maps (x, y) at fine_level to a POI count, and must cover
+    aligned_bbox(start_level, ...): the edge cells reach past the bbox, and
+    points there count towards them too. Starting from the
+    start_level cells overlapping the bbox, a cell is split into its four
+    children while it holds more than max_points and is coarser than
+    fine_level; children outside the bbox are dropped. Returns (level, x,
+    y, point_count) per cell, so dense areas get small cells and empty
+    ones a few large cells with no points.
+    """
+    # Counts of every coarser level up to start_level, merged from the fine one
+    pyramid = {fine_level: counts}
+    for level in range(fine_level - 1, start_level - 1, -1):
+        merged = defaultdict(int)
+        for (x, y), count in pyramid[level + 1].items():
+            merged[(x >> 1, y >> 1)] += count
+        pyramid[level] = merged
+
+    x0, y0, x1, y1 = cell_range(start_level, min_lon, min_lat, max_lon, max_lat)
+    stack = [(start_level, x, y) for y in range(y1, y0 - 1, -1) for x in range(x1, x0 - 1, -1)]
+    plan = []
+    while stack:
+        level, x, y = stack.pop()
+        count = pyramid[level].get((x, y), 0)
+        if count <= max_points or level == fine_level:
+            plan.append((level, x, y, count))
+            continue
+        cx0, cy0, cx1, cy1 = cell_range(level + 1, min_lon, min_lat, max_lon, max_lat)
+        for cy in (2 * y + 1, 2 * y):
+            for cx in (2 * x + 1, 2 * x):
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                    stack.append((level + 1, cx, cy))
+    return plan
+
+def parse_levels(spec):
+    if '-' in spec:
+        low, high = spec.split('-')
+        return list(range(int(low), int(high) + 1))
+    return [int(level) for level in spec.split(',')]
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the per-cell POI aggregates")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build_parser = sub.add_parser('build', help="(re)build poi_grid from osm_points")
+    build_parser.add_argument('--levels', default=f'{MIN_LEVEL}-{MAX_LEVEL}', help="e.g. 10-18 or 12,14,16")
+    args = parser.parse_args()
+
+    conn = connect_db()
+    try:
+        if args.command == 'build':
+            build(conn, parse_levels(args.levels))
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
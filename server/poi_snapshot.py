@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""Memory-mapped, spatially sorted snapshot of the POI set.
+
+The snapshot stores every point sorted by its Hilbert curve key together
+with a block index (bounding box of every run of BLOCK_SIZE points), so a
+bbox query only touches the blocks that overlap it. Readers map the file
+with mmap: opening it is instant and every worker process shares the same
+page cache copy.
+
+    python poi_snapshot.py build points.snap             # from osm_points
+    python poi_snapshot.py build points.snap --store DIR # from the columnar POI store
+    python poi_snapshot.py query points.snap 22.93 40.63 22.95 40.65
+
+File layout (little endian, every section 8-byte aligned):
+
+    header      magic, version, block size, point count, block count, bbox
+    index       per block: min_lon, min_lat, max_lon, max_lat (f64), start (u64), count (u64)
+    ids         int64[count]
+    lons        float64[count]
+    lats        float64[count]
+"""
+import argparse
+import os
+import time
+import numpy as np # type: ignore
+
+MAGIC = b'NEARPOI1'
+VERSION = 1
+BLOCK_SIZE = 1024
+HILBERT_ORDER = 16
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('block_size', '<u4'),
+    ('count', '<u8'),
+    ('blocks', '<u8'),
+    ('min_lon', '<f8'),
+    ('min_lat', '<f8'),
+    ('max_lon', '<f8'),
+    ('max_lat', '<f8'),
+])
+
+INDEX_DTYPE = np.dtype([
+    ('min_lon', '<f8'),
+    ('min_lat', '<f8'),
+    ('max_lon', '<f8'),
+    ('max_lat', '<f8'),
+    ('start', '<u8'),
+    ('count', '<u8'),
+])
+
+def hilbert_keys(lons, lats, bbox, order=HILBERT_ORDER):
+    """Hilbert curve index of every point on a 2^order x 2^order grid over bbox."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    n = 1 << order
+    span_lon = max(max_lon - min_lon, 1e-12)
+    span_lat = max(max_lat - min_lat, 1e-12)
+    x = np.clip(((lons - min_lon) / span_lon * (n - 1)).astype(np.int64), 0, n - 1)
+    y = np.clip(((lats - min_lat) / span_lat * (n - 1)).astype(np.int64), 0, n - 1)
+
+    d = np.zeros(len(x), dtype=np.int64)
+    s = n >> 1
+    while s:
+        rx = ((x & s) > 0).astype(np.int64)
+        ry = ((y & s) > 0).astype(np.int64)
+        d += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the curve stays continuous
+        flip = (ry == 0) & (rx == 1)
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        swap = ry == 0
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s >>= 1
+    return d
+
+def _aligned(offset):
+    return (offset + 7) & ~7
+
+def write_snapshot(path, ids, lons, lats, block_size=BLOCK_SIZE):
+    """Sort the points along the Hilbert curve and write the snapshot file atomically."""
+    ids = np.asarray(ids, dtype=np.int64)
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    count = len(ids)
+
+    if count:
+        bbox = (float(lons.min()), float(lats.min()), float(lons.max()), float(lats.max()))
+        order = np.argsort(hilbert_keys(lons, lats, bbox), kind='stable')
+        ids, lons, lats = ids[order], lons[order], lats[order]
+    else:
+        bbox = (0.0, 0.0, 0.0, 0.0)
+
+    starts = np.arange(0, count, block_size, dtype=np.int64)
+    index = np.zeros(len(starts), dtype=INDEX_DTYPE)
+    if count:
+        index['min_lon'] = np.minimum.reduceat(lons, starts)
+        index['min_lat'] = np.minimum.reduceat(lats, starts)
+        index['max_lon'] = np.maximum.reduceat(lons, starts)
+        index['max_lat'] = np.maximum.reduceat(lats, starts)
+        index['start'] = starts
+        index['count'] = np.diff(np.append(starts, count))
+
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['block_size'] = block_size
+    header['count'] = count
+    header['blocks'] = len(index)
+    header['min_lon'], header['min_lat'], header['max_lon'], header['max_lat'] = bbox
+
+    # Write next to the target and rename, so running readers keep their mapping of the old file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        for section in (header, index, ids, lons, lats):
+            f.write(b'\0' * (_aligned(f.tell()) - f.tell()))
+            f.write(section.tobytes())
+    os.replace(tmp_path, path)
+    return count, len(index)
+
+class PoiSnapshot:
+    """Read-only view of a snapshot file; all arrays are views into the mapping."""
+
+    def __init__(self, path):
+        self.path = path
+        self._map = np.memmap(path, dtype=np.uint8, mode='r')
+        header = self._map[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)[0]
+        if bytes(header['magic']) != MAGIC:
+            raise ValueError(f"{path} is not a POI snapshot")
+        if int(header['version']) != VERSION:
+            raise ValueError(f"Unsupported snapshot version {int(header['version'])}")
+
+        self.count = int(header['count'])
+        self.block_size = int(header['block_size'])
+        self.bbox = (float(header['min_lon']), float(header['min_lat']),
+                     float(header['max_lon']), float(header['max_lat']))
+
+        offset = _aligned(HEADER_DTYPE.itemsize)
+        blocks = int(header['blocks'])
+        self.index = self._map[offset:offset + blocks * INDEX_DTYPE.itemsize].view(INDEX_DTYPE)
+        offset = _aligned(offset + blocks * INDEX_DTYPE.itemsize)
+        self.ids = self._map[offset:offset + self.count * 8].view(np.int64)
+        offset = _aligned(offset + self.count * 8)
+        self.lons = self._map[offset:offset + self.count * 8].view(np.float64)
+        offset = _aligned(offset + self.count * 8)
+        self.lats = self._map[offset:offset + self.count * 8].view(np.float64)
+
+    def __len__(self):
+        return self.count
+
+    def query_bbox(self, min_lon, min_lat, max_lon, max_lat):
+        """Return (ids, lons, lats) of the points inside the bbox, edges included."""
+        index = self.index
+        hits = np.nonzero(
+            (index['max_lon'] >= min_lon) & (index['min_lon'] <= max_lon) &
+            (index['max_lat'] >= min_lat) & (index['min_lat'] <= max_lat)
+        )[0]
+        if not len(hits):
+            empty = np.empty(0)
+            return empty.astype(np.int64), empty, empty
+
+        ids, lons, lats = [], [], []
+        for block in hits:
+            start = int(index['start'][block])
+            end = start + int(index['count'][block])
+            block_lons = self.lons[start:end]
+            block_lats = self.lats[start:end]
+            inside = ((block_lons >= min_lon) & (block_lons <= max_lon) &
+                      (block_lats >= min_lat) & (block_lats <= max_lat))
+            ids.append(self.ids[start:end][inside])
+            lons.append(block_lons[inside])
+            lats.append(block_lats[inside])
+        return np.concatenate(ids), np.concatenate(lons), np.concatenate(lats)
+
+def load_points_from_db(conn, batch_size=100000):
+    """Read (ids, lons, lats) of osm_points in batches through a server-side cursor.
+
+    The batches keep the rows off the client until they are fetched, but
+    the whole point set ends up in memory: write_snapshot sorts it at once.
+    """
+    cur = conn.cursor(name='poi_snapshot')
+    cur.itersize = batch_size
+    cur.execute("SELECT id, ST_X(geom), ST_Y(geom) FROM osm_points")
+    chunks = []
+    fetched = 0
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.float64))
+        fetched += len(rows)
+        print(f"Fetched {fetched} points")
+    cur.close()
+    if not chunks:
+        return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0)
+    data = np.concatenate(chunks)
+    # OSM node ids stay below 2^53, so they survive the float64 round trip
+    return data[:, 0].astype(np.int64), data[:, 1].copy(), data[:, 2].copy()
+
+def build_snapshot(path, store_dir=None, block_size=BLOCK_SIZE):
+    start_time = time.time()
+    if store_dir:
+        from poi_store import read_points
+        print(f"Reading points from POI store {store_dir}")
+        ids, lons, lats = read_points(store_dir)
+    else:
+        from create_clusters import connect_db
+        conn = connect_db()
+        try:
+            ids, lons, lats = load_points_from_db(conn)
+        finally:
+            conn.close()
+    count, blocks = write_snapshot(path, ids, lons, lats, block_size)
+    print(f"Wrote {count} points in {blocks} blocks to {path} in {time.time() - start_time:.2f} seconds")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query a POI snapshot file")
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('build', help="generate a snapshot")
+    build.add_argument('path')
+    build.add_argument('--store', metavar='DIR', help="read the columnar POI store instead of osm_points")
+    build.add_argument('--block-size', type=int, default=BLOCK_SIZE)
+    query = sub.add_parser('query', help="count the points of a snapshot inside a bbox")
+    query.add_argument('path')
+    query.add_argument('bbox', nargs=4, type=float, metavar=('MIN_LON', 'MIN_LAT', 'MAX_LON', 'MAX_LAT'))
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_snapshot(args.path, args.store, args.block_size)
+    else:
+        start = time.perf_counter()
+        snapshot = PoiSnapshot(args.path)
+        opened = time.perf_counter()
+        ids, _, _ = snapshot.query_bbox(*args.bbox)
+        done = time.perf_counter()
+        print(f"{len(ids)} of {len(snapshot)} points, opened in {(opened - start) * 1000:.2f} ms, "
+              f"queried in {(done - opened) * 1000:.2f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Columnar intermediate store of the imported POIs.
+
+The store is a directory of uncompressed Arrow IPC files partitioned by
+city, so a stage that works on one city maps exactly one file:
+
+    <root>/city=<city_id>/part-00000.arrow
+    <root>/city=none/part-00000.arrow      # points outside every city
+
+Every file has the columns id (int64), lon, lat (float64), tags (JSON
+string or null) and city_id (int32, null outside cities). The schema
+metadata carries a GeoParquet style "geo" entry describing the point
+encoding. Arrow IPC is used rather than Parquet because it can be memory
+mapped and read without copying or decoding.
+"""
+import json
+import os
+import shutil
+from array import array
+import numpy as np # type: ignore
+import pyarrow as pa # type: ignore
+import shapely # type: ignore
+from shapely import wkb # type: ignore
+
+SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('lon', pa.float64()),
+    ('lat', pa.float64()),
+    ('tags', pa.string()),
+    ('city_id', pa.int32()),
+], metadata={
+    'geo': json.dumps({
+        'version': '1.0.0',
+        'crs': 'EPSG:4326',
+        'encoding': 'point',
+        'columns': {'x': 'lon', 'y': 'lat'},
+    }),
+})
+
+PARTITION_ROWS = 65536
+
+# Pass as city_id to read every partition of the store
+ALL_PARTITIONS = object()
+
+def partition_name(city_id):
+    return f"city={'none' if city_id is None else city_id}"
+
+class CityLocator:
+    """Assigns city ids to points with an in-memory STRtree of the cities table."""
+
+    def __init__(self, conn):
+        cur = conn.cursor()
+        cur.execute("SELECT id, ST_AsBinary(geom) FROM cities WHERE geom IS NOT NULL")
+        rows = cur.fetchall()
+        cur.close()
+        self.city_ids = np.array([row[0] for row in rows], dtype=np.int32)
+        geoms = [wkb.loads(bytes(row[1])) for row in rows]
+        self.tree = shapely.STRtree(geoms)
+
+    def locate(self, lons, lats):
+        """Return an int32 array of city ids, -1 for points outside every city."""
+        result = np.full(len(lons), -1, dtype=np.int32)
+        if not len(self.city_ids) or not len(lons):
+            return result
+        points = shapely.points(lons, lats)
+        point_index, city_index = self.tree.query(points, predicate='intersects')
+        # Municipalities do not overlap, a point on a shared border keeps its first match
+        result[point_index[::-1]] = self.city_ids[city_index[::-1]]
+        return result
+
+class _Partition:
+    def __init__(self, path):
+        self.path = path
+        self.writer = None
+        self.reset()
+
+    def reset(self):
+        self.ids = array('q')
+        self.lons = array('d')
+        self.lats = array('d')
+        self.tags = []
+
+class PoiStoreWriter:
+    """Buffers points, assigns their city and appends them to the city partitions.
+
+    Opening a writer replaces any earlier export in the same directory.
+    """
+
+    def __init__(self, root, locator=None, batch_size=100000):
+        self.root = root
+        self.locator = locator
+        self.batch_size = batch_size
+        self.partitions = {}
+        self.count = 0
+        self._pending_reset()
+        os.makedirs(root, exist_ok=True)
+        for name in os.listdir(root):
+            if name.startswith('city='):
+                shutil.rmtree(os.path.join(root, name))
+
+    def _pending_reset(self):
+        self.pending_ids = array('q')
+        self.pending_lons = array('d')
+        self.pending_lats = array('d')
+        self.pending_tags = []
+
+    def add(self, point_id, lon, lat, tags=None):
+        self.pending_ids.append(point_id)
+        self.pending_lons.append(lon)
+        self.pending_lats.append(lat)
+        self.pending_tags.append(json.dumps(tags, ensure_ascii=False) if tags else None)
+        if len(self.pending_ids) >= self.batch_size:
+            self._dispatch()
+
+    def _dispatch(self):
+        if not self.pending_ids:
+            return
+        lons = np.frombuffer(self.pending_lons, dtype=np.float64)
+        lats = np.frombuffer(self.pending_lats, dtype=np.float64)
+        if self.locator:
+            city_ids = self.locator.locate(lons, lats)
+        else:
+            city_ids = np.full(len(lons), -1, dtype=np.int32)
+
+        ids = np.frombuffer(self.pending_ids, dtype=np.int64)
+        for city_id in np.unique(city_ids):
+            rows = np.nonzero(city_ids == city_id)[0]
+            key = None if city_id < 0 else int(city_id)
+            partition = self._partition(key)
+            partition.ids.frombytes(ids[rows].tobytes())
+            partition.lons.frombytes(lons[rows].tobytes())
+            partition.lats.frombytes(lats[rows].tobytes())
+            partition.tags.extend(self.pending_tags[i] for i in rows)
+            if len(partition.ids) >= PARTITION_ROWS:
+                self._flush(key, partition)
+        self.count += len(ids)
+        self._pending_reset()
+
+    def _partition(self, city_id):
+        partition = self.partitions.get(city_id)
+        if partition is None:
+            directory = os.path.join(self.root, partition_name(city_id))
+            os.makedirs(directory, exist_ok=True)
+            partition = _Partition(directory)
+            self.partitions[city_id] = partition
+        return partition
+
+    def _flush(self, city_id, partition):
+        if not partition.ids:
+            return
+        if partition.writer is None:
+            path = os.path.join(partition.path, "part-00000.arrow")
+            partition.writer = pa.ipc.new_file(path, SCHEMA)
+        count = len(partition.ids)
+        batch = pa.record_batch([
+            pa.array(np.frombuffer(partition.ids, dtype=np.int64)),
+            pa.array(np.frombuffer(partition.lons, dtype=np.float64)),
+            pa.array(np.frombuffer(partition.lats, dtype=np.float64)),
+            pa.array(partition.tags, type=pa.string()),
+            pa.array([city_id] * count, type=pa.int32()),
+        ], schema=SCHEMA)
+        partition.writer.write_batch(batch)
+        partition.reset()
+
+    def close(self):
+        self._dispatch()
+        for city_id, partition in self.partitions.items():
+            self._flush(city_id, partition)
+            if partition.writer is not None:
+                partition.writer.close()
+        self.partitions = {}
+
+def partition_files(root, city_id=ALL_PARTITIONS):
+    """List the Arrow files of one city (None for points outside cities) or of the whole store."""
+    if city_id is ALL_PARTITIONS:
+        directories = sorted(d for d in os.listdir(root) if d.startswith('city='))
+    else:
+        directories = [partition_name(city_id)]
+    files = []
+    for directory in directories:
+        path = os.path.join(root, directory)
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith('.arrow'))
+    return files
+
+def read_table(root, city_id=ALL_PARTITIONS, columns=None):
+    """Memory-map the store (or one city partition) as a single Arrow table without copying."""
+    tables = []
+    for path in partition_files(root, city_id):
+        reader = pa.ipc.open_file(pa.memory_map(path, 'r'))
+        table = reader.read_all()
+        tables.append(table.select(columns) if columns else table)
+    if not tables:
+        return SCHEMA.empty_table().select(columns) if columns else SCHEMA.empty_table()
+    return pa.concat_tables(tables)
+
+def read_points(root, city_id=ALL_PARTITIONS):
+    """Return (ids, lons, lats) numpy arrays; zero-copy when the data is a single chunk."""
+    table = read_table(root, city_id, columns=['id', 'lon', 'lat'])
+    return tuple(
+        table.column(name).combine_chunks().to_numpy(zero_copy_only=False)
+        for name in ('id', 'lon', 'lat')
+    )
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Change versions of osm_points, for the delta sync at /api/sync.
+
+Every insert or move of a point takes the next value of
+osm_points_version_seq into osm_points.version, and every delete or move
+leaves a tombstone with the old position and its own version, so a client
+that last synced at version V can be sent just what changed after V in its
+cells.
+
+Only apply_diff.py versions changes. Full imports (import_pois.py) skip
+existing ids and leave neither versions nor tombstones, so they end with
+require_resync: every client that synced before must download its cells
+again. Imported points keep a NULL version and are never sent as changes.
+
+Sequence values are handed out before commit and in no particular commit
+order, so syncs never read the sequence. Writers take the sync state row
+lock first (lock_versions), write, and bump committed_version as their last
+write (publish_versions); syncs send changes up to committed_version only,
+and every version up to it is already committed.
+
+Tombstones are pruned after a while; pruned_through remembers the newest
+version dropped, and clients that last synced before it must download
+their cells again.
+
+    python poi_versions.py migrate
+    python poi_versions.py prune --keep-days 30
+"""
+import argparse
+
+from create_clusters import connect_db
+
+def create_schema(conn):
+    cur = conn.cursor()
+    # No default: versions are only taken under the sync state row lock
+    cur.execute("""
+        CREATE SEQUENCE IF NOT EXISTS osm_points_version_seq;
+        ALTER TABLE osm_points ADD COLUMN IF NOT EXISTS version BIGINT;
+        ALTER TABLE osm_points ALTER COLUMN version DROP DEFAULT;
+        CREATE INDEX IF NOT EXISTS osm_points_version_idx ON osm_points (version) WHERE version IS NOT NULL;
+        CREATE TABLE IF NOT EXISTS osm_points_tombstones (
+            id BIGINT NOT NULL,
+            version BIGINT NOT NULL DEFAULT nextval('osm_points_version_seq') PRIMARY KEY,
+            longitude DOUBLE PRECISION NOT NULL,
+            latitude DOUBLE PRECISION NOT NULL,
+            deleted_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+        CREATE TABLE IF NOT EXISTS osm_points_sync_state (
+            pruned_through BIGINT NOT NULL
+        );
+        ALTER TABLE osm_points_sync_state ADD COLUMN IF NOT EXISTS committed_version BIGINT NOT NULL DEFAULT 0;
+        INSERT INTO osm_points_sync_state (pruned_through)
+        SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM osm_points_sync_state);
+    """)
+    conn.commit()
+    cur.close()
+
+def add_tombstones(cur, points):
+    """Record (id, lon, lat) positions that points have left, by deletion or by moving."""
+    if points:
+        cur.executemany("""
+            INSERT INTO osm_points_tombstones (id, longitude, latitude) VALUES (%s, %s, %s)
+        """, points)
+
+def lock_versions(cur):
+    """Start a versioned write: lock the sync state row until commit, returns committed_version.
+
+    Writers run one at a time from here, so no version below another
+    writer's can still be uncommitted when that writer publishes.
+    """
+    cur.execute("SELECT committed_version FROM osm_points_sync_state FOR UPDATE")
+    return cur.fetchone()[0]
+
+def publish_versions(cur):
+    """Last write of a versioned write: let syncs see the versions it took."""
+    # last_value is 1 before the first nextval, when is_called is still false
+    cur.execute("""
+        UPDATE osm_points_sync_state
+        SET committed_version = GREATEST(committed_version, (
+            SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM osm_points_version_seq))
+        RETURNING committed_version
+    """)
+    return cur.fetchone()[0]
+
+def require_resync(conn):
+    """Make every client synced before now download its cells again; returns the new version.
+
+    For writes that bypass the versioning, like full imports: they take a
+    fresh version and prune everything before it.
+    """
+    cur = conn.cursor()
+    lock_versions(cur)
+    cur.execute("SELECT nextval('osm_points_version_seq')")
+    version = publish_versions(cur)
+    cur.execute("UPDATE osm_points_sync_state SET pruned_through = %s", (version,))
+    conn.commit()
+    cur.close()
+    print(f"Clients before version {version} must resync")
+    return version
+
+def current_version(cur):
+    """Newest version syncs may send; every version up to it is committed."""
+    cur.execute("SELECT committed_version FROM osm_points_sync_state")
+    return cur.fetchone()[0]
+
+def prune(conn, keep_days):
+    """Drop tombstones older than keep_days; returns the new pruned_through version."""
+    cur = conn.cursor()
+    cur.execute("""
+        WITH dropped AS (
+            DELETE FROM osm_points_tombstones
+            WHERE deleted_at < NOW() - make_interval(days => %s)
+            RETURNING version
+        )
+        UPDATE osm_points_sync_state
+        SET pruned_through = GREATEST(pruned_through, (SELECT MAX(version) FROM dropped))
+        WHERE EXISTS (SELECT 1 FROM dropped)
+    """, (keep_days,))
+    cur.execute("SELECT pruned_through FROM osm_points_sync_state")
+    pruned_through = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    print(f"Tombstones older than {keep_days} days dropped, clients before version {pruned_through} must resync")
+    return pruned_through
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the osm_points change versions")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('migrate', help="add the version column, sequence and tombstone table")
+    prune_parser = sub.add_parser('prune', help="drop old tombstones")
+    prune_parser.add_argument('--keep-days', type=int, default=30)
+    args = parser.parse_args()
+
+    conn = connect_db()
+    try:
+        if args.command == 'migrate':
+            create_schema(conn)
+            print("osm_points versioning enabled")
+        elif args.command == 'prune':
+            prune(conn, args.keep_days)
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
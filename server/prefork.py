@@ -0,0 +1,84 @@
+"""Pre-fork process supervisor for the API servers.
+
+The master process binds the listening socket (or, with SO_REUSEPORT,
+lets every worker bind its own), forks N workers and restarts any worker
+that dies until it receives SIGTERM or SIGINT, which it forwards to the
+workers before exiting.
+
+Works with gevent's monkey patching: the patched os.fork reinitialises the
+hub in the child and the patched os.waitpid reaps children cooperatively.
+"""
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+# A worker that dies sooner than this after starting is restarted with a delay
+MIN_WORKER_LIFETIME = 1.0
+RESTART_DELAY = 1.0
+
+def bind_listener(address, reuse_port=False, backlog=2048):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(address)
+    sock.listen(backlog)
+    return sock
+
+def run_prefork(workers, worker_main):
+    """Fork `workers` processes running worker_main(slot) and keep them alive."""
+    children = {}
+    started = {}
+    stopping = False
+
+    def spawn(slot):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                worker_main(slot)
+            except Exception:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        children[pid] = slot
+        started[slot] = time.monotonic()
+        print(f"Started worker {slot} (pid {pid})")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for slot in range(workers):
+        spawn(slot)
+
+    while children:
+        try:
+            pid, status = os.waitpid(-1, 0)
+        except ChildProcessError:
+            break
+        slot = children.pop(pid, None)
+        if slot is None or stopping:
+            continue
+        print(f"Worker {slot} (pid {pid}) exited with status {status}, restarting")
+        if time.monotonic() - started[slot] < MIN_WORKER_LIFETIME:
+            # Avoid a tight fork loop when workers crash on startup
+            time.sleep(RESTART_DELAY)
+        spawn(slot)
+    print("All workers stopped")
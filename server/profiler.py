@@ -0,0 +1,148 @@
+"""On-demand sampling profiler for the API process.
+
+GET /api/admin/profile?seconds=10&hz=100&format=collapsed|speedscope&greenlets=0|1
+with the X-Admin-Token header set to ADMIN_TOKEN. The endpoint does not
+exist (404) unless ADMIN_TOKEN is configured.
+
+The sampler runs in a thread of gevent's native threadpool, so it keeps
+sampling while a greenlet hogs the hub (a slow jsonify, a large fetch, a
+TLS handshake) and the requesting greenlet simply waits for the result.
+Every tick it records the current stack of each native thread; with
+greenlets=1 it also records the stacks of the suspended greenlets, which
+shows where requests are parked (pool waits, socket reads). Walking the
+greenlets scans the heap, so that part is done at most every
+GREENLET_INTERVAL seconds.
+
+The collapsed output feeds straight into flamegraph.pl; the speedscope
+output opens in https://www.speedscope.app.
+"""
+import gc
+import hmac
+import math
+import os
+import sys
+import threading
+from collections import Counter
+import gevent # type: ignore
+from gevent.monkey import get_original # type: ignore
+from greenlet import greenlet # type: ignore
+from flask import Response, abort, jsonify, request # type: ignore
+
+sleep = get_original('time', 'sleep')
+monotonic = get_original('time', 'monotonic')
+get_ident = get_original('_thread', 'get_ident')
+
+MAX_SECONDS = 60
+MAX_HZ = 1000
+GREENLET_INTERVAL = 0.1
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def stack_of(frame, root):
+    stack = []
+    while frame is not None:
+        stack.append(frame_name(frame))
+        frame = frame.f_back
+    stack.append(root)
+    stack.reverse()
+    return tuple(stack)
+
+def sample(seconds, hz, include_greenlets=False):
+    """Collect stacks for `seconds`; returns a Counter of root-first stack tuples."""
+    own = get_ident()
+    thread_names = {t.ident: t.name for t in threading.enumerate()}
+    stacks = Counter()
+    interval = 1.0 / hz
+    deadline = monotonic() + seconds
+    next_greenlet_walk = 0.0
+
+    while True:
+        now = monotonic()
+        if now >= deadline:
+            break
+        for ident, frame in sys._current_frames().items():
+            if ident != own:
+                stacks[stack_of(frame, f"thread {thread_names.get(ident, ident)}")] += 1
+        if include_greenlets and now >= next_greenlet_walk:
+            next_greenlet_walk = now + GREENLET_INTERVAL
+            # Weighted so a walk counts like the ticks it stands for
+            weight = max(1, round(GREENLET_INTERVAL * hz))
+            for obj in gc.get_objects():
+                if isinstance(obj, greenlet) and obj.gr_frame is not None:
+                    stacks[stack_of(obj.gr_frame, "greenlet")] += weight
+        sleep(interval)
+    return stacks
+
+def to_collapsed(stacks):
+    lines = [f"{';'.join(stack)} {count}" for stack, count in stacks.most_common()]
+    return '\n'.join(lines) + '\n'
+
+def to_speedscope(stacks, seconds, hz):
+    frames = []
+    frame_index = {}
+    samples = []
+    weights = []
+    for stack, count in stacks.items():
+        indices = []
+        for name in stack:
+            if name not in frame_index:
+                frame_index[name] = len(frames)
+                frames.append({'name': name})
+            indices.append(frame_index[name])
+        samples.append(indices)
+        weights.append(count / hz)
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': 'near api',
+        'exporter': 'near profiler',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': f'{seconds}s at {hz}Hz',
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': seconds,
+            'samples': samples,
+            'weights': weights,
+        }],
+    }
+
+def install(app, admin_token, path='/api/admin/profile'):
+    """Register the profiling endpoint; without an admin token it answers 404."""
+    busy = threading.Lock()
+
+    def profile():
+        if not admin_token:
+            abort(404)
+        supplied = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(supplied.encode(), admin_token.encode()):
+            abort(403)
+
+        try:
+            seconds = float(request.args.get('seconds', 5))
+            hz = float(request.args.get('hz', 100))
+            output = request.args.get('format', 'collapsed')
+            include_greenlets = request.args.get('greenlets', '0') == '1'
+            # nan slips through comparisons and would keep the sampler (and the lock) forever
+            if not (math.isfinite(seconds) and math.isfinite(hz) and seconds > 0 and hz >= 1) \
+                    or output not in ('collapsed', 'speedscope'):
+                raise ValueError("seconds and hz must be positive numbers, format collapsed or speedscope")
+            seconds = min(seconds, MAX_SECONDS)
+            hz = min(int(hz), MAX_HZ)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if not busy.acquire(blocking=False):
+            return jsonify({'error': 'A profile is already being recorded'}), 409
+        try:
+            stacks = gevent.get_hub().threadpool.apply(sample, (seconds, hz, include_greenlets))
+        finally:
+            busy.release()
+
+        if output == 'speedscope':
+            return jsonify(to_speedscope(stacks, seconds, hz))
+        return Response(to_collapsed(stacks), mimetype='text/plain')
+
+    app.add_url_rule(path, 'admin_profile', profile)
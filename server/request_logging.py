@@ -0,0 +1,129 @@
+"""Structured, sampled logging that stays off the request path.
+
+Log calls only put the record on a queue; a real OS thread (not a
+greenlet, so its file writes never block the gevent hub) formats the
+records as JSON lines and writes them out. Every record carries the id of
+the request that logged it, taken from the X-Request-ID header or
+generated, and echoed back in the response.
+
+INFO and DEBUG records logged while serving a request are kept for a
+sample of the requests only (all of them with sample_rate=1.0); warnings
+and errors are always written. Use %-style arguments, so messages of
+dropped records are never formatted:
+
+    logging.info("Found cities: %s", city_names)
+"""
+import atexit
+import json
+import logging
+import os
+import random
+import uuid
+from datetime import datetime
+from gevent.monkey import get_original # type: ignore
+from flask import g, has_request_context, request # type: ignore
+
+# The unpatched primitives, even when gevent has monkey patched the process
+start_new_thread = get_original('_thread', 'start_new_thread')
+allocate_lock = get_original('_thread', 'allocate_lock')
+SimpleQueue = get_original('queue', 'SimpleQueue')
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'request_id': getattr(record, 'request_id', None),
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class RequestContextFilter(logging.Filter):
+    """Tags records with the request id and drops unsampled INFO/DEBUG request logs."""
+
+    def filter(self, record):
+        if not has_request_context():
+            record.request_id = None
+            return True
+        record.request_id = g.get('request_id')
+        return record.levelno > logging.INFO or g.get('log_sampled', True)
+
+class QueueHandler(logging.Handler):
+    """Hands records to the writer thread; the caller does no formatting or I/O."""
+
+    def __init__(self, writer):
+        super().__init__()
+        self.writer = writer
+
+    def emit(self, record):
+        self.writer.queue.put(record)
+
+class LogWriter:
+    def __init__(self, path, formatter):
+        # Opened on every flush: pin it to the directory it was configured in
+        self.path = os.path.abspath(path)
+        self.formatter = formatter
+        self.dropped = 0
+        self.start()
+
+    def start(self):
+        self.queue = SimpleQueue()
+        self.stopped = allocate_lock()
+        self.stopped.acquire()
+        start_new_thread(self._run, ())
+
+    def _run(self):
+        try:
+            with open(self.path, 'a') as f:
+                while True:
+                    record = self.queue.get()
+                    if record is None:
+                        break
+                    try:
+                        f.write(self.formatter.format(record) + '\n')
+                    except Exception:
+                        self.dropped += 1
+                    if self.queue.empty():
+                        f.flush()
+        finally:
+            self.stopped.release()
+
+    def stop(self, timeout=2.0):
+        self.queue.put(None)
+        self.stopped.acquire(timeout=timeout)
+
+def configure_logging(path, level=logging.DEBUG):
+    """Route the root logger through a background writer thread into `path`."""
+    writer = LogWriter(path, JsonFormatter())
+    handler = QueueHandler(writer)
+    handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    # Threads do not survive fork, so pre-forked workers start their own writer
+    os.register_at_fork(after_in_child=writer.start)
+    atexit.register(writer.stop)
+    return writer
+
+def install(app, sample_rate=1.0):
+    """Assign request ids and decide per request whether its INFO logs are kept."""
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get(REQUEST_ID_HEADER, '')[:64] or uuid.uuid4().hex[:16]
+        g.log_sampled = sample_rate >= 1.0 or random.random() < sample_rate
+
+    @app.after_request
+    def echo_request_id(response):
+        if 'request_id' in g:
+            response.headers[REQUEST_ID_HEADER] = g.request_id
+        return response
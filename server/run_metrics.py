@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""Structured performance metrics for the batch scripts.
+
+Each run writes a JSON file under metrics/ with per-stage timings, row
+rates, the run's peak memory and per-city clustering figures. Two runs can be
+compared to spot regressions:
+
+    python run_metrics.py list
+    python run_metrics.py compare metrics/old.json metrics/new.json --threshold 0.2
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+METRICS_DIR = 'metrics'
+
+def peak_memory_mb():
+    """Peak resident set size of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+class StageMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.extra = {}
+
+    def add_rows(self, count):
+        self.rows += count
+
+class RunMetrics:
+    """Collects metrics for one batch run and saves them as JSON."""
+
+    def __init__(self, name, params=None, directory=METRICS_DIR):
+        self.name = name
+        self.directory = directory
+        self.started_at = datetime.now()
+        self.data = {
+            'name': name,
+            'started_at': self.started_at.isoformat(),
+            'params': params or {},
+            'stages': {},
+            'cities': {},
+        }
+
+    @contextmanager
+    def stage(self, name):
+        stage = StageMetrics(name)
+        start = time.perf_counter()
+        status = 'completed'
+        try:
+            yield stage
+        except BaseException:
+            status = 'failed'
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.data['stages'][name] = {
+                'status': status,
+                'seconds': round(elapsed, 3),
+                'rows': stage.rows,
+                'rows_per_second': round(stage.rows / elapsed, 1) if elapsed > 0 else None,
+                **stage.extra,
+            }
+
+    def record_city(self, city_id, city_name, seconds, points_scanned, clusters, clustered_points):
+        self.data['cities'][str(city_id)] = {
+            'name': city_name,
+            'seconds': round(seconds, 3),
+            'points_scanned': points_scanned,
+            'clusters': clusters,
+            'clustered_points': clustered_points,
+        }
+
+    def save(self):
+        self.data['finished_at'] = datetime.now().isoformat()
+        self.data['peak_memory_mb'] = round(peak_memory_mb(), 1)
+        os.makedirs(self.directory, exist_ok=True)
+        filename = f"{self.started_at.strftime('%Y%m%d-%H%M%S')}-{self.name}.json"
+        path = os.path.join(self.directory, filename)
+        with open(path, 'w') as f:
+            json.dump(self.data, f, indent=2, ensure_ascii=False)
+        print(f"Metrics saved to {path}")
+        return path
+
+def load_run(path):
+    with open(path) as f:
+        return json.load(f)
+
+def relative_change(old, new):
+    if not old:
+        return None
+    return (new - old) / old
+
+def compare_runs(old, new, threshold=0.2, min_seconds=0.5):
+    """Return a list of (kind, key, metric, old, new, change) regressions.
+
+    A stage or city regresses when it takes more than `threshold` longer (or
+    processes rows that much slower). Timings below `min_seconds` in both
+    runs are ignored as noise.
+    """
+    regressions = []
+
+    for name, new_stage in new.get('stages', {}).items():
+        old_stage = old.get('stages', {}).get(name)
+        if not old_stage:
+            continue
+        if max(old_stage['seconds'], new_stage['seconds']) >= min_seconds:
+            change = relative_change(old_stage['seconds'], new_stage['seconds'])
+            if change is not None and change > threshold:
+                regressions.append(('stage', name, 'seconds', old_stage['seconds'], new_stage['seconds'], change))
+        old_rate, new_rate = old_stage.get('rows_per_second'), new_stage.get('rows_per_second')
+        if old_rate and new_rate:
+            change = relative_change(old_rate, new_rate)
+            if change < -threshold:
+                regressions.append(('stage', name, 'rows_per_second', old_rate, new_rate, change))
+
+    for city_id, new_city in new.get('cities', {}).items():
+        old_city = old.get('cities', {}).get(city_id)
+        if not old_city:
+            continue
+        if max(old_city['seconds'], new_city['seconds']) < min_seconds:
+            continue
+        change = relative_change(old_city['seconds'], new_city['seconds'])
+        if change is not None and change > threshold:
+            regressions.append(('city', new_city['name'], 'seconds', old_city['seconds'], new_city['seconds'], change))
+
+    return regressions
+
+def print_comparison(old_path, new_path, threshold, min_seconds):
+    old, new = load_run(old_path), load_run(new_path)
+    print(f"Comparing {old['name']} ({old['started_at']}) -> {new['name']} ({new['started_at']})")
+
+    if old.get('params') != new.get('params'):
+        print(f"Parameters changed: {old.get('params')} -> {new.get('params')}")
+    # ru_maxrss only grows, so peak memory is measured for the whole run, not per stage
+    print(f"Peak memory: {old.get('peak_memory_mb')} -> {new.get('peak_memory_mb')} MB")
+
+    print("\n=== Stages ===")
+    for name in sorted(set(old.get('stages', {})) | set(new.get('stages', {}))):
+        o, n = old['stages'].get(name), new['stages'].get(name)
+        if not o or not n:
+            print(f"{name}: only in {'new' if n else 'old'} run")
+            continue
+        change = relative_change(o['seconds'], n['seconds'])
+        change_text = f" ({change:+.1%})" if change is not None else ""
+        print(f"{name}: {o['seconds']:.2f}s -> {n['seconds']:.2f}s{change_text}")
+
+    old_cities, new_cities = old.get('cities', {}), new.get('cities', {})
+    if old_cities or new_cities:
+        print("\n=== Cities ===")
+        print(f"Old: {len(old_cities)} cities, {sum(c['clusters'] for c in old_cities.values())} clusters")
+        print(f"New: {len(new_cities)} cities, {sum(c['clusters'] for c in new_cities.values())} clusters")
+
+    regressions = compare_runs(old, new, threshold, min_seconds)
+    print(f"\n=== Regressions (>{threshold:.0%}) ===")
+    if not regressions:
+        print("None")
+    for kind, key, metric, old_value, new_value, change in sorted(regressions, key=lambda r: -abs(r[5])):
+        print(f"{kind} {key}: {metric} {old_value} -> {new_value} ({change:+.1%})")
+    return regressions
+
+def list_runs(directory=METRICS_DIR):
+    if not os.path.isdir(directory):
+        print(f"No metrics in {directory}")
+        return
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith('.json'):
+            continue
+        run = load_run(os.path.join(directory, filename))
+        total = sum(stage['seconds'] for stage in run.get('stages', {}).values())
+        print(f"{filename}: {len(run.get('stages', {}))} stages, "
+              f"{len(run.get('cities', {}))} cities, {total:.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect batch run metrics")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list', help="list recorded runs")
+    compare = sub.add_parser('compare', help="compare two runs and flag regressions")
+    compare.add_argument('old')
+    compare.add_argument('new')
+    compare.add_argument('--threshold', type=float, default=0.2,
+                         help="relative slowdown that counts as a regression (default 0.2)")
+    compare.add_argument('--min-seconds', type=float, default=0.5,
+                         help="ignore timings shorter than this in both runs")
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        list_runs()
+    else:
+        regressions = print_comparison(args.old, args.new, args.threshold, args.min_seconds)
+        raise SystemExit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
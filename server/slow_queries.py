@@ -0,0 +1,106 @@
+"""Sampled EXPLAIN capture for slow API queries.
+
+Queries that take longer than the threshold are sampled and, in a
+background worker on a dedicated connection (never one from the API pool),
+re-run under EXPLAIN (ANALYZE, BUFFERS). The plan is written as a JSON line
+to a separate log, together with the parameters, the original duration
+and the endpoint. Like the writer in request_logging.py, the worker is a
+real OS thread, so neither the EXPLAIN nor the file write blocks the
+gevent hub.
+
+Only plain SELECT / WITH statements are explained, and the dedicated
+connection is read only, so ANALYZE can never repeat a write.
+"""
+import json
+import logging
+import os
+import random
+import re
+import time
+from datetime import datetime
+import psycopg2 # type: ignore
+from gevent.monkey import get_original # type: ignore
+
+# The unpatched primitives, as in request_logging.py
+start_new_thread = get_original('_thread', 'start_new_thread')
+SimpleQueue = get_original('queue', 'SimpleQueue')
+
+WRITE_STATEMENT = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|CREATE|DROP|ALTER)\b', re.IGNORECASE)
+
+def explainable(query):
+    text = query.lstrip().upper()
+    return (text.startswith('SELECT') or text.startswith('WITH')) and not WRITE_STATEMENT.search(query)
+
+class SlowQueryLog:
+    def __init__(self, dsn, threshold_ms, sample_rate=0.1, path='slow_queries.log', max_pending=100):
+        self.dsn = dsn
+        self.threshold = threshold_ms / 1000
+        self.sample_rate = sample_rate
+        # Opened on every capture: pin it to the directory it was configured in
+        self.path = os.path.abspath(path)
+        self.max_pending = max_pending
+        self.captured = 0
+        self.dropped = 0
+        self.start()
+        # Threads and connections do not survive fork, so pre-forked workers start their own
+        os.register_at_fork(after_in_child=self.start)
+
+    def start(self):
+        self._pending = SimpleQueue()
+        self._conn = None
+        start_new_thread(self._run, ())
+
+    def observe(self, query, params, seconds, endpoint=None):
+        """Queue a plan capture if the query was slow and is sampled; never blocks the caller."""
+        if seconds < self.threshold or random.random() >= self.sample_rate:
+            return
+        if isinstance(query, bytes):
+            query = query.decode()
+        if not explainable(query):
+            return
+        # SimpleQueue has no bound of its own; a few over max_pending under a race is fine
+        if self._pending.qsize() >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.put((query, params, seconds, endpoint))
+
+    def _connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(self.dsn)
+            self._conn.set_session(readonly=True)
+        return self._conn
+
+    def _explain(self, query, params):
+        conn = self._connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, params)
+            plan = '\n'.join(row[0] for row in cur.fetchall())
+            cur.close()
+            return plan
+        finally:
+            conn.rollback()
+
+    def _run(self):
+        while True:
+            query, params, seconds, endpoint = self._pending.get()
+            start = time.perf_counter()
+            try:
+                plan = self._explain(query, params)
+            except Exception as e:
+                logging.warning("Could not explain slow query: %s", e)
+                if self._conn is not None:
+                    self._conn.close()
+                continue
+            entry = {
+                'time': datetime.now().isoformat(),
+                'endpoint': endpoint,
+                'duration_ms': round(seconds * 1000, 3),
+                'explain_ms': round((time.perf_counter() - start) * 1000, 3),
+                'query': ' '.join(query.split()),
+                'params': params,
+                'plan': plan,
+            }
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry, default=str) + '\n')
+            self.captured += 1
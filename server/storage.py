@@ -0,0 +1,444 @@
+"""Data access for the API behind a small repository interface.
+
+Routes open a session per request and call its methods; they never see
+SQL or connections:
+
+    with storage.session() as db:
+        points = db.points_in_bbox(min_lon, min_lat, max_lon, max_lat)
+
+PostgisStorage runs the queries against the PostGIS tables through the
+API's connection pool, one connection per session. MemoryStorage answers
+the same calls from in-process data, usually built by generate_dataset(),
+so request handling, serialization and caching can be benchmarked and
+profiled without a database:
+
+    NEAR_STORAGE=memory SYNTHETIC_POINTS=1000000 python api.py --port 8080 --no-ssl
+
+Every method returns plain dicts with the same keys and value types as the
+PostGIS rows, so responses look the same whichever backend is used.
+"""
+import json
+import math
+import random
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+
+from metrics import TimedCursor
+from poi_grid import cell_range, cell_size
+
+# Thessaloniki center, where the synthetic cities are laid out
+SYNTHETIC_CENTER = (22.9444, 40.6401)
+EARTH_RADIUS_M = 6371008.8
+
+class PostgisSession:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _fetchall(self, query, params):
+        cur = self.conn.cursor(cursor_factory=TimedCursor)
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
+    def _fetchone(self, query, params, commit=False):
+        cur = self.conn.cursor(cursor_factory=TimedCursor)
+        cur.execute(query, params)
+        row = cur.fetchone()
+        if commit:
+            self.conn.commit()
+        cur.close()
+        return row
+
+    def points_in_bbox(self, min_lon, min_lat, max_lon, max_lat):
+        return self._fetchall("""
+            SELECT id,
+                ST_X(geom) as longitude,
+                ST_Y(geom) as latitude
+            FROM osm_points
+            WHERE geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
+        """, (min_lon, min_lat, max_lon, max_lat))
+
+    def cities_in_bbox(self, min_lon, min_lat, max_lon, max_lat):
+        return self._fetchall("""
+            SELECT
+                id,
+                name,
+                ST_AsGeoJSON(geom) as geometry
+            FROM cities
+            WHERE geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
+            ORDER BY name
+        """, (min_lon, min_lat, max_lon, max_lat))
+
+    def nearest_cities_with_clusters(self, locations):
+        """The city with clusters nearest to each (lon, lat) location, in one KNN lookup per location.
+
+        Rows (location, id, name, distance) in location order, location being
+        the index into `locations`; a location gets no row when no city has
+        clusters.
+        """
+        return self._fetchall("""
+            SELECT
+                (l.ordinality - 1)::integer as location,
+                nearest.id,
+                nearest.name,
+                ST_Distance(nearest.geom::geography, l.geom::geography) as distance
+            FROM (
+                SELECT ordinality, ST_SetSRID(ST_MakePoint(lon, lat), 4326) AS geom
+                FROM unnest(%s::float8[], %s::float8[]) WITH ORDINALITY AS u (lon, lat, ordinality)
+            ) l
+            CROSS JOIN LATERAL (
+                SELECT c.id, c.name, c.geom
+                FROM cities c
+                WHERE EXISTS (SELECT 1 FROM poi_clusters pc WHERE pc.city_id = c.id)
+                ORDER BY c.geom <-> l.geom
+                LIMIT 1
+            ) nearest
+            ORDER BY l.ordinality
+        """, ([lon for lon, _ in locations], [lat for _, lat in locations]))
+
+    def clusters_for_cities(self, city_ids):
+        """Clusters of the given cities, largest first, with the city name as city_name."""
+        placeholders = ','.join(['%s'] * len(city_ids))
+        return self._fetchall(f"""
+            SELECT
+                pc.id,
+                pc.city_id,
+                c.name as city_name,
+                pc.cluster_id,
+                pc.point_count,
+                ST_X(pc.geom) as longitude,
+                ST_Y(pc.geom) as latitude
+            FROM poi_clusters pc
+            JOIN cities c ON pc.city_id = c.id
+            WHERE pc.city_id IN ({placeholders})
+            ORDER BY pc.point_count DESC
+        """, city_ids)
+
+    def cell_counts(self, level, min_lon, min_lat, max_lon, max_lat):
+        """poi_grid cells of a level overlapping the bbox, with their POI count and centroid."""
+        x0, y0, x1, y1 = cell_range(level, min_lon, min_lat, max_lon, max_lat)
+        return self._fetchall("""
+            SELECT
+                cell_x,
+                cell_y,
+                point_count,
+                sum_lon / point_count as longitude,
+                sum_lat / point_count as latitude
+            FROM poi_grid
+            WHERE level = %s AND cell_x BETWEEN %s AND %s AND cell_y BETWEEN %s AND %s
+            ORDER BY cell_y, cell_x
+        """, (level, x0, x1, y0, y1))
+
+    def sync_state(self):
+        """(committed change version, newest version whose tombstones were pruned), see poi_versions.py."""
+        row = self._fetchone("""
+            SELECT committed_version as version, pruned_through FROM osm_points_sync_state
+        """, ())
+        return row['version'], row['pruned_through']
+
+    def changes_in_cells(self, grid_size, cells, since, until):
+        """Points inserted or moved into, and positions left in, the given grid cells in (since, until].
+
+        cells holds (cell_lon, cell_lat) pairs as the client computes them,
+        floor(coordinate / grid_size). Returns (upserted, deleted), oldest
+        change first.
+        """
+        params = {
+            'xs': [x for x, _ in cells],
+            'ys': [y for _, y in cells],
+            'size': grid_size,
+            'since': since,
+            'until': until,
+        }
+        upserted = self._fetchall("""
+            SELECT p.id, ST_X(p.geom) as longitude, ST_Y(p.geom) as latitude, p.version
+            FROM unnest(%(xs)s::integer[], %(ys)s::integer[]) AS c (x, y)
+            JOIN osm_points p ON p.geom && ST_MakeEnvelope(
+                c.x * %(size)s, c.y * %(size)s, (c.x + 1) * %(size)s, (c.y + 1) * %(size)s, 4326)
+            WHERE p.version > %(since)s AND p.version <= %(until)s
+                AND FLOOR(ST_X(p.geom) / %(size)s) = c.x AND FLOOR(ST_Y(p.geom) / %(size)s) = c.y
+            ORDER BY p.version
+        """, params)
+        deleted = self._fetchall("""
+            SELECT t.id, t.longitude, t.latitude, t.version
+            FROM osm_points_tombstones t
+            JOIN unnest(%(xs)s::integer[], %(ys)s::integer[]) AS c (x, y)
+                ON FLOOR(t.longitude / %(size)s) = c.x AND FLOOR(t.latitude / %(size)s) = c.y
+            WHERE t.version > %(since)s AND t.version <= %(until)s
+            ORDER BY t.version
+        """, params)
+        return upserted, deleted
+
+    def get_meeting(self, token):
+        return self._fetchone("SELECT * FROM meetings WHERE token = %s", (token,))
+
+    def create_meeting(self, token, longitude, latitude, meeting_datetime, status):
+        return self._fetchone("""
+            INSERT INTO meetings (token, location_lon, location_lat, datetime, status)
+            VALUES (%s, %s, %s, %s, %s)
+            RETURNING id, token, status, location_lon, location_lat, datetime, created_at
+        """, (token, longitude, latitude, meeting_datetime, status), commit=True)
+
+    def suggest_meeting(self, token, longitude, latitude, meeting_datetime, status):
+        return self._fetchone("""
+            UPDATE meetings
+            SET location_lon = %s, location_lat = %s, datetime = %s, status = %s, updated_at = NOW()
+            WHERE token = %s
+            RETURNING id, token, status, location_lon, location_lat, datetime, created_at, updated_at
+        """, (longitude, latitude, meeting_datetime, status, token), commit=True)
+
+    def set_meeting_status(self, token, status):
+        return self._fetchone("""
+            UPDATE meetings
+            SET status = %s, updated_at = NOW()
+            WHERE token = %s
+            RETURNING id, token, status, location_lon, location_lat, created_at, updated_at
+        """, (status, token), commit=True)
+
+class PostgisStorage:
+    """Sessions over connections checked out with getconn and handed back with putconn."""
+
+    def __init__(self, getconn, putconn):
+        self.getconn = getconn
+        self.putconn = putconn
+
+    @contextmanager
+    def session(self):
+        conn = self.getconn()
+        try:
+            yield PostgisSession(conn)
+        finally:
+            self.putconn(conn)
+
+def _polygon_contains(ring, lon, lat):
+    inside = False
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        if (y1 > lat) != (y2 > lat) and lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+def _distance_m(lon1, lat1, lon2, lat2):
+    dlon = math.radians(lon2 - lon1)
+    dlat = math.radians(lat2 - lat1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+def _polygon_distance(ring, lon, lat):
+    """Planar distance in degrees from a point to a polygon (0 inside), and the closest point."""
+    if _polygon_contains(ring, lon, lat):
+        return 0.0, (lon, lat)
+    best = (math.inf, None)
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+        dx, dy = x2 - x1, y2 - y1
+        t = 0.0 if dx == dy == 0 else max(0.0, min(1.0, ((lon - x1) * dx + (lat - y1) * dy) / (dx * dx + dy * dy)))
+        px, py = x1 + t * dx, y1 + t * dy
+        d = math.hypot(lon - px, lat - py)
+        if d < best[0]:
+            best = (d, (px, py))
+    return best
+
+class MemoryStorage:
+    """In-process storage; the session is the storage itself."""
+
+    def __init__(self, dataset):
+        # Points sorted by longitude, so a bbox query is a binary search plus a latitude mask
+        order = np.argsort(dataset['lons'], kind='stable')
+        self.ids = np.asarray(dataset['ids'])[order]
+        self.lons = np.asarray(dataset['lons'])[order]
+        self.lats = np.asarray(dataset['lats'])[order]
+
+        self.cities = dataset['cities']
+        for city in self.cities:
+            ring = city['ring']
+            city['bbox'] = (min(x for x, _ in ring), min(y for _, y in ring),
+                            max(x for x, _ in ring), max(y for _, y in ring))
+            city['geometry'] = json.dumps({'type': 'MultiPolygon', 'coordinates': [[[list(p) for p in ring]]]})
+        self.city_names = {city['id']: city['name'] for city in self.cities}
+
+        self.clusters_by_city = {}
+        for cluster in dataset['clusters']:
+            self.clusters_by_city.setdefault(cluster['city_id'], []).append(cluster)
+
+        self.meetings = {}
+        self.next_meeting_id = 1
+
+    @classmethod
+    def synthetic(cls, **kwargs):
+        return cls(generate_dataset(**kwargs))
+
+    @contextmanager
+    def session(self):
+        yield self
+
+    def points_in_bbox(self, min_lon, min_lat, max_lon, max_lat):
+        start = np.searchsorted(self.lons, min_lon, side='left')
+        end = np.searchsorted(self.lons, max_lon, side='right')
+        lats = self.lats[start:end]
+        mask = (lats >= min_lat) & (lats <= max_lat)
+        return [
+            {'id': point_id, 'longitude': lon, 'latitude': lat}
+            for point_id, lon, lat in zip(self.ids[start:end][mask].tolist(),
+                                          self.lons[start:end][mask].tolist(), lats[mask].tolist())
+        ]
+
+    def cities_in_bbox(self, min_lon, min_lat, max_lon, max_lat):
+        found = [
+            {'id': city['id'], 'name': city['name'], 'geometry': city['geometry']}
+            for city in self.cities
+            if city['bbox'][0] <= max_lon and city['bbox'][2] >= min_lon
+            and city['bbox'][1] <= max_lat and city['bbox'][3] >= min_lat
+        ]
+        return sorted(found, key=lambda city: city['name'])
+
+    def nearest_cities_with_clusters(self, locations):
+        rows = []
+        for index, (lon, lat) in enumerate(locations):
+            best = None
+            for city in self.cities:
+                if city['id'] not in self.clusters_by_city:
+                    continue
+                d, closest = _polygon_distance(city['ring'], lon, lat)
+                if best is None or d < best[0]:
+                    best = (d, closest, city)
+            if best is not None:
+                _, (x, y), city = best
+                rows.append({'location': index, 'id': city['id'], 'name': city['name'],
+                             'distance': _distance_m(lon, lat, x, y)})
+        return rows
+
+    def clusters_for_cities(self, city_ids):
+        clusters = [
+            dict(cluster, city_name=self.city_names[city_id])
+            for city_id in city_ids
+            for cluster in self.clusters_by_city.get(city_id, [])
+        ]
+        clusters.sort(key=lambda cluster: cluster['point_count'], reverse=True)
+        return clusters
+
+    def cell_counts(self, level, min_lon, min_lat, max_lon, max_lat):
+        # Whole cells, like poi_grid: widen the bbox to the cell edges first
+        size = cell_size(level)
+        x0, y0, x1, y1 = cell_range(level, min_lon, min_lat, max_lon, max_lat)
+        start = np.searchsorted(self.lons, -180 + x0 * size, side='left')
+        end = np.searchsorted(self.lons, -180 + (x1 + 1) * size, side='left')
+        lons, lats = self.lons[start:end], self.lats[start:end]
+        cell_x = np.floor((lons + 180) / size).astype(np.int64)
+        cell_y = np.floor((lats + 90) / size).astype(np.int64)
+        mask = (cell_y >= y0) & (cell_y <= y1)
+        cells, inverse, counts = np.unique(cell_y[mask] * (x1 - x0 + 1) + (cell_x[mask] - x0),
+                                           return_inverse=True, return_counts=True)
+        sum_lon = np.bincount(inverse, weights=lons[mask])
+        sum_lat = np.bincount(inverse, weights=lats[mask])
+        return [
+            {'cell_x': x0 + cell % (x1 - x0 + 1), 'cell_y': cell // (x1 - x0 + 1), 'point_count': count,
+             'longitude': lon / count, 'latitude': lat / count}
+            for cell, count, lon, lat in zip(cells.tolist(), counts.tolist(), sum_lon.tolist(), sum_lat.tolist())
+        ]
+
+    def sync_state(self):
+        # The synthetic points never change
+        return 0, 0
+
+    def changes_in_cells(self, grid_size, cells, since, until):
+        return [], []
+
+    def get_meeting(self, token):
+        meeting = self.meetings.get(token)
+        return dict(meeting) if meeting else None
+
+    def _returning(self, token, columns):
+        meeting = self.meetings[token]
+        return {column: meeting[column] for column in columns}
+
+    def create_meeting(self, token, longitude, latitude, meeting_datetime, status):
+        self.meetings[token] = {
+            'id': self.next_meeting_id,
+            'token': token,
+            'location_lon': longitude,
+            'location_lat': latitude,
+            'datetime': datetime.fromisoformat(meeting_datetime),
+            'status': status,
+            'created_at': datetime.now(),
+            'updated_at': None,
+        }
+        self.next_meeting_id += 1
+        return self._returning(token, ('id', 'token', 'status', 'location_lon', 'location_lat', 'datetime', 'created_at'))
+
+    def suggest_meeting(self, token, longitude, latitude, meeting_datetime, status):
+        if token not in self.meetings:
+            return None
+        self.meetings[token].update(location_lon=longitude, location_lat=latitude,
+                                    datetime=datetime.fromisoformat(meeting_datetime),
+                                    status=status, updated_at=datetime.now())
+        return self._returning(token, ('id', 'token', 'status', 'location_lon', 'location_lat', 'datetime',
+                                       'created_at', 'updated_at'))
+
+    def set_meeting_status(self, token, status):
+        if token not in self.meetings:
+            return None
+        self.meetings[token].update(status=status, updated_at=datetime.now())
+        return self._returning(token, ('id', 'token', 'status', 'location_lon', 'location_lat',
+                                       'created_at', 'updated_at'))
+
+def generate_dataset(num_cities=50, num_points=1_000_000, clusters_per_city=20, seed=0, center=SYNTHETIC_CENTER):
+    """Synthetic cities, POIs and clusters shaped like the real data around `center`.
+
+    Cities are irregular polygons on a jittered grid. Each city's POIs are
+    gathered around a few dense centers, with some uniform background noise,
+    and its clusters are those centers, with the number of POIs around each.
+    """
+    rng = np.random.default_rng(seed)
+    py_random = random.Random(seed)
+    side = math.ceil(math.sqrt(num_cities))
+    cell = 0.04  # degrees between city centers, a few km
+
+    cities, clusters = [], []
+    ids, lons, lats = [], [], []
+    points_per_city = np.bincount(rng.integers(0, num_cities, num_points), minlength=num_cities)
+    next_point_id = 1
+    next_cluster_id = 1
+
+    for index in range(num_cities):
+        row, col = divmod(index, side)
+        cx = center[0] + (col - side / 2) * cell + rng.uniform(-0.005, 0.005)
+        cy = center[1] + (row - side / 2) * cell + rng.uniform(-0.005, 0.005)
+
+        # Irregular polygon: twelve vertices at varying radii around the center
+        angles = np.linspace(0, 2 * math.pi, 12, endpoint=False)
+        radii = rng.uniform(0.35, 0.5, len(angles)) * cell
+        ring = [(cx + r * math.cos(a), cy + r * math.sin(a)) for a, r in zip(angles, radii)]
+        ring.append(ring[0])
+        city_id = index + 1
+        cities.append({'id': city_id, 'name': f"City {py_random.randrange(10**6):06d}-{city_id}", 'ring': ring})
+
+        count = int(points_per_city[index])
+        hotspots = rng.uniform(-0.3, 0.3, (clusters_per_city, 2)) * cell + (cx, cy)
+        noise = count // 10
+        membership = rng.integers(0, clusters_per_city, count - noise)
+        spread = rng.uniform(0.0005, 0.002, clusters_per_city)
+        city_lons = np.concatenate([hotspots[membership, 0] + rng.normal(0, 1, len(membership)) * spread[membership],
+                                    cx + rng.uniform(-0.35, 0.35, noise) * cell])
+        city_lats = np.concatenate([hotspots[membership, 1] + rng.normal(0, 1, len(membership)) * spread[membership],
+                                    cy + rng.uniform(-0.35, 0.35, noise) * cell])
+        ids.append(np.arange(next_point_id, next_point_id + count, dtype=np.int64))
+        lons.append(city_lons)
+        lats.append(city_lats)
+        next_point_id += count
+
+        sizes = np.bincount(membership, minlength=clusters_per_city)
+        for cluster_id, ((lon, lat), size) in enumerate(zip(hotspots.tolist(), sizes.tolist())):
+            if size == 0:
+                continue
+            clusters.append({'id': next_cluster_id, 'city_id': city_id, 'cluster_id': cluster_id,
+                             'point_count': size, 'longitude': lon, 'latitude': lat})
+            next_cluster_id += 1
+
+    return {
+        'ids': np.concatenate(ids) if ids else np.empty(0, dtype=np.int64),
+        'lons': np.concatenate(lons) if lons else np.empty(0),
+        'lats': np.concatenate(lats) if lats else np.empty(0),
+        'cities': cities,
+        'clusters': clusters,
+    }
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Parameter sweep for the per-city DBSCAN clustering.
+
+Extracts a city's points from osm_points once, then evaluates a grid of
+EPS / MIN_POINTS values in parallel worker processes and prints cluster
+counts, coverage and runtime for every combination:
+
+    python sweep_clusters.py --city ΘΕΣΣΑΛΟΝΙΚΗΣ --eps 0.00025,0.0005,0.001 --min-points 10,20,40,80
+
+The clustering runs in-process with scikit-learn's DBSCAN, which uses the
+same definition as ST_ClusterDBSCAN (planar distance in degrees, a point is
+a core point when at least minpoints points, itself included, lie within
+eps). The neighbourhood graph is built once per eps and reused for every
+minpoints value.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np # type: ignore
+from sklearn.cluster import DBSCAN # type: ignore
+from sklearn.neighbors import NearestNeighbors # type: ignore
+
+from create_clusters import EPS, MIN_POINTS, connect_db
+
+# Set in the parent before the workers fork, so they share it without copying
+_points = None
+
+def fetch_city_points(conn, city, store_dir=None):
+    """Return (city_id, city_name, points) for a city given by name or id.
+
+    points is an (n, 2) float64 array of lon/lat, selected exactly like
+    create_clusters.process_city does. With store_dir the points are read
+    from the city's partition of the columnar POI store instead.
+    """
+    cur = conn.cursor()
+    if str(city).isdigit():
+        cur.execute("SELECT id, name FROM cities WHERE id = %s", (int(city),))
+    else:
+        cur.execute("SELECT id, name FROM cities WHERE name = %s", (city,))
+    row = cur.fetchone()
+    if not row:
+        cur.close()
+        raise ValueError(f"City not found: {city}")
+    city_id, city_name = row
+
+    if store_dir:
+        from poi_store import read_points
+        cur.close()
+        _, lons, lats = read_points(store_dir, city_id)
+        return city_id, city_name, np.column_stack((lons, lats))
+
+    cur.execute("""
+        SELECT ST_X(p.geom), ST_Y(p.geom)
+        FROM osm_points p, cities c
+        WHERE c.id = %s
+          AND p.geom && c.geom AND ST_Intersects(c.geom, p.geom)
+    """, (city_id,))
+    points = np.array(cur.fetchall(), dtype=np.float64).reshape(-1, 2)
+    cur.close()
+    return city_id, city_name, points
+
+def evaluate_eps(eps, min_points_values):
+    """Cluster the shared points with one eps and every minpoints value."""
+    points = _points
+    total = len(points)
+    results = []
+
+    start = time.perf_counter()
+    graph = NearestNeighbors(radius=eps).fit(points).radius_neighbors_graph(mode='distance')
+    graph_seconds = time.perf_counter() - start
+
+    for min_points in min_points_values:
+        start = time.perf_counter()
+        labels = DBSCAN(eps=eps, min_samples=min_points, metric='precomputed').fit_predict(graph)
+        seconds = time.perf_counter() - start
+
+        clustered = labels >= 0
+        sizes = np.bincount(labels[clustered]) if clustered.any() else np.array([], dtype=np.int64)
+        results.append({
+            'eps': eps,
+            'min_points': min_points,
+            'clusters': int(len(sizes)),
+            'clustered_points': int(clustered.sum()),
+            'coverage': float(clustered.sum() / total) if total else 0.0,
+            'largest_cluster': int(sizes.max()) if len(sizes) else 0,
+            'median_cluster': float(np.median(sizes)) if len(sizes) else 0.0,
+            # The neighbourhood graph is shared by every minpoints value of this eps
+            'seconds': round(seconds + graph_seconds / len(min_points_values), 4),
+        })
+    return results
+
+def run_sweep(points, eps_values, min_points_values, workers):
+    global _points
+    _points = points
+    results = []
+    # fork keeps the point array shared copy-on-write with the workers
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = [executor.submit(evaluate_eps, eps, min_points_values) for eps in eps_values]
+        for future in as_completed(futures):
+            results.extend(future.result())
+    results.sort(key=lambda r: (r['eps'], r['min_points']))
+    return results
+
+def parse_list(value, cast):
+    return [cast(v) for v in value.split(',') if v.strip()]
+
+def print_results(city_name, total, results):
+    print(f"\n=== {city_name}: {total} points ===")
+    print(f"{'eps':>10} {'minpts':>7} {'clusters':>9} {'coverage':>9} {'largest':>8} {'median':>7} {'seconds':>8}")
+    for r in results:
+        current = ' *' if r['eps'] == EPS and r['min_points'] == MIN_POINTS else ''
+        print(f"{r['eps']:>10g} {r['min_points']:>7} {r['clusters']:>9} {r['coverage']:>9.1%} "
+              f"{r['largest_cluster']:>8} {r['median_cluster']:>7g} {r['seconds']:>8.3f}{current}")
+    print("* current create_clusters.py values")
+
+def write_results(path, city_id, city_name, total, results):
+    if path.endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump({'city_id': city_id, 'city': city_name, 'points': total, 'results': results},
+                      f, indent=2, ensure_ascii=False)
+    else:
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
+    print(f"Results written to {path}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep DBSCAN parameters for one city")
+    parser.add_argument('--city', required=True, help="city name or id")
+    parser.add_argument('--eps', default='0.00025,0.0005,0.00075,0.001',
+                        help="comma separated eps values in degrees")
+    parser.add_argument('--min-points', default='10,20,40,80',
+                        help="comma separated minpoints values")
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--output', help="write results to a .csv or .json file")
+    parser.add_argument('--store', metavar='DIR',
+                        help="read the points from the columnar POI store instead of osm_points")
+    args = parser.parse_args()
+
+    eps_values = parse_list(args.eps, float)
+    min_points_values = parse_list(args.min_points, int)
+
+    conn = connect_db()
+    try:
+        start = time.time()
+        city_id, city_name, points = fetch_city_points(conn, args.city, args.store)
+        print(f"Loaded {len(points)} points for {city_name} in {time.time() - start:.2f} seconds")
+    finally:
+        conn.close()
+
+    if not len(points):
+        print(f"No points inside {city_name}")
+        sys.exit(1)
+
+    start = time.time()
+    results = run_sweep(points, eps_values, min_points_values, args.workers)
+    print(f"Evaluated {len(results)} combinations in {time.time() - start:.2f} seconds")
+    print_results(city_name, len(points), results)
+    if args.output:
+        write_results(args.output, city_id, city_name, len(points), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""POST /api/clusters/batch: NDJSON lines in request order, against MemoryStorage."""
+import json
+
+from storage import SYNTHETIC_CENTER
+
+LON, LAT = SYNTHETIC_CENTER
+PAIRS = [
+    {'lon1': LON + 0.01 * i, 'lat1': LAT - 0.01 * i, 'lon2': LON - 0.02 * i, 'lat2': LAT + 0.015 * i}
+    for i in range(8)
+]
+
+def batch(client, pairs, **params):
+    return client.post('/api/clusters/batch', json={'pairs': pairs, **params})
+
+def lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+def test_lines_in_request_order(api_client):
+    response = batch(api_client, PAIRS)
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+
+    results = lines(response)
+    assert [result['index'] for result in results] == list(range(len(PAIRS)))
+    for pair, result in zip(PAIRS, results):
+        get = api_client.get('/api/clusters', query_string=pair).get_json()
+        assert {key: value for key, value in result.items() if key != 'index'} == get
+
+def test_ranked_lines_match_get(api_client):
+    results = lines(batch(api_client, PAIRS, top=2, score='sum'))
+    for index, (pair, result) in enumerate(zip(PAIRS, results)):
+        get = api_client.get('/api/clusters', query_string=dict(pair, top=2, score='sum')).get_json()
+        assert result.pop('index') == index
+        assert result == get
+
+def test_invalid_pair_in_the_middle_fails_the_whole_batch(api_client):
+    pairs = PAIRS[:3] + [dict(PAIRS[3], lat2=95.0)] + PAIRS[4:]
+    response = batch(api_client, pairs)
+
+    # Checked before streaming starts: one JSON error, no lines
+    assert response.status_code == 400
+    assert response.mimetype == 'application/json'
+    assert 'Invalid coordinates' in response.get_json()['error']
+
+    missing = PAIRS[:3] + [{'lon1': LON, 'lat1': LAT}] + PAIRS[4:]
+    response = batch(api_client, missing)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+def test_batch_limits(api_module, api_client):
+    assert batch(api_client, []).status_code == 400
+    assert batch(api_client, PAIRS[:1] * (api_module.CLUSTERS_BATCH_MAX_PAIRS + 1)).status_code == 400
@@ -0,0 +1,61 @@
+"""POST /api/clusters (any number of people) against MemoryStorage."""
+from storage import SYNTHETIC_CENTER
+
+LON, LAT = SYNTHETIC_CENTER
+# Spread around the synthetic cities, so different locations pick different ones
+LOCATIONS = [(LON + dx, LAT + dy) for dx, dy in ((0.05, 0.0), (-0.06, 0.02), (0.0, -0.05), (0.03, 0.04), (-0.02, -0.03))]
+
+def post(client, locations, **params):
+    body = {'locations': [{'longitude': lon, 'latitude': lat} for lon, lat in locations], **params}
+    return client.post('/api/clusters', json=body)
+
+def nearest_city_names(api, locations):
+    with api.storage.session() as db:
+        return [city['name'] for city in db.nearest_cities_with_clusters(locations)]
+
+def test_locations_and_cities_in_request_order(api_module, api_client):
+    response = post(api_client, LOCATIONS)
+    assert response.status_code == 200
+    body = response.get_json()
+
+    assert body['locations'] == [{'longitude': lon, 'latitude': lat} for lon, lat in LOCATIONS]
+    # Nearest cities, first occurrence first
+    assert [city['name'] for city in body['cities']] == list(dict.fromkeys(nearest_city_names(api_module, LOCATIONS)))
+    assert len({city['name'] for city in body['cities']}) > 1
+
+    reversed_body = post(api_client, LOCATIONS[::-1]).get_json()
+    assert [city['name'] for city in reversed_body['cities']] == \
+        list(dict.fromkeys(nearest_city_names(api_module, LOCATIONS[::-1])))
+    assert post(api_client, LOCATIONS).get_json() == body
+
+def test_two_locations_match_get(api_client):
+    (lon1, lat1), (lon2, lat2) = LOCATIONS[:2]
+    get = api_client.get(f'/api/clusters?lon1={lon1}&lat1={lat1}&lon2={lon2}&lat2={lat2}&top=3&score=sum')
+    assert post(api_client, LOCATIONS[:2], top=3, score='sum').get_json() == get.get_json()
+
+def test_duplicate_locations_share_their_city(api_client):
+    unique = post(api_client, LOCATIONS[:2]).get_json()
+    duplicated = post(api_client, [LOCATIONS[0], LOCATIONS[1], LOCATIONS[0]]).get_json()
+
+    # Each city and its clusters once, every location echoed
+    assert duplicated['cities'] == unique['cities']
+    assert duplicated['count'] == unique['count']
+    assert len(duplicated['locations']) == 3
+
+def test_ranked_distances_follow_the_locations(api_client):
+    body = post(api_client, LOCATIONS, top=2).get_json()
+    clusters = [cluster for city in body['cities'] for cluster in city['clusters']]
+    assert body['ranking'] == {'score': 'max', 'top': 2}
+    assert sorted(cluster['rank'] for cluster in clusters) == [1, 2]
+    assert all(len(cluster['distances']) == len(LOCATIONS) for cluster in clusters)
+
+def test_invalid_locations(api_module, api_client):
+    assert post(api_client, [LOCATIONS[0], (181.0, LAT)]).status_code == 400
+    assert post(api_client, [LOCATIONS[0], (LON, -91.0)]).status_code == 400
+    assert post(api_client, []).status_code == 400
+    assert post(api_client, [LOCATIONS[0]] * (api_module.CLUSTERS_MAX_LOCATIONS + 1)).status_code == 400
+    assert post(api_client, LOCATIONS, score='min').status_code == 400
+    assert post(api_client, LOCATIONS, top=0).status_code == 400
+    missing = api_client.post('/api/clusters', json={'locations': [{'longitude': LON}]})
+    assert missing.status_code == 400
+    assert 'error' in missing.get_json()
@@ -0,0 +1,67 @@
+import gzip
+import math
+import sqlite3
+import struct
+import pytest
+from shapely import wkb # type: ignore
+
+import export_region
+from export_region import GRID_SIZE, point_blob, point_bounds, slugify, snap_to_cells
+
+def test_point_blob_is_a_gpkg_point():
+    blob = point_blob(22.9444, 40.6401)
+    magic, version, flags, srid = struct.unpack_from('<2sBBi', blob)
+    # Version 0, little endian, no envelope, so the WKB starts at byte 8
+    assert (magic, version, flags, srid) == (b'GP', 0, 0x01, 4326)
+    point = wkb.loads(blob[8:])
+    assert (point.geom_type, point.x, point.y) == ('Point', 22.9444, 40.6401)
+    assert point_bounds(blob) == (22.9444, 22.9444, 40.6401, 40.6401)
+
+def test_snap_to_cells_matches_the_client_grid():
+    # SpatialDb: (coordinate / gridSize).floor()
+    for lon, lat in ((22.9444, 40.6401), (-0.0001, -33.9), (0.0, 0.0)):
+        x0, y0, _, _ = snap_to_cells(lon, lat, lon, lat)
+        assert (x0, y0) == (math.floor(lon / GRID_SIZE), math.floor(lat / GRID_SIZE))
+    assert snap_to_cells(-0.001, 0.004, 0.005, 0.0051) == (-1, 0, 1, 1)
+
+def test_slugify():
+    assert slugify('Δήμος Θεσσαλονίκης') == 'region'
+    assert slugify('  Kalamaria / Pylaia ') == 'kalamaria-pylaia'
+
+@pytest.fixture
+def package(tmp_path, monkeypatch):
+    points = [(22.9401, 40.6401), (22.9412, 40.6433), (22.9412, 40.6433), (22.9488, 40.6499)]
+
+    def fetch_points(conn, min_lon, min_lat, max_lon, max_lat):
+        return [(lon, lat) for lon, lat in points if min_lon <= lon <= max_lon and min_lat <= lat <= max_lat]
+
+    monkeypatch.setattr(export_region, 'fetch_points', fetch_points)
+    path, count, cells = export_region.export_region(None, 'center', 22.941, 40.641, 22.949, 40.649, str(tmp_path))
+    gpkg = tmp_path / 'center.gpkg'
+    with gzip.open(path) as src:
+        gpkg.write_bytes(src.read())
+    db = sqlite3.connect(gpkg)
+    yield db, count, cells
+    db.close()
+
+def test_package_holds_whole_cells(package):
+    db, count, cells = package
+    assert db.execute("PRAGMA integrity_check").fetchone()[0] == 'ok'
+    assert db.execute("PRAGMA application_id").fetchone()[0] == export_region.GPKG_APPLICATION_ID
+
+    # The bbox snaps out to cells 4588-4589 x 8128-8129, so the first point is in
+    assert snap_to_cells(22.941, 40.641, 22.949, 40.649) == (4588, 8128, 4589, 8129)
+    assert cells == 4
+    assert sorted(db.execute("SELECT cell_lon, cell_lat FROM cells_pois")) == \
+        [(4588, 8128), (4588, 8129), (4589, 8128), (4589, 8129)]
+    # The duplicate is stored once
+    assert count == 3
+    assert db.execute("SELECT COUNT(*) FROM pois").fetchone()[0] == 3
+
+def test_package_rtree_finds_points(package):
+    db, _, _ = package
+    rows = db.execute("""
+        SELECT p.geopoint FROM pois p JOIN rtree_pois_geopoint r ON r.id = p.id
+        WHERE r.maxx >= 22.941 AND r.minx <= 22.942 AND r.maxy >= 40.643 AND r.miny <= 40.644
+    """).fetchall()
+    assert [point_bounds(blob)[::2] for blob, in rows] == [(22.9412, 40.6433)]
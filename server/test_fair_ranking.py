@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from fair_ranking import haversine_m, rank_clusters
+
+def cluster(cluster_id, lon, lat, point_count):
+    return {'id': cluster_id, 'longitude': lon, 'latitude': lat, 'point_count': point_count}
+
+def test_haversine_one_degree_of_latitude():
+    distance = haversine_m(np.array([23.0]), np.array([40.0]), 23.0, 41.0)[0]
+    assert distance == pytest.approx(111195, rel=1e-3)
+    assert haversine_m(np.array([23.0]), np.array([40.0]), 23.0, 40.0)[0] == 0
+
+def test_max_prefers_the_fair_middle_and_sum_the_least_travel():
+    # Two people at one end, one at the other
+    locations = [(23.0, 40.0), (23.0, 40.0), (23.2, 40.0)]
+    clusters = [cluster(1, 23.0, 40.0, 10), cluster(2, 23.1, 40.0, 10), cluster(3, 23.0, 40.0, 10)]
+
+    assert [c['id'] for c in rank_clusters(clusters, locations, 'max')] == [2, 1, 3]
+    # Ties keep the input order
+    assert [c['id'] for c in rank_clusters(clusters, locations, 'sum')] == [1, 3, 2]
+
+def test_score_divides_cost_by_popularity():
+    locations = [(23.0, 40.0), (23.2, 40.0)]
+    quiet, busy = cluster(1, 23.1, 40.0, 1), cluster(2, 23.1, 40.0, 100)
+    ranked = rank_clusters([quiet, busy], locations, 'max')
+
+    assert [c['id'] for c in ranked] == [2, 1]
+    assert ranked[1]['score'] == pytest.approx(ranked[0]['score'] * 10)
+    # A cluster without points is not divided by zero
+    assert rank_clusters([cluster(3, 23.1, 40.0, 0)], locations)[0]['score'] == pytest.approx(ranked[1]['score'])
+
+def test_top_rank_and_distances():
+    locations = [(23.0, 40.0), (23.2, 40.0), (23.1, 40.1)]
+    clusters = [cluster(i, 23.0 + 0.05 * i, 40.0, 10) for i in range(5)]
+    ranked = rank_clusters(clusters, locations, top=2)
+
+    assert [c['rank'] for c in ranked] == [1, 2]
+    assert all(len(c['distances']) == 3 for c in ranked)
+    assert ranked[0]['distances'][0] == round(haversine_m(
+        np.array([ranked[0]['longitude']]), np.array([40.0]), 23.0, 40.0)[0], 1)
+    # The input clusters are left as they were
+    assert 'score' not in clusters[0]
+
+def test_empty_and_unknown_method():
+    assert rank_clusters([], [(23.0, 40.0)]) == []
+    with pytest.raises(ValueError):
+        rank_clusters([cluster(1, 23.0, 40.0, 1)], [(23.0, 40.0)], 'min')
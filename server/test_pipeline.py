@@ -0,0 +1,44 @@
+"""Stage checkpoints of pipeline.py; needs NEAR_TEST_DSN, see conftest.py."""
+import pipeline
+from pipeline import Stage
+
+def city_checkpoints(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT city_id, status FROM pipeline_city_checkpoints ORDER BY city_id")
+    rows = cur.fetchall()
+    cur.close()
+    conn.rollback()
+    return rows
+
+def test_later_stages_keep_the_city_checkpoints(pg_connect, monkeypatch, tmp_path, capsys):
+    def cluster_cities(ctx):
+        ctx.checkpoint_city(1, 'completed', clusters=3)
+        ctx.checkpoint_city(2, 'failed', error='no points')
+
+    later_runs = []
+    def build_grid(ctx):
+        later_runs.append(ctx.stage)
+        if len(later_runs) == 1:
+            raise RuntimeError('interrupted')
+
+    monkeypatch.setattr(pipeline, 'STAGES', [
+        Stage('create_clusters', cluster_cities),
+        Stage('build_poi_grid', build_grid, deps=['create_clusters']),
+    ])
+    # run_pipeline closes the connection it is handed
+    monkeypatch.setattr(pipeline, 'connect_db', pg_connect)
+    # RunMetrics writes metrics/ to the working directory
+    monkeypatch.chdir(tmp_path)
+
+    assert not pipeline.run_pipeline(new_run=True)
+    assert city_checkpoints(pg_connect()) == [(1, 'completed'), (2, 'failed')]
+
+    # Resuming the run with the later stage forced reruns only that stage
+    assert pipeline.run_pipeline(force=['build_poi_grid'])
+    assert later_runs == ['build_poi_grid', 'build_poi_grid']
+    assert city_checkpoints(pg_connect()) == [(1, 'completed'), (2, 'failed')]
+
+    capsys.readouterr()
+    pipeline.print_status()
+    out = capsys.readouterr().out
+    assert "cities completed: 1" in out and "cities failed: 1" in out
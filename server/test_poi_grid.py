@@ -0,0 +1,121 @@
+from collections import Counter
+import numpy as np
+
+import pytest
+
+from poi_grid import aligned_bbox, apply_delta, cell_bounds, cell_deltas, cell_plan, cell_range, cell_size, create_table
+
+START_LEVEL, FINE_LEVEL = 8, 12
+
+def fine_counts(points, min_lon, min_lat, max_lon, max_lat):
+    """What PostgisSession.cell_counts reads: fine cells overlapping the bbox."""
+    x0, y0, x1, y1 = cell_range(FINE_LEVEL, min_lon, min_lat, max_lon, max_lat)
+    counts = Counter()
+    for lon, lat in points:
+        x, y, _, _ = cell_range(FINE_LEVEL, lon, lat, lon, lat)
+        if x0 <= x <= x1 and y0 <= y <= y1:
+            counts[(x, y)] += 1
+    return counts
+
+def points_in_cell(points, level, x, y):
+    min_lon, min_lat, max_lon, max_lat = cell_bounds(level, x, y)
+    return sum(1 for lon, lat in points if min_lon <= lon < max_lon and min_lat <= lat < max_lat)
+
+def test_aligned_bbox_covers_whole_cells():
+    bbox = (22.9, 40.6, 23.3, 40.7)
+    aligned = aligned_bbox(START_LEVEL, *bbox)
+    size = cell_size(START_LEVEL)
+    assert aligned[0] <= bbox[0] and aligned[1] <= bbox[1] and aligned[2] >= bbox[2] and aligned[3] >= bbox[3]
+    assert all(((edge + 180) / size).is_integer() for edge in aligned[::2])
+    assert all(((edge + 90) / size).is_integer() for edge in aligned[1::2])
+
+def test_dense_cluster_outside_bbox_edge_is_counted():
+    # The bbox is the middle of one start cell; a dense cluster sits just
+    # west of it, still inside that start cell
+    cell_min_lon, cell_min_lat, cell_max_lon, cell_max_lat = cell_bounds(START_LEVEL, 158, 100)
+    side = cell_max_lon - cell_min_lon
+    bbox = (cell_min_lon + side / 2, cell_min_lat + side / 4, cell_min_lon + side * 3 / 4, cell_min_lat + side * 3 / 4)
+
+    rng = np.random.default_rng(1)
+    inside = np.column_stack([rng.uniform(bbox[0], bbox[2], 50), rng.uniform(bbox[1], bbox[3], 50)])
+    cluster = np.column_stack([np.full(3000, bbox[0] - side / 100), rng.uniform(bbox[1], bbox[3], 3000)])
+    points = [tuple(point) for point in np.vstack([inside, cluster]).tolist()]
+    max_points = 500
+
+    counts = fine_counts(points, *aligned_bbox(START_LEVEL, *bbox))
+    plan = cell_plan(counts, FINE_LEVEL, START_LEVEL, max_points, *bbox)
+
+    for level, x, y, count in plan:
+        assert count == points_in_cell(points, level, x, y)
+        assert count <= max_points or level == FINE_LEVEL
+    # Only the cells along the edge hold the cluster
+    assert sum(count for *_, count in plan) < len(points)
+
+def test_plan_covers_bbox_without_overlap():
+    bbox = (22.9, 40.6, 23.0, 40.7)
+    rng = np.random.default_rng(2)
+    points = [tuple(point) for point in
+              np.column_stack([rng.normal(22.95, 0.01, 5000), rng.normal(40.65, 0.01, 5000)]).tolist()]
+
+    counts = fine_counts(points, *aligned_bbox(START_LEVEL, *bbox))
+    plan = cell_plan(counts, FINE_LEVEL, START_LEVEL, 200, *bbox)
+
+    covered = Counter()
+    for level, x, y, _ in plan:
+        shift = FINE_LEVEL - level
+        for fy in range(y << shift, (y + 1) << shift):
+            for fx in range(x << shift, (x + 1) << shift):
+                covered[(fx, fy)] += 1
+    x0, y0, x1, y1 = cell_range(FINE_LEVEL, *bbox)
+    assert all(covered[(x, y)] == 1 for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+    assert max(covered.values()) == 1
+
+def test_cell_deltas_of_a_move():
+    levels = [8, 16]
+    old, new = (22.9400, 40.6400), (22.9500, 40.6500)
+    deltas = cell_deltas(levels, [new], [old])
+
+    # Same level 8 cell: only the sums move; level 16 cells differ
+    (level_8,) = [delta for (level, _, _), delta in deltas.items() if level == 8]
+    assert level_8[0] == 0 and level_8[1] == pytest.approx(0.01) and level_8[2] == pytest.approx(0.01)
+    assert sorted(delta[0] for (level, _, _), delta in deltas.items() if level == 16) == [-1, 1]
+    # Adding and removing the same point changes nothing
+    assert cell_deltas(levels, [old], [old]) == {}
+
+def grid_rows(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT level, cell_x, cell_y, point_count, sum_lon, sum_lat FROM poi_grid")
+    rows = {(level, x, y): (count, sum_lon, sum_lat) for level, x, y, count, sum_lon, sum_lat in cur.fetchall()}
+    cur.close()
+    return rows
+
+def assert_grid_counts(conn, levels, points):
+    expected = cell_deltas(levels, points, [])
+    rows = grid_rows(conn)
+    assert rows.keys() == expected.keys()
+    for cell, (count, sum_lon, sum_lat) in expected.items():
+        assert rows[cell][0] == count
+        assert rows[cell][1:] == pytest.approx((sum_lon, sum_lat))
+
+def test_apply_delta_matches_a_rebuild(pg_connect):
+    conn = pg_connect()
+    create_table(conn)
+    levels = [8, 12, 16]
+    rng = np.random.default_rng(3)
+    points = [tuple(point) for point in
+              np.column_stack([rng.uniform(22.8, 23.1, 300), rng.uniform(40.5, 40.8, 300)]).tolist()]
+    apply_delta(conn, points, [], levels)
+    conn.commit()
+    assert_grid_counts(conn, levels, points)
+
+    # Delete a third, move a third
+    removed, moved, kept = points[:100], points[100:200], points[200:]
+    moved_to = [(lon + 0.05, lat - 0.05) for lon, lat in moved]
+    apply_delta(conn, moved_to, removed + moved, levels)
+    conn.commit()
+    assert_grid_counts(conn, levels, kept + moved_to)
+
+    # Emptied cells are deleted, not left at zero
+    apply_delta(conn, [], kept + moved_to, levels)
+    conn.commit()
+    assert grid_rows(conn) == {}
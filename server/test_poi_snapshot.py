@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from poi_snapshot import PoiSnapshot, hilbert_keys, write_snapshot
+
+def test_hilbert_keys_of_the_first_order_curve():
+    lons = np.array([0.0, 0.0, 1.0, 1.0])
+    lats = np.array([0.0, 1.0, 1.0, 0.0])
+    assert hilbert_keys(lons, lats, (0.0, 0.0, 1.0, 1.0), order=1).tolist() == [0, 1, 2, 3]
+
+def test_hilbert_curve_visits_every_cell_once_in_steps_of_one():
+    order = 4
+    n = 1 << order
+    x, y = np.meshgrid(np.arange(n), np.arange(n))
+    x, y = x.ravel(), y.ravel()
+    keys = hilbert_keys(x.astype(np.float64), y.astype(np.float64), (0.0, 0.0, n - 1.0, n - 1.0), order=order)
+
+    assert sorted(keys.tolist()) == list(range(n * n))
+    path = np.argsort(keys)
+    steps = np.abs(np.diff(x[path])) + np.abs(np.diff(y[path]))
+    assert steps.tolist() == [1] * (n * n - 1)
+
+def random_points(count, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = rng.permutation(count).astype(np.int64) + 1000
+    return ids, rng.uniform(22.8, 23.1, count), rng.uniform(40.5, 40.8, count)
+
+def test_snapshot_is_hilbert_sorted_with_tight_blocks(tmp_path):
+    ids, lons, lats = random_points(5000)
+    path = tmp_path / 'points.snap'
+    count, blocks = write_snapshot(path, ids, lons, lats, block_size=256)
+    snapshot = PoiSnapshot(path)
+
+    assert (count, blocks, len(snapshot)) == (5000, 20, 5000)
+    keys = hilbert_keys(snapshot.lons, snapshot.lats, snapshot.bbox)
+    assert np.all(np.diff(keys) >= 0)
+    # The same points, each with its own id
+    order = np.argsort(snapshot.ids)
+    assert np.array_equal(snapshot.ids[order], np.sort(ids))
+    by_id = dict(zip(ids.tolist(), zip(lons.tolist(), lats.tolist())))
+    assert all(by_id[i] == (lon, lat) for i, lon, lat in
+               zip(snapshot.ids.tolist(), snapshot.lons.tolist(), snapshot.lats.tolist()))
+
+    for block in snapshot.index:
+        start, end = int(block['start']), int(block['start'] + block['count'])
+        assert block['min_lon'] == snapshot.lons[start:end].min()
+        assert block['max_lat'] == snapshot.lats[start:end].max()
+
+def test_query_bbox_matches_a_scan(tmp_path):
+    ids, lons, lats = random_points(5000, seed=1)
+    path = tmp_path / 'points.snap'
+    write_snapshot(path, ids, lons, lats, block_size=128)
+    snapshot = PoiSnapshot(path)
+
+    for bbox in ((22.9, 40.6, 22.95, 40.65), (22.0, 40.0, 24.0, 41.0), (23.5, 41.5, 23.6, 41.6)):
+        found, found_lons, found_lats = snapshot.query_bbox(*bbox)
+        inside = (lons >= bbox[0]) & (lons <= bbox[2]) & (lats >= bbox[1]) & (lats <= bbox[3])
+        assert sorted(found.tolist()) == sorted(ids[inside].tolist())
+        assert np.all((found_lons >= bbox[0]) & (found_lats <= bbox[3]))
+
+def test_empty_snapshot(tmp_path):
+    path = tmp_path / 'empty.snap'
+    assert write_snapshot(path, [], [], []) == (0, 0)
+    assert len(PoiSnapshot(path).query_bbox(0, 0, 1, 1)[0]) == 0
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.snap'
+    path.write_bytes(b'\0' * 128)
+    with pytest.raises(ValueError):
+        PoiSnapshot(path)
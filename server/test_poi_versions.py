@@ -0,0 +1,94 @@
+"""The /api/sync watermark; needs NEAR_TEST_DSN, see conftest.py."""
+import threading
+import pytest
+
+import poi_versions
+from storage import PostgisSession
+
+@pytest.fixture
+def connect(pg_connect):
+    conn = pg_connect()
+    conn.cursor().execute("CREATE TABLE osm_points (id BIGINT PRIMARY KEY)")
+    conn.commit()
+    poi_versions.create_schema(conn)
+    return pg_connect
+
+def write(conn, ids):
+    """A versioned write, as apply_diff.apply_batch does it, left open."""
+    cur = conn.cursor()
+    poi_versions.lock_versions(cur)
+    cur.executemany("INSERT INTO osm_points (id, version) VALUES (%s, nextval('osm_points_version_seq'))",
+                    [(node_id,) for node_id in ids])
+    return cur
+
+def commit(conn, cur):
+    poi_versions.publish_versions(cur)
+    cur.close()
+    conn.commit()
+
+def sync(conn, since):
+    """(watermark, ids a sync from `since` is sent), as /api/sync reads them."""
+    version, _ = PostgisSession(conn).sync_state()
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM osm_points WHERE version > %s AND version <= %s ORDER BY version",
+                (since, version))
+    ids = [row[0] for row in cur.fetchall()]
+    cur.close()
+    conn.rollback()
+    return version, ids
+
+def test_nothing_written_is_version_zero(connect):
+    conn = connect()
+    assert sync(conn, 0) == (0, [])
+
+    writer = connect()
+    commit(writer, write(writer, [1]))
+    # The first change is version 1 and a client at 0 gets it
+    assert sync(conn, 0) == (1, [1])
+
+def test_publishing_without_changes_keeps_the_version(connect):
+    writer = connect()
+    commit(writer, write(writer, []))
+    assert sync(connect(), 0) == (0, [])
+
+def test_sync_waits_for_slow_writer(connect):
+    reader = connect()
+    slow = connect()
+    slow_cur = write(slow, [1, 2])
+
+    fast = connect()
+    fast_thread = threading.Thread(target=lambda: commit(fast, write(fast, [3])))
+    fast_thread.start()
+    fast_thread.join(timeout=0.5)
+    # The fast writer queues behind the slow one instead of committing a
+    # higher version while 1 and 2 are in flight
+    assert fast_thread.is_alive()
+    assert sync(reader, 0) == (0, [])
+
+    commit(slow, slow_cur)
+    fast_thread.join(timeout=5)
+    assert not fast_thread.is_alive()
+
+    version, ids = sync(reader, 0)
+    assert (version, ids) == (3, [1, 2, 3])
+    assert sync(reader, version) == (3, [])
+
+def test_sync_between_writes_misses_nothing(connect):
+    reader = connect()
+    writer = connect()
+    commit(writer, write(writer, [1]))
+    version, ids = sync(reader, 0)
+
+    cur = write(writer, [2])
+    # In flight: not sent yet, and not skipped later
+    assert sync(reader, version) == (version, [])
+    commit(writer, cur)
+    assert sync(reader, version) == (2, [2])
+
+def test_resync_prunes_everything_before(connect):
+    writer = connect()
+    commit(writer, write(writer, [1]))
+    version = poi_versions.require_resync(writer)
+
+    assert version == 2
+    assert PostgisSession(connect()).sync_state() == (2, 2)
@@ -0,0 +1,54 @@
+import pytest
+
+from run_metrics import RunMetrics, compare_runs, load_run, relative_change
+
+def run(stages=None, cities=None):
+    return {'stages': stages or {}, 'cities': cities or {}}
+
+def stage(seconds, rows_per_second=None):
+    return {'seconds': seconds, 'rows_per_second': rows_per_second}
+
+def city(name, seconds):
+    return {'name': name, 'seconds': seconds}
+
+def test_relative_change():
+    assert relative_change(2.0, 3.0) == 0.5
+    assert relative_change(2.0, 1.0) == -0.5
+    assert relative_change(0, 1.0) is None
+
+def test_slower_stage_regresses():
+    old = run({'import_pois': stage(10.0), 'create_clusters': stage(10.0)})
+    new = run({'import_pois': stage(13.0), 'create_clusters': stage(11.0)})
+    assert compare_runs(old, new) == [('stage', 'import_pois', 'seconds', 10.0, 13.0, pytest.approx(0.3))]
+
+def test_lower_row_rate_regresses_even_when_faster():
+    old = run({'import_pois': stage(10.0, rows_per_second=1000.0)})
+    new = run({'import_pois': stage(9.0, rows_per_second=500.0)})
+    assert compare_runs(old, new) == [('stage', 'import_pois', 'rows_per_second', 1000.0, 500.0, -0.5)]
+
+def test_short_timings_are_noise():
+    old = run({'import_cities': stage(0.1)}, {'1': city('Kalamaria', 0.1)})
+    new = run({'import_cities': stage(0.4)}, {'1': city('Kalamaria', 0.4)})
+    assert compare_runs(old, new) == []
+    assert len(compare_runs(old, new, min_seconds=0.2)) == 2
+
+def test_slower_city_regresses_and_new_ones_are_skipped():
+    old = run(cities={'1': city('Kalamaria', 2.0)})
+    new = run(cities={'1': city('Kalamaria', 3.0), '2': city('Pylaia', 60.0)})
+    assert compare_runs(old, new) == [('city', 'Kalamaria', 'seconds', 2.0, 3.0, 0.5)]
+    assert compare_runs(old, new, threshold=0.6) == []
+
+def test_saved_runs_compare(tmp_path):
+    metrics = RunMetrics('pipeline', params={'eps': 0.001}, directory=str(tmp_path))
+    with metrics.stage('import_cities') as stage_metrics:
+        stage_metrics.add_rows(3)
+        stage_metrics.extra['failed_cities'] = ['Pylaia']
+    metrics.record_city(1, 'Kalamaria', 1.5, 1000, 4, 900)
+    saved = load_run(metrics.save())
+
+    assert saved['params'] == {'eps': 0.001}
+    assert saved['stages']['import_cities']['rows'] == 3
+    assert saved['stages']['import_cities']['failed_cities'] == ['Pylaia']
+    # Peak memory is per run only, a stage would inherit the peaks before it
+    assert 'peak_memory_mb' not in saved['stages']['import_cities'] and saved['peak_memory_mb'] > 0
+    assert compare_runs(saved, saved) == []
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from weighted_kmeans import weighted_kmeans
+
+BLOB_CENTERS = np.array([[22.90, 40.60], [22.95, 40.65], [23.00, 40.60]])
+
+def blobs(rng, per_blob=200, spread=0.003):
+    points = np.vstack([center + rng.normal(0, spread, (per_blob, 2)) for center in BLOB_CENTERS])
+    weights = rng.integers(1, 20, len(points)).astype(np.float64)
+    return points, weights
+
+def sorted_rows(centers):
+    return centers[np.lexsort(centers.T[::-1])]
+
+def test_weights_act_like_repeated_points():
+    rng = np.random.default_rng(0)
+    points, weights = blobs(rng)
+    centers, labels, inertia = weighted_kmeans(points, weights, 3)
+
+    repeated = np.repeat(points, weights.astype(int), axis=0)
+    repeated_centers, _, repeated_inertia = weighted_kmeans(repeated, np.ones(len(repeated)), 3)
+    assert sorted_rows(centers) == pytest.approx(sorted_rows(repeated_centers))
+    assert inertia == pytest.approx(repeated_inertia)
+
+    # Each center is the weighted mean of its points
+    for label, center in enumerate(centers):
+        members = labels == label
+        assert center == pytest.approx(np.average(points[members], axis=0, weights=weights[members]))
+
+def test_finds_separated_blobs():
+    points, weights = blobs(np.random.default_rng(1))
+    centers, labels, _ = weighted_kmeans(points, weights, 3)
+    assert sorted_rows(centers) == pytest.approx(sorted_rows(BLOB_CENTERS), abs=0.002)
+    assert sorted(np.bincount(labels).tolist()) == [200, 200, 200]
+
+def test_minibatch_agrees_with_full_runs():
+    points, weights = blobs(np.random.default_rng(2), per_blob=2000)
+    full, full_labels, full_inertia = weighted_kmeans(points, weights, 3)
+    batched, batched_labels, batched_inertia = weighted_kmeans(points, weights, 3, batch_size=256)
+    assert sorted_rows(batched) == pytest.approx(sorted_rows(full), abs=1e-4)
+    assert batched_inertia == pytest.approx(full_inertia, rel=1e-3)
+
+def test_more_clusters_than_distinct_points():
+    points = np.array([[23.0, 40.0], [23.0, 40.0], [23.1, 40.1]])
+    centers, labels, inertia = weighted_kmeans(points, [1, 1, 1], 5)
+    assert len(centers) == 3
+    assert inertia == 0
+    assert labels[0] == labels[1] != labels[2]
+
+def test_same_seed_same_result():
+    points, weights = blobs(np.random.default_rng(3))
+    first = weighted_kmeans(points, weights, 4, seed=7)
+    second = weighted_kmeans(points, weights, 4, seed=7)
+    assert np.array_equal(first[0], second[0]) and np.array_equal(first[1], second[1])
@@ -0,0 +1,89 @@
+"""Weighted k-means over aggregated points.
+
+Used by /api/kmeans to cluster poi_grid cells instead of raw POIs: every
+cell is one point at its centroid, weighted by its POI count, so the work
+depends on the number of cells and not on the number of POIs. Distances
+are planar in degrees, like ST_ClusterKMeans on 4326 geometries.
+
+Weighted Lloyd iterations minimise the same objective as k-means on the
+underlying points with each point moved to its cell centroid, at most one
+cell diagonal away. The resulting clusters therefore match the ones from
+the raw points up to the grid resolution; see KMEANS_CELLS_PER_SIDE in
+api_v1.py.
+"""
+import numpy as np
+
+def _sq_distances(points, centers):
+    return ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+
+def kmeans_plusplus(points, weights, k, rng):
+    """k-means++ seeding, with each point's chance scaled by its weight."""
+    centers = np.empty((k, points.shape[1]))
+    centers[0] = points[rng.choice(len(points), p=weights / weights.sum())]
+    closest = ((points - centers[0]) ** 2).sum(axis=1)
+    for i in range(1, k):
+        scores = closest * weights
+        total = scores.sum()
+        if total <= 0:
+            # Fewer distinct points than clusters: reuse existing ones
+            centers[i:] = centers[0]
+            break
+        centers[i] = points[rng.choice(len(points), p=scores / total)]
+        closest = np.minimum(closest, ((points - centers[i]) ** 2).sum(axis=1))
+    return centers
+
+def _lloyd(points, weights, centers, max_iter, tol):
+    for _ in range(max_iter):
+        labels = _sq_distances(points, centers).argmin(axis=1)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, points * weights[:, None])
+        mass = np.bincount(labels, weights=weights, minlength=len(centers))
+        moved = mass > 0
+        new_centers = centers.copy()
+        new_centers[moved] = sums[moved] / mass[moved, None]
+        shift = ((new_centers - centers) ** 2).sum()
+        centers = new_centers
+        if shift <= tol:
+            break
+    labels = _sq_distances(points, centers).argmin(axis=1)
+    return centers, labels
+
+def _minibatch(points, weights, centers, batch_size, iterations, rng):
+    """Mini-batch updates (Sculley 2010), sampling points in proportion to their weight."""
+    probabilities = weights / weights.sum()
+    counts = np.zeros(len(centers))
+    for _ in range(iterations):
+        batch = points[rng.choice(len(points), size=batch_size, p=probabilities)]
+        nearest = _sq_distances(batch, centers).argmin(axis=1)
+        batch_counts = np.bincount(nearest, minlength=len(centers))
+        sums = np.zeros_like(centers)
+        np.add.at(sums, nearest, batch)
+        counts += batch_counts
+        hit = batch_counts > 0
+        # Per-center learning rate 1 / (points seen so far)
+        centers[hit] += (sums[hit] - batch_counts[hit, None] * centers[hit]) / counts[hit, None]
+    return centers
+
+def weighted_kmeans(points, weights, k, n_init=3, max_iter=100, tol=1e-14,
+                    batch_size=None, batch_iterations=50, seed=0):
+    """Cluster weighted points; returns (centers, labels, inertia) of the best of n_init runs.
+
+    With batch_size set and more points than that, each run is first moved
+    with mini-batch updates and then polished with a few full iterations.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    k = min(k, len(points))
+    rng = np.random.default_rng(seed)
+    best = None
+    for _ in range(n_init):
+        centers = kmeans_plusplus(points, weights, k, rng)
+        iterations = max_iter
+        if batch_size and len(points) > batch_size:
+            centers = _minibatch(points, weights, centers, batch_size, batch_iterations, rng)
+            iterations = min(max_iter, 5)
+        centers, labels = _lloyd(points, weights, centers, iterations, tol)
+        inertia = float((((points - centers[labels]) ** 2).sum(axis=1) * weights).sum())
+        if best is None or inertia < best[2]:
+            best = (centers, labels, inertia)
+    return best